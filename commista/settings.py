@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/4.1/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
+import os
 from datetime import timedelta
 from pathlib import Path
 
@@ -63,7 +64,7 @@ INSTALLED_APPS = DJANGO_APPS + LOCAL_APPS + THIRD_PARTY_APPS
 REST_FRAMEWORK = {
     'EXCEPTION_HANDLER': 'core.exceptions.custom_exception_handler',
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "core.authentication.ClaimsJWTAuthentication",
     ),
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -75,6 +76,18 @@ REST_FRAMEWORK = {
     "PAGE_SIZE": 30,
     "DEFAULT_PERMISSION_CLASSES": ("rest_framework.permissions.AllowAny",),
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
+    # Token buckets of core.throttling: "<scope>_ip" per client address, "<scope>_email" per account
+    "DEFAULT_THROTTLE_RATES": {
+        "login_ip": "30/min",
+        "login_email": "10/min",
+        "register_ip": "20/hour",
+        "register_email": "5/hour",
+        "otp_ip": "20/hour",
+        "otp_email": "5/hour",
+        "otp_check_ip": "30/hour",
+        "otp_check_email": "10/hour",
+        "otp_check_user": "10/hour",
+    },
 }
 
 SPECTACULAR_SETTINGS = {
@@ -90,11 +103,49 @@ INTERNAL_IPS = [
 ]
 
 SIMPLE_JWT = {
-    "ACCESS_TOKEN_LIFETIME": timedelta(days=5),
+    # Requests are authenticated from the token's claims, so this bounds how long a revocation that
+    # didn't reach the cache (evicted, flushed) leaves an old token working
+    "ACCESS_TOKEN_LIFETIME": timedelta(minutes=config("ACCESS_TOKEN_LIFETIME_MINUTES", default=15, cast=int)),
+    "UPDATE_LAST_LOGIN": True,
 }
 
+# Seconds User.last_login updates are collected in memory before they are written together
+LAST_LOGIN_FLUSH_INTERVAL = config("LAST_LOGIN_FLUSH_INTERVAL", default=60, cast=int)
+
 AUTH_USER_MODEL = "core.User"
 
+# Anything that keeps state in the cache across requests (e.g. the cache cart backend) needs a cache
+# shared by every process, e.g. django.core.cache.backends.redis.RedisCache with a redis:// location
+CACHES = {
+    "default": {
+        "BACKEND": config("CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("CACHE_LOCATION", default=""),
+    }
+}
+
+# Requests under these paths sent with an Idempotency-Key header are answered once and replayed on retry.
+# Retries arriving while the first request still runs are only held off through a shared cache
+IDEMPOTENCY_KEY_PATHS = ("/store/",)
+
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24
+
+# STORE
+# Use "store.cart_storage.CacheCartStorage" to keep carts in the cache until checkout; it refuses to
+# start on a per-process cache unless CART_CACHE_ALLOW_LOCAL is set (fine for a single dev server)
+CART_STORAGE_BACKEND = config("CART_STORAGE_BACKEND", default="store.cart_storage.DatabaseCartStorage")
+
+CART_CACHE_ALLOW_LOCAL = config("CART_CACHE_ALLOW_LOCAL", default=False, cast=bool)
+
+CART_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+# Seconds a product snapshot used to validate and price cart lines is kept in the cache
+CART_PRODUCT_CACHE_TIMEOUT = 60 * 5
+
+CART_WRITE_BEHIND_INTERVAL = config("CART_WRITE_BEHIND_INTERVAL", default=300, cast=int)
+
+# Seconds stock stays reserved for a checkout before it is released again
+INVENTORY_RESERVATION_TTL = 15 * 60
+
 CORS_ALLOW_ALL_ORIGINS = True
 
 MIDDLEWARE = [
@@ -108,6 +159,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "common.middleware.IdempotencyKeyMiddleware",
 ]
 
 ROOT_URLCONF = "commista.urls"
@@ -136,10 +188,17 @@ WSGI_APPLICATION = "commista.wsgi.application"
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": "commista.sqlite"
+        "NAME": "commista.sqlite",
+        # A file rather than SQLite's shared in-memory database, whose table locks fail concurrent writers
+        # at once instead of waiting, so the concurrency tests run against the real locking
+        "TEST": {"NAME": BASE_DIR / "test_commista.sqlite"},
     }
 }
 
+# Above this many rows, per the database's table statistics, unfiltered admin changelists show an estimate
+# rather than counting the table
+ADMIN_EXACT_COUNT_LIMIT = config("ADMIN_EXACT_COUNT_LIMIT", default=10000, cast=int)
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -158,6 +217,9 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Processes the async auth views hash passwords in
+PASSWORD_HASH_WORKERS = config("PASSWORD_HASH_WORKERS", default=os.cpu_count() or 1, cast=int)
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.1/topics/i18n/
 
@@ -209,6 +271,20 @@ EMAIL_PORT = 465
 
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
+# Background senders sharing SMTP connections, and how many emails may wait for them
+EMAIL_WORKERS = config("EMAIL_WORKERS", default=2, cast=int)
+
+EMAIL_QUEUE_SIZE = config("EMAIL_QUEUE_SIZE", default=1000, cast=int)
+
+# "pool" sends from the web process; "jobs" queues emails in the database for the run_workers command
+EMAIL_DELIVERY = config("EMAIL_DELIVERY", default="pool")
+
+# "database" keeps one-time codes in the Otp table; "signed" derives them with an HMAC and stores nothing
+OTP_MODE = config("OTP_MODE", default="database")
+
+# Certificates Google signs its ID tokens with
+GOOGLE_CERTS_URL = config("GOOGLE_CERTS_URL", default="https://www.googleapis.com/oauth2/v1/certs")
+
 # JAZZMIN
 JAZZMIN_UI_TWEAKS = {
     "theme": "minty",
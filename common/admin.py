@@ -1,3 +1,20 @@
 from django.contrib import admin
 
+from common.models import IdempotencyKey, Job
+
+
 # Register your models here.
+
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ("key", "status_code", "expires_at",)
+    search_fields = ("key",)
+    exclude = ("content",)
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("name", "status", "priority", "attempts", "run_at", "claimed_by",)
+    list_filter = ("status", "name",)
+    ordering = ("-priority", "run_at",)
@@ -0,0 +1,12 @@
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def cache_is_shared(alias="default"):
+    """
+    Whether every process sees the same cache. LocMemCache keeps a copy per process and DummyCache keeps
+    nothing, so whatever other processes have to notice, like a revocation or a new index version, can't
+    be left to them alone.
+    """
+    return not isinstance(caches[alias], (LocMemCache, DummyCache))
@@ -0,0 +1,9 @@
+JOB_QUEUED = "Q"
+JOB_RUNNING = "R"
+JOB_DEAD = "D"
+
+JOB_STATUS_CHOICES = (
+    (JOB_QUEUED, "Queued"),
+    (JOB_RUNNING, "Running"),
+    (JOB_DEAD, "Dead"),
+)
@@ -0,0 +1,115 @@
+import logging
+import traceback
+from uuid import uuid4
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from common.choices import JOB_DEAD, JOB_QUEUED, JOB_RUNNING
+from common.models import Job
+
+logger = logging.getLogger(__name__)
+
+# Handlers by job name, filled by ``register`` as each app's ``jobs`` module is imported
+handlers = {}
+
+
+def register(name):
+    """
+    Decorator making a function runnable as the job ``name``; it's called with the job's payload as keyword
+    arguments. Handlers may run more than once for the same job, after a failure or a lost worker.
+    """
+    def decorator(func):
+        handlers[name] = func
+        return func
+    return decorator
+
+
+def enqueue(name, priority=0, run_at=None, max_attempts=5, **payload):
+    """
+    Queue the job ``name`` with a JSON serializable payload. Inside a transaction the job is only seen by the
+    workers once it commits, so it never runs against data that was rolled back.
+    """
+    return Job.objects.create(name=name, payload=payload, priority=priority, run_at=run_at or timezone.now(),
+                              max_attempts=max_attempts)
+
+
+def _due(now):
+    # Queued jobs whose time has come, and running jobs whose lease ran out before the worker got to them
+    return Q(status=JOB_QUEUED, run_at__lte=now) | Q(status=JOB_RUNNING, lease_expires_at__lt=now)
+
+
+def claim(worker, batch_size=10, lease=timezone.timedelta(minutes=5)):
+    """
+    Claim up to ``batch_size`` due jobs for ``worker``, highest priority first, and return them.
+
+    Candidates are locked with ``SKIP LOCKED`` where the database supports it, so concurrent workers pick
+    different jobs. Either way the claim is an UPDATE that checks the job is still due, so a job lost to
+    another worker is simply left out. A worker that dies loses its jobs to others once the lease runs out.
+    """
+    now = timezone.now()
+    token = f"{worker}:{uuid4().hex}"
+    with transaction.atomic():
+        candidates = Job.objects.filter(_due(now)).order_by("-priority", "run_at", "id")
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = candidates.select_for_update(skip_locked=True)
+        ids = list(candidates.values_list("id", flat=True)[:batch_size])
+        Job.objects.filter(_due(now), id__in=ids).update(status=JOB_RUNNING, claimed_by=token,
+                                                         lease_expires_at=now + lease, attempts=F("attempts") + 1)
+    return list(Job.objects.filter(claimed_by=token, status=JOB_RUNNING).order_by("-priority", "run_at", "id"))
+
+
+def retry_delay(attempts):
+    return timezone.timedelta(seconds=min(10 * 2 ** (attempts - 1), 60 * 60))
+
+
+def run(job):
+    """
+    Run a claimed job. It's deleted once it succeeds; a failure queues it again after an exponential delay,
+    or marks it dead when it's out of attempts or has no handler. Returns whether the job succeeded.
+    """
+    handler = handlers.get(job.name)
+    try:
+        if handler is None:
+            raise LookupError(f"No handler registered for job {job.name!r}")
+        handler(**job.payload)
+    except Exception:
+        logger.exception("Job %s failed (attempt %s of %s)", job, job.attempts, job.max_attempts)
+        job.last_error = traceback.format_exc()
+        if handler is None or job.attempts >= job.max_attempts:
+            job.status = JOB_DEAD
+        else:
+            job.status = JOB_QUEUED
+            job.run_at = timezone.now() + retry_delay(job.attempts)
+        # Matching the claim leaves the job alone if it was given to another worker in the meantime
+        Job.objects.filter(pk=job.pk, claimed_by=job.claimed_by).update(
+                status=job.status, run_at=job.run_at, claimed_by="", lease_expires_at=None, last_error=job.last_error)
+        return False
+    Job.objects.filter(pk=job.pk, claimed_by=job.claimed_by).delete()
+    return True
+
+
+def renew(jobs, lease=timezone.timedelta(minutes=5)):
+    """
+    Extend the leases of claimed jobs from now. Returns how many are still the worker's; a job whose lease
+    ran out and was claimed by another worker is left alone.
+    """
+    return Job.objects.filter(pk__in=[job.pk for job in jobs], claimed_by__in={job.claimed_by for job in jobs},
+                              status=JOB_RUNNING).update(lease_expires_at=timezone.now() + lease)
+
+
+def work(worker, batch_size=10, lease=timezone.timedelta(minutes=5)):
+    """
+    Claim and run one batch of jobs. Returns the number of jobs claimed, zero when nothing was due.
+
+    Before each job runs, the leases of it and of the jobs still waiting are renewed, so no job's lease runs
+    out while earlier ones take their time. A job claimed by another worker in the meantime is skipped; a
+    single job running for longer than ``lease`` can still be claimed and run a second time.
+    """
+    jobs = claim(worker, batch_size=batch_size, lease=lease)
+    for index, job in enumerate(jobs):
+        renew(jobs[index + 1:], lease)
+        if renew([job], lease):
+            run(job)
+    return len(jobs)
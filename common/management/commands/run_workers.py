@@ -0,0 +1,40 @@
+import os
+import signal
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from common.jobs import work
+
+
+class Command(BaseCommand):
+    help = "Run queued jobs until stopped; start as many workers as needed, on as many machines as needed"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10, help="Jobs claimed at a time")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds to wait when no job is due")
+        parser.add_argument("--once", action="store_true", help="Exit once no job is due")
+        parser.add_argument("--name", default=f"{socket.gethostname()}:{os.getpid()}", help="Worker name")
+
+    def handle(self, *args, **options):
+        # Finish the batch at hand before stopping
+        stopping = []
+        previous = {signum: signal.signal(signum, lambda *_: stopping.append(True))
+                    for signum in (signal.SIGINT, signal.SIGTERM)}
+
+        ran = 0
+        try:
+            while not stopping:
+                close_old_connections()
+                claimed = work(options["name"], batch_size=options["batch_size"])
+                ran += claimed
+                if not claimed:
+                    if options["once"]:
+                        break
+                    time.sleep(options["poll_interval"])
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS(f"Ran {ran} jobs"))
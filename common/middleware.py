@@ -0,0 +1,122 @@
+import hashlib
+import tempfile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from common.models import IdempotencyKey
+
+IDEMPOTENT_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+
+def _hash(*parts):
+    return hashlib.sha256(b"\0".join(parts)).hexdigest()
+
+
+def _fingerprint(request):
+    """
+    ``_hash`` of the method, path and body. Bodies larger than ``DATA_UPLOAD_MAX_MEMORY_SIZE``, which
+    ``request.body`` refuses to load (e.g. review images), are hashed in chunks as they're copied to a
+    temporary file, which the view then reads the request from.
+    """
+    digest = hashlib.sha256(b"\0".join((request.method.encode(), request.path.encode(), b"")))
+    try:
+        length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        length = 0
+    limit = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+    if limit is None or length <= limit:
+        digest.update(request.body)
+        return digest.hexdigest()
+
+    spooled = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    for chunk in iter(lambda: request.read(64 * 1024), b""):
+        digest.update(chunk)
+        spooled.write(chunk)
+    spooled.seek(0)
+    request._stream, request._read_started = spooled, False
+    return digest.hexdigest()
+
+
+class IdempotencyKeyMiddleware:
+    """
+    Replays the stored response when a mutating request is retried with the same ``Idempotency-Key`` header,
+    so a retry never runs the write twice.
+
+    Keys are scoped to the caller's ``Authorization`` header and only cover ``IDEMPOTENCY_KEY_PATHS``.
+    A retry is answered from the cache, falling back to the ``IdempotencyKey`` table for entries the cache
+    has dropped. Reusing a key for a different request is rejected with 422, and a retry that arrives while
+    the first request is still running gets a 409. That in-progress mark only lives in the cache, so with
+    more than one process it needs a cache they share: on a per-process one, a retry reaching another
+    process while the first request runs is executed again.
+    """
+    in_progress = "in-progress"
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.ttl = getattr(settings, "IDEMPOTENCY_KEY_TTL", 60 * 60 * 24)
+        self.paths = tuple(getattr(settings, "IDEMPOTENCY_KEY_PATHS", ("/",)))
+
+    def __call__(self, request):
+        key = request.headers.get("Idempotency-Key")
+        if not key or request.method not in IDEMPOTENT_METHODS or not request.path.startswith(self.paths):
+            return self.get_response(request)
+        if len(key) > 255:
+            return JsonResponse({"message": "Idempotency-Key is too long.", "status": "failed"}, status=400)
+
+        owner = _hash(request.headers.get("Authorization", "").encode())
+        fingerprint = _fingerprint(request)
+        cache_key = f"idempotency:{owner}:{_hash(key.encode())}"
+
+        stored = cache.get(cache_key) or self._from_database(owner, key, cache_key)
+        if stored is None and not cache.add(cache_key, (fingerprint, self.in_progress), 60):
+            stored = cache.get(cache_key)
+        if stored is not None:
+            return self._replay(stored, fingerprint)
+
+        try:
+            response = self.get_response(request)
+        except Exception:
+            cache.delete(cache_key)
+            raise
+        if response.status_code >= 500 or response.streaming:
+            # Let the client try again rather than replaying a failure
+            cache.delete(cache_key)
+            return response
+        self._store(owner, key, cache_key, fingerprint, response)
+        return response
+
+    def _from_database(self, owner, key, cache_key):
+        record = IdempotencyKey.objects.filter(owner=owner, key=key, expires_at__gt=timezone.now()).first()
+        if record is None:
+            return None
+        stored = (record.fingerprint, (record.status_code, record.content_type, bytes(record.content)))
+        cache.set(cache_key, stored, max((record.expires_at - timezone.now()).total_seconds(), 1))
+        return stored
+
+    def _replay(self, stored, fingerprint):
+        stored_fingerprint, result = stored
+        if stored_fingerprint != fingerprint:
+            return JsonResponse({"message": "Idempotency-Key was already used for a different request.",
+                                 "status": "failed"}, status=422)
+        if result == self.in_progress:
+            return JsonResponse({"message": "A request with this Idempotency-Key is still being processed.",
+                                 "status": "failed"}, status=409)
+        status_code, content_type, content = result
+        response = HttpResponse(content, status=status_code, content_type=content_type)
+        response["Idempotent-Replayed"] = "true"
+        return response
+
+    def _store(self, owner, key, cache_key, fingerprint, response):
+        result = (response.status_code, response.get("Content-Type", ""), response.content)
+        try:
+            IdempotencyKey.objects.update_or_create(owner=owner, key=key, defaults={
+                "fingerprint": fingerprint, "status_code": result[0], "content_type": result[1],
+                "content": result[2], "expires_at": timezone.now() + timezone.timedelta(seconds=self.ttl),
+            })
+        except IntegrityError:
+            pass
+        cache.set(cache_key, (fingerprint, result), self.ttl)
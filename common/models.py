@@ -1,6 +1,9 @@
 from uuid import uuid4
 
 from django.db import models
+from django.utils import timezone
+
+from common.choices import JOB_QUEUED, JOB_STATUS_CHOICES
 
 
 # Create your models here.
@@ -13,3 +16,47 @@ class BaseModel(models.Model):
 
     class Meta:
         abstract = True
+
+
+class IdempotencyKey(models.Model):
+    """
+    Response stored for a request sent with an ``Idempotency-Key`` header, replayed when the request is retried.
+    ``owner`` and ``fingerprint`` are hashes, so a row stays small whatever the request looked like.
+    """
+    owner = models.CharField(max_length=64)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField()
+    content_type = models.CharField(max_length=100)
+    content = models.BinaryField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["owner", "key"], name="idempotency_owner_key_unique")]
+
+    def __str__(self):
+        return self.key
+
+
+class Job(models.Model):
+    """
+    Work queued for the ``run_workers`` command: the registered handler ``name`` is called with ``payload``
+    as keyword arguments. Finished jobs are deleted; jobs out of attempts stay behind as dead.
+    """
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(choices=JOB_STATUS_CHOICES, max_length=1, default=JOB_QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=100, blank=True)
+    lease_expires_at = models.DateTimeField(null=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "priority", "run_at"], name="job_claim_idx")]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk}"
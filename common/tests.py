@@ -1,3 +1,168 @@
-from django.test import TestCase
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from common import jobs
+from common.choices import JOB_DEAD, JOB_QUEUED
+from common.models import IdempotencyKey, Job
+from core.emails import Util
+from store.models import CartItem, Category, Product
+
+
+class IdempotencyKeyMiddlewareTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        user = get_user_model().objects.create_user(email="retry@example.com", full_name="Jane Doe", password="string")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}")
+        category = Category.objects.create(title="Jackets")
+        self.product = Product.objects.create(title="Denim Jacket", category=category, description="description",
+                                              style="casual", price="100.00", inventory=10)
+
+    def add_to_cart(self, key, quantity=1):
+        return self.client.post(reverse("cart"), {"product_id": str(self.product.id), "quantity": quantity},
+                                format="json", HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_is_replayed_from_the_cache(self):
+        first = self.add_to_cart("add-1")
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        with self.assertNumQueries(0):
+            retry = self.add_to_cart("add-1")
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(CartItem.objects.get().quantity, 1)
+
+    def test_retry_is_replayed_from_the_database_once_the_cache_forgets(self):
+        self.add_to_cart("add-1")
+        cache.clear()
+        retry = self.add_to_cart("add-1")
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(CartItem.objects.get().quantity, 1)
+
+    def test_key_reused_for_another_request_is_rejected(self):
+        self.add_to_cart("add-1")
+        response = self.add_to_cart("add-1", quantity=2)
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=1024)
+    def test_uploads_larger_than_the_body_limit_are_fingerprinted(self):
+        def upload(key, content):
+            return self.client.post(reverse("cart"), {"product_id": str(self.product.id), "quantity": 1,
+                                                      "attachment": SimpleUploadedFile("photo.jpg", content)},
+                                    format="multipart", HTTP_IDEMPOTENCY_KEY=key)
+
+        first = upload("upload-1", b"x" * 4096)
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        retry = upload("upload-1", b"x" * 4096)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(CartItem.objects.get().quantity, 1)
+        response = upload("upload-1", b"y" * 4096)
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_requests_without_a_key_run_every_time(self):
+        self.add_to_cart("")
+        self.add_to_cart("")
+        self.assertEqual(CartItem.objects.count(), 2)
+
+    def test_purge_deletes_expired_keys(self):
+        self.add_to_cart("add-1")
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        call_command("purge_idempotency_keys", stdout=StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.calls = []
+        patcher = mock.patch.dict(jobs.handlers, {"test.record": lambda **payload: self.calls.append(payload)})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_jobs_run_by_priority_and_are_deleted(self):
+        jobs.enqueue("test.record", value="low")
+        jobs.enqueue("test.record", priority=5, value="high")
+        jobs.enqueue("test.record", run_at=timezone.now() + timezone.timedelta(hours=1), value="later")
+
+        self.assertEqual(jobs.work("worker"), 2)
+        self.assertEqual(self.calls, [{"value": "high"}, {"value": "low"}])
+        self.assertEqual(list(Job.objects.values_list("payload", flat=True)), [{"value": "later"}])
+
+    def test_claimed_jobs_are_not_claimed_again_until_the_lease_runs_out(self):
+        jobs.enqueue("test.record")
+        self.assertEqual(len(jobs.claim("first")), 1)
+        self.assertEqual(jobs.claim("second"), [])
+        with mock.patch("common.jobs.timezone.now", return_value=timezone.now() + timezone.timedelta(minutes=10)):
+            self.assertEqual(len(jobs.claim("second")), 1)
+
+    def test_jobs_waiting_in_a_batch_keep_their_lease(self):
+        for value in ("a", "b", "c"):
+            jobs.enqueue("test.record", value=value)
+        clock = [timezone.now()]
+        taken = []
+
+        def record(**payload):
+            self.calls.append(payload)
+            # Each job takes three of the lease's five minutes, so the batch outlives the lease it was claimed with
+            clock[0] += timezone.timedelta(minutes=3)
+            taken.extend(jobs.claim("other"))
+
+        jobs.handlers["test.record"] = record
+        with mock.patch("common.jobs.timezone.now", side_effect=lambda: clock[0]):
+            self.assertEqual(jobs.work("worker"), 3)
+        self.assertEqual(self.calls, [{"value": "a"}, {"value": "b"}, {"value": "c"}])
+        self.assertEqual(taken, [])
+
+    def test_jobs_claimed_by_another_worker_are_skipped(self):
+        jobs.enqueue("test.record", priority=1, value="first")
+        jobs.enqueue("test.record", value="second")
+
+        def record(**payload):
+            self.calls.append(payload)
+            Job.objects.filter(payload={"value": "second"}).update(claimed_by="other:token")
+
+        jobs.handlers["test.record"] = record
+        jobs.work("worker")
+        self.assertEqual(self.calls, [{"value": "first"}])
+
+    def test_failing_jobs_are_retried_then_dead(self):
+        job = jobs.enqueue("test.missing", max_attempts=3)
+        jobs.work("worker")
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (JOB_DEAD, 1))
+
+        job = jobs.enqueue("test.record", max_attempts=2, unexpected=True)
+        jobs.handlers["test.record"] = mock.Mock(side_effect=ValueError)
+        jobs.work("worker")
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (JOB_QUEUED, 1))
+        self.assertIn("ValueError", job.last_error)
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        jobs.work("worker")
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (JOB_DEAD, 2))
+
+    @override_settings(EMAIL_DELIVERY="jobs")
+    def test_emails_can_be_sent_by_the_workers(self):
+        user = get_user_model().objects.create_user(email="queued@example.com", full_name="Jane Doe",
+                                                    password="string")
+        mail.outbox = []
+        Util.email_activation(user)
+        self.assertEqual(mail.outbox, [])
+
+        # Closing the connection would end the test's transaction, as the test client avoids for requests
+        with mock.patch("common.management.commands.run_workers.close_old_connections"):
+            call_command("run_workers", "--once", stdout=StringIO())
+        self.assertEqual([message.to for message in mail.outbox], [[user.email]])
+        self.assertFalse(Job.objects.exists())
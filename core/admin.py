@@ -16,6 +16,7 @@ class CustomUserAdmin(UserAdmin):
         "is_active",
         "is_verified",
         "email_changed",
+        "auth_provider",
     )
     list_filter = (
         "email",
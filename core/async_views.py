@@ -0,0 +1,146 @@
+import functools
+import json
+import math
+
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError
+from django.http import HttpResponseNotAllowed, JsonResponse
+from rest_framework import status
+from rest_framework.exceptions import APIException, Throttled
+from rest_framework_simplejwt.settings import api_settings
+
+from core import otp as otp_store
+from core.authentication import ClaimsJWTAuthentication, token_pair
+from core.buffers import record_login
+from core.choices import OTP_PASSWORD_CHANGE
+from core.emails import Util
+from core.hashing import acheck_password, amake_password
+from core.models import User
+from core.serializers import ChangePasswordSerializer, LoginSerializer, RegisterSerializer
+from core.throttling import UserTokenBucketThrottle
+
+# Async versions of the login, register and change password views. Served through the ASGI app in
+# commista/asgi.py, they wait on password hashing in the process pool of core.hashing instead of
+# holding a worker, so login throughput follows the number of cores rather than of web workers.
+# They answer like their counterparts in core.views.
+
+
+def _post_only(view):
+    # csrf_exempt and require_POST only wrap sync views in this Django version
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != "POST":
+            return HttpResponseNotAllowed(["POST"])
+        return await view(request, *args, **kwargs)
+    # Like the DRF views, these authenticate with tokens rather than session cookies
+    wrapper.csrf_exempt = True
+    return wrapper
+
+
+def _failed(message, status_code):
+    return JsonResponse({"message": message, "status": "failed"}, status=status_code)
+
+
+def _throttled(wait):
+    # What DRF answers a throttled request with
+    exception = Throttled(wait)
+    response = JsonResponse({"detail": exception.detail}, status=exception.status_code)
+    response["Retry-After"] = f"{math.ceil(wait)}"
+    return response
+
+
+def _validated(serializer_class, request):
+    if request.content_type == "application/json":
+        try:
+            data = json.loads(request.body or b"{}")
+        except ValueError:
+            return None, _failed("Invalid JSON", status.HTTP_400_BAD_REQUEST)
+    else:
+        data = request.POST
+    serializer = serializer_class(data=data)
+    if not serializer.is_valid():
+        errors = dict(serializer.errors)
+        if "non_field_errors" in errors:
+            errors["error"] = errors.pop("non_field_errors")
+        return None, JsonResponse(errors, status=status.HTTP_400_BAD_REQUEST)
+    return serializer.validated_data, None
+
+
+async def _authenticated_user(request):
+    try:
+        result = await sync_to_async(ClaimsJWTAuthentication().authenticate)(request)
+    except APIException as exc:
+        return None, JsonResponse({"detail": exc.detail}, status=exc.status_code)
+    if result is None:
+        return None, JsonResponse({"detail": "Authentication credentials were not provided."},
+                                  status=status.HTTP_401_UNAUTHORIZED)
+    return result[0], None
+
+
+@_post_only
+async def login(request):
+    data, error = _validated(LoginSerializer, request)
+    if error:
+        return error
+    user = await User.objects.filter(email=data["email"]).afirst()
+    if user is None:
+        # Hash anyway, so the response time doesn't tell whether the account exists
+        await amake_password(data["password"])
+        return _failed("Invalid credentials", status.HTTP_400_BAD_REQUEST)
+    if not await acheck_password(user, data["password"]) or not user.is_active:
+        return _failed("Invalid credentials", status.HTTP_400_BAD_REQUEST)
+    if not user.is_verified:
+        return _failed("Email is not verified", status.HTTP_400_BAD_REQUEST)
+
+    if api_settings.UPDATE_LAST_LOGIN:
+        await sync_to_async(record_login)(user)
+    tokens = await sync_to_async(token_pair)(user)
+    return JsonResponse({"message": "Logged in successfully", "tokens": tokens,
+                         "data": {"email": user.email, "full_name": user.full_name}, "status": "success"})
+
+
+@_post_only
+async def register(request):
+    data, error = _validated(RegisterSerializer, request)
+    if error:
+        return error
+    try:
+        user = await User.objects.acreate(email=User.objects.normalize_email(data["email"]),
+                                          full_name=data["full_name"],
+                                          password=await amake_password(data["password"]))
+    except IntegrityError:
+        return _failed("An account with this email already exists", status.HTTP_400_BAD_REQUEST)
+
+    await sync_to_async(Util.email_activation)(user)
+    return JsonResponse({"message": "Registered successfully. Check email for verification code",
+                         "data": {"full_name": user.full_name, "email": user.email}, "status": "success"},
+                        status=status.HTTP_201_CREATED)
+
+
+@_post_only
+async def change_password(request):
+    request_user, error = await _authenticated_user(request)
+    if error:
+        return error
+    data, error = _validated(ChangePasswordSerializer, request)
+    if error:
+        return error
+    throttle = UserTokenBucketThrottle()
+    if not await sync_to_async(throttle.consume)("otp_check", request_user.pk):
+        return _throttled(throttle.wait())
+    user = await User.objects.filter(email=request_user.email).afirst()
+    if user is None:
+        return _failed("Account not found", status.HTTP_404_NOT_FOUND)
+
+    result = await sync_to_async(otp_store.check)(user, OTP_PASSWORD_CHANGE, data["code"])
+    if result != otp_store.OTP_VALID:
+        return _failed(otp_store.OTP_MESSAGES[result], status.HTTP_400_BAD_REQUEST)
+
+    if await acheck_password(user, data["password"]):
+        return _failed("New password cannot be same as old password", status.HTTP_400_BAD_REQUEST)
+
+    user.password = await amake_password(data["password"])
+    # Saved through the model so the password change still revokes the user's tokens
+    await sync_to_async(user.save)()
+    await sync_to_async(otp_store.discard)(user, OTP_PASSWORD_CHANGE)
+    return JsonResponse({"message": "Password updated successfully", "status": "success"})
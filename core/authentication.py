@@ -0,0 +1,207 @@
+import threading
+import time
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, TokenError
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from common.cache import cache_is_shared
+from core.models import User
+
+# User fields copied into every token so most requests never need the User row
+USER_CLAIMS = ("email", "full_name", "is_staff", "is_verified", "is_active")
+
+# Issue time with sub-second precision; "iat" only has whole seconds, which would reject a token
+# issued in the same second as a revocation, e.g. logging in right after verifying an email
+ISSUED_AT_CLAIM = "issued_at"
+
+
+def _revocation_key(user_id):
+    return f"auth:revoked:{user_id}"
+
+
+def revoke_tokens(user_id):
+    """
+    Reject every token issued to the user before now. The mark is saved on the user, and cached for as
+    long as the access tokens already handed out last; refreshing re-reads the user, so newer tokens
+    carry up to date claims. A mark lost from the cache leaves the old access tokens valid at most until
+    they expire, so keep ACCESS_TOKEN_LIFETIME short.
+    """
+    revoked_at = timezone.now()
+    User.objects.filter(pk=user_id).update(tokens_revoked_at=revoked_at)
+    cache.set(_revocation_key(user_id), revoked_at.timestamp(),
+              int(api_settings.ACCESS_TOKEN_LIFETIME.total_seconds()))
+
+
+# Replaced whenever a token is blacklisted so every process picks it up on its next check
+BLACKLIST_VERSION_KEY = "auth:blacklist-version"
+
+
+class BlacklistIndex:
+    """
+    In-process copy of the ids of blacklisted tokens that haven't expired yet.
+
+    Checking a token is a set lookup plus one cache read of the blacklist version. When the version
+    changed, only tokens blacklisted since the last load are read; expired ids are dropped, as an
+    expired token is rejected before the blacklist is even checked. The version only reaches other
+    processes through a shared cache; on a per-process one, tokens missing from the index are looked up.
+    """
+    # Tokens blacklisted this long before the last load are read again, for transactions still open then
+    overlap = timezone.timedelta(minutes=1)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._expiry_dates = {}
+        self._version = None
+        self._loaded_at = None
+
+    def _current_version(self):
+        version = cache.get(BLACKLIST_VERSION_KEY)
+        if version is None:
+            cache.add(BLACKLIST_VERSION_KEY, uuid4().hex, None)
+            version = cache.get(BLACKLIST_VERSION_KEY)
+        return version
+
+    def _refresh(self):
+        version = self._current_version()
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            now = timezone.now()
+            tokens = BlacklistedToken.objects.filter(token__expires_at__gt=now)
+            if self._loaded_at is not None:
+                tokens = tokens.filter(blacklisted_at__gte=self._loaded_at - self.overlap)
+            expiry_dates = {jti: expires_at for jti, expires_at in self._expiry_dates.items() if expires_at > now}
+            expiry_dates.update(tokens.values_list("token__jti", "token__expires_at"))
+            self._expiry_dates, self._version, self._loaded_at = expiry_dates, version, now
+
+    def __contains__(self, jti):
+        self._refresh()
+        return jti in self._expiry_dates
+
+
+def invalidate_blacklist_index():
+    cache.set(BLACKLIST_VERSION_KEY, uuid4().hex, None)
+
+
+blacklisted_tokens = BlacklistIndex()
+
+
+def compact_tokens(chunk_size=1000, now=None):
+    """
+    Delete outstanding tokens past their expiry date, and their blacklist entries with them, ``chunk_size``
+    rows per DELETE so a large backlog never holds a long lock. Returns the number of tokens deleted.
+    """
+    now = now or timezone.now()
+    expired = OutstandingToken.objects.filter(expires_at__lte=now).order_by("id")
+    deleted = 0
+    while True:
+        ids = list(expired.values_list("id", flat=True)[:chunk_size])
+        if not ids:
+            break
+        deleted += OutstandingToken.objects.filter(id__in=ids).delete()[1].get(OutstandingToken._meta.label, 0)
+    return deleted
+
+
+def _claims(user):
+    return {claim: getattr(user, claim) for claim in USER_CLAIMS}
+
+
+class ClaimsRefreshToken(RefreshToken):
+    """
+    Refresh token carrying ``USER_CLAIMS``, re-read from the database whenever an access token is derived from it.
+    """
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token._user = user
+        token[ISSUED_AT_CLAIM] = time.time()
+        for claim, value in _claims(user).items():
+            token[claim] = value
+        return token
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        user = getattr(self, "_user", None) or User.objects.filter(pk=self[api_settings.USER_ID_CLAIM]).first()
+        if user is None or not user.is_active:
+            raise TokenError(_("User is inactive or no longer exists"))
+        access[ISSUED_AT_CLAIM] = time.time()
+        for claim, value in _claims(user).items():
+            access[claim] = value
+        return access
+
+    def check_blacklist(self):
+        jti = self[api_settings.JTI_CLAIM]
+        if jti in blacklisted_tokens:
+            raise TokenError(_("Token is blacklisted"))
+        # A per-process cache never sees the version bump of a logout handled by another process
+        if not cache_is_shared() and BlacklistedToken.objects.filter(token__jti=jti).exists():
+            raise TokenError(_("Token is blacklisted"))
+
+
+def token_pair(user):
+    refresh = ClaimsRefreshToken.for_user(user)
+    return {"refresh": str(refresh), "access": str(refresh.access_token)}
+
+
+class ClaimsUser(TokenUser):
+    """
+    User built from the claims of a validated token. Anything that isn't a claim is read from the
+    ``User`` row, which is only loaded the first time that happens.
+    """
+
+    @cached_property
+    def is_active(self):
+        return self.token.get("is_active", True)
+
+    @cached_property
+    def user(self):
+        return User.objects.get(pk=self.id)
+
+    def __getattr__(self, attr):
+        if attr == "token" or attr.startswith("_"):
+            raise AttributeError(attr)
+        if attr in self.token:
+            return self.token[attr]
+        return getattr(self.user, attr)
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    Authenticates from the token's claims without a user query; the only lookup per request is a
+    cache read to check the user's tokens haven't been revoked. On a per-process cache, which never
+    sees revocations made by other processes, that check reads the user's row instead. Tokens issued
+    before the claims were added fall back to loading the user.
+    """
+
+    def get_user(self, validated_token):
+        if not all(claim in validated_token for claim in USER_CLAIMS):
+            return super().get_user(validated_token)
+
+        user = ClaimsUser(validated_token)
+        if cache_is_shared():
+            revoked_at, is_active = cache.get(_revocation_key(user.id)), user.is_active
+        else:
+            row = User.objects.filter(pk=user.id).values_list("tokens_revoked_at", "is_active").first()
+            if row is None:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            revoked_at, is_active = row[0] and row[0].timestamp(), row[1]
+
+        issued_at = validated_token.get(ISSUED_AT_CLAIM, validated_token.get("iat", 0))
+        if revoked_at is not None and issued_at < revoked_at:
+            raise AuthenticationFailed(_("Token has been revoked"), code="token_revoked")
+        if not is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
@@ -0,0 +1,81 @@
+import atexit
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from core.models import User
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """
+    Collects updates to columns nobody needs up to the second, such as ``User.last_login``, and writes them
+    with ``bulk_update`` every ``interval`` seconds and when the process exits, instead of one UPDATE per
+    request on a row other requests are locking too. Only the latest value per row is kept; a crash loses
+    what was collected since the last flush. With an ``interval`` of 0 every update is written at once.
+    """
+
+    def __init__(self, model, interval, batch_size=500):
+        self.model = model
+        self.interval = interval
+        self.batch_size = batch_size
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._timer = None
+        atexit.register(self.flush)
+
+    def record(self, pk, **values):
+        if not self.interval:
+            self.model.objects.filter(pk=pk).update(**values)
+            return
+        with self._lock:
+            self._pending.setdefault(pk, {}).update(values)
+            if self._timer is None:
+                self._timer = threading.Timer(self.interval, self._flush_in_background)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """
+        Write every collected update now. Returns the number of rows written.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        # bulk_update sets the same fields on every object, so rows are grouped by the fields they changed
+        groups = defaultdict(list)
+        for pk, values in pending.items():
+            groups[tuple(sorted(values))].append(self.model(pk=pk, **values))
+        written = 0
+        for fields, objs in groups.items():
+            try:
+                written += self.model.objects.bulk_update(objs, fields, batch_size=self.batch_size)
+            except Exception:
+                logger.exception("Could not write %s buffered %s updates", len(objs), self.model.__name__)
+        return written
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        finally:
+            # The timer thread gets its own database connection which nothing else would close
+            connection.close()
+
+
+last_logins = WriteBehindBuffer(User, settings.LAST_LOGIN_FLUSH_INTERVAL)
+
+
+def record_login(user):
+    """
+    Drop-in for ``update_last_login``: sets ``last_login`` on the user and buffers the write.
+    """
+    user.last_login = timezone.now()
+    last_logins.record(user.pk, last_login=user.last_login)
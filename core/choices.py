@@ -7,3 +7,21 @@ GENDER_CHOICES = (
     (GENDER_FEMALE, "Female"),
     (GENDER_OTHERS, "Others"),
 )
+
+OTP_ACTIVATION = "A"
+OTP_EMAIL_CHANGE = "E"
+OTP_PASSWORD_CHANGE = "P"
+
+OTP_PURPOSE_CHOICES = (
+    (OTP_ACTIVATION, "Account activation"),
+    (OTP_EMAIL_CHANGE, "Email change"),
+    (OTP_PASSWORD_CHANGE, "Password change"),
+)
+
+AUTH_PROVIDER_EMAIL = "email"
+AUTH_PROVIDER_GOOGLE = "google"
+
+AUTH_PROVIDER_CHOICES = (
+    (AUTH_PROVIDER_EMAIL, "Email"),
+    (AUTH_PROVIDER_GOOGLE, "Google"),
+)
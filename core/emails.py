@@ -1,102 +1,74 @@
-import random
-import threading
-import warnings
-
 from django.conf import settings
 from django.core.mail import EmailMessage
-from django.template.loader import render_to_string
-from django.utils import timezone
-
-from core.models import Otp, User
-
-
-# This function sends an activation email to a user with an OTP code to change their password.
-# It takes a user ID as input and retrieves the user object from the database.
-def password_verification_email(user_id):
-    try:
-        user = User.objects.get(id=user_id)
-    except User.DoesNotExist:
-        warnings.warn(f"User with this id {user_id} does not exist")
-        return
-    code = random.randint(1000, 9999)
-    otp = Otp.objects.create(user=user, code=code, expiry_date=timezone.now() + timezone.timedelta(minutes=10))
-    context = {'full_name': user.full_name, 'code': otp.code}
-    message = render_to_string("password_reset.html", context)
-    msg = EmailMessage(subject='Change Your Password', body=message, from_email=settings.EMAIL_HOST_USER,
-                       to=[user.email])
-    msg.content_subtype = 'html'
-    msg.send()
-
-
-# This function sends an activation email to a user with an OTP code to verify their account.
-# It takes a user ID as input and retrieves the user object from the database.
-def send_activation_email(user_id):
-    try:
-        user = User.objects.get(id=user_id)
-    except User.DoesNotExist:
-        warnings.warn(f"User with this id {user_id} does not exist")
-        return
-    code = random.randint(1000, 9999)
-    otp = Otp.objects.create(user=user, code=code, expiry_date=timezone.now() + timezone.timedelta(minutes=15))
-    context = {'full_name': user.full_name, 'code': otp.code}
-    message = render_to_string("activation_email.html", context)
-    msg = EmailMessage(subject='Activate Your Account', body=message, from_email=settings.EMAIL_HOST_USER,
-                       to=[user.email])
-    msg.content_subtype = 'html'
-    msg.send()
-
-
-# This function sends an email change email to a user with an OTP code to change their email.
-# It takes a user ID as input and retrieves the user object from the database.
-def send_email_change_verification(user_id):
-    try:
-        user = User.objects.get(id=user_id)
-    except User.DoesNotExist:
-        warnings.warn(f"User with this id {user_id} does not exist")
-        return
-    code = random.randint(1000, 9999)
-    otp = Otp.objects.create(user=user, code=code, expiry_date=timezone.now() + timezone.timedelta(minutes=10))
-    context = {'full_name': user.full_name, 'code': otp.code}
-    message = render_to_string("email_change.html", context)
-    msg = EmailMessage(subject='Change Your Email', body=message, from_email=settings.EMAIL_HOST_USER,
-                       to=[user.email])
-    msg.content_subtype = 'html'
-    msg.send()
-
-
-# This function sends an activation email to a user with an OTP code to verify their account.
-# It takes a user ID as input and retrieves the user object from the database.
-def send_verification_email(user_id):
-    try:
-        user = User.objects.get(id=user_id)
-    except User.DoesNotExist:
-        warnings.warn(f"User with this id {user_id} does not exist")
-        return
-    context = {'full_name': user.full_name}
-    message = render_to_string("verification_email.html", context)
-    msg = EmailMessage(subject='Account Verified', body=message, from_email=settings.EMAIL_HOST_USER,
-                       to=[user.email])
+
+from common.jobs import enqueue
+from core import otp as otp_store
+from core.choices import OTP_ACTIVATION, OTP_EMAIL_CHANGE, OTP_PASSWORD_CHANGE
+from core.email_templates import render_email
+from core.mailer import mailer
+
+
+def _html_email(user, subject, template, context):
+    message = render_email(template, {'full_name': user.full_name, **context})
+    msg = EmailMessage(subject=subject, body=message, from_email=settings.EMAIL_HOST_USER, to=[user.email])
     msg.content_subtype = 'html'
-    msg.send()
+    return msg
+
+
+# This function builds the email sending a user an OTP code to change their password.
+def password_verification_email(user):
+    code = otp_store.issue(user, OTP_PASSWORD_CHANGE)
+    return _html_email(user, 'Change Your Password', "password_reset.html", {'code': code})
+
+
+# This function builds the activation email sending a user an OTP code to verify their account.
+def send_activation_email(user):
+    code = otp_store.issue(user, OTP_ACTIVATION)
+    return _html_email(user, 'Activate Your Account', "activation_email.html", {'code': code})
+
+
+# This function builds the email sending a user an OTP code to change their email.
+def send_email_change_verification(user):
+    code = otp_store.issue(user, OTP_EMAIL_CHANGE)
+    return _html_email(user, 'Change Your Email', "email_change.html", {'code': code})
+
+
+# This function builds the email telling a user their account is verified.
+def send_verification_email(user):
+    return _html_email(user, 'Account Verified', "verification_email.html", {})
+
+
+EMAILS = {
+    "activation": send_activation_email,
+    "email_change": send_email_change_verification,
+    "password_change": password_verification_email,
+    "verified": send_verification_email,
+}
+
+
+# With EMAIL_DELIVERY = "pool" the code is issued and the email built in the caller, which already has the
+# user at hand, and only the sending is left to the background workers of ``mailer``. With "jobs" the whole
+# email is queued in the database for ``run_workers``, so it survives a restart of the web process.
+def _deliver(kind, user):
+    if settings.EMAIL_DELIVERY == "jobs":
+        enqueue("core.send_email", priority=10, kind=kind, user_id=str(user.id))
+    else:
+        mailer.send(EMAILS[kind](user))
 
 
 class Util:
     @staticmethod
     def email_activation(user):
-        t = threading.Thread(target=send_activation_email, args=(user.id,))
-        t.start()
+        _deliver("activation", user)
 
     @staticmethod
     def email_change(user):
-        t = threading.Thread(target=send_email_change_verification, args=(user.id,))
-        t.start()
+        _deliver("email_change", user)
 
     @staticmethod
     def email_verified(user):
-        t = threading.Thread(target=send_verification_email, args=(user.id,))
-        t.start()
+        _deliver("verified", user)
 
     @staticmethod
     def password_activation(user):
-        t = threading.Thread(target=password_verification_email, args=(user.id,))
-        t.start()
+        _deliver("password_change", user)
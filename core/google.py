@@ -1,5 +1,52 @@
-from google.auth.transport import requests
-from google.oauth2 import id_token
+import re
+import threading
+import time
+
+import requests
+from django.conf import settings
+from google.auth import jwt
+
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+
+
+class GoogleCerts:
+    """
+    Google's signing certificates, downloaded through one reused session and kept for as long as the
+    ``Cache-Control: max-age`` of the response allows. A token signed with a key that isn't known yet
+    triggers a single early download, as Google rotates its keys before the old ones expire.
+    """
+
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+        self._session = requests.Session()
+        self._lock = threading.Lock()
+        self._certs = {}
+        self._expires_at = 0
+
+    @staticmethod
+    def _max_age(response):
+        match = re.search(r"max-age=(\d+)", response.headers.get("Cache-Control", ""))
+        if match is None:
+            return 0
+        return max(int(match.group(1)) - int(response.headers.get("Age", 0) or 0), 0)
+
+    def _fetch(self):
+        response = self._session.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        self._certs = response.json()
+        self._expires_at = time.monotonic() + self._max_age(response)
+
+    def get(self, key_id=None):
+        if time.monotonic() < self._expires_at and (key_id is None or key_id in self._certs):
+            return self._certs
+        with self._lock:
+            if time.monotonic() >= self._expires_at or (key_id is not None and key_id not in self._certs):
+                self._fetch()
+        return self._certs
+
+
+google_certs = GoogleCerts(settings.GOOGLE_CERTS_URL)
 
 
 class Google:
@@ -7,10 +54,12 @@ class Google:
 
     @staticmethod
     def validate(auth_token):
-        # validate method queries, google oauth2 api to fetch the user info
+        # validate method checks the token's signature against Google's cached certificates, without a request per login
         try:
-            id_info = id_token.verify_oauth2_token(auth_token, requests.Request())
-            if 'core.google.com' in id_info['iss']:
+            certs = google_certs.get(jwt.decode_header(auth_token).get("kid"))
+            id_info = jwt.decode(auth_token, certs=certs, clock_skew_in_seconds=10)
+            if id_info['iss'] in GOOGLE_ISSUERS:
                 return id_info
-        except:
-            return "The token is either invalid or expired"
+        except Exception:
+            pass
+        return "The token is either invalid or expired"
@@ -0,0 +1,66 @@
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX, get_hasher, identify_hasher
+
+_executor = None
+_lock = threading.Lock()
+
+
+def _pool():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                # Spawned rather than forked: by now the server runs threads (email senders, write-behind
+                # timers) and a fork could copy one of their locks while held, deadlocking the child
+                _executor = ProcessPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS,
+                                                mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+# Run in the pool's processes; hashers are plain objects, so they travel there with the call
+def _verify(hasher, password, encoded):
+    return hasher.verify(password, encoded)
+
+
+def _encode(hasher, password, salt):
+    return hasher.encode(password, salt)
+
+
+async def _run(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_pool(), func, *args)
+
+
+async def amake_password(password):
+    """
+    ``make_password`` with the default hasher, hashing in a process of the pool instead of the event loop.
+    """
+    hasher = get_hasher("default")
+    return await _run(_encode, hasher, password, hasher.salt())
+
+
+async def acheck_password(user, password):
+    """
+    ``user.check_password`` hashing in a process of the pool. Like it, a password stored with an outdated
+    hasher or too few iterations is hashed again with the default one and saved.
+    """
+    encoded = user.password
+    if password is None or not encoded or encoded.startswith(UNUSABLE_PASSWORD_PREFIX):
+        return False
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        return False
+    if not await _run(_verify, hasher, password, encoded):
+        return False
+
+    preferred = get_hasher("default")
+    if hasher.algorithm != preferred.algorithm or preferred.must_update(encoded):
+        user.password = await amake_password(password)
+        await sync_to_async(user.save)(update_fields=["password"])
+    return True
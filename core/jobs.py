@@ -0,0 +1,14 @@
+import warnings
+
+from common.jobs import register
+from core.emails import EMAILS
+from core.models import User
+
+
+@register("core.send_email")
+def send_email(kind, user_id):
+    user = User.objects.filter(id=user_id).first()
+    if user is None:
+        warnings.warn(f"User with this id {user_id} does not exist")
+        return
+    EMAILS[kind](user).send()
@@ -0,0 +1,134 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+logger = logging.getLogger(__name__)
+
+
+class EmailWorkerPool:
+    """
+    Sends emails from a bounded queue with a fixed number of worker threads.
+
+    Each worker keeps its connection from ``get_connection()`` open while there is mail to send and hands
+    everything waiting, up to ``batch_size`` messages, to a single ``send_messages`` call. A failed batch is
+    retried with exponential backoff on a new connection; as a batch can fail part way, a message may then
+    arrive twice. Once the queue is full ``send`` blocks, which slows callers down instead of piling up
+    threads. Workers start with the first email, so a process forked after import gets its own.
+    """
+
+    def __init__(self, workers=2, max_queue=1000, batch_size=50, max_attempts=3, backoff=1.0, idle_timeout=30):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._sent = 0
+        self._failed = 0
+        self._latencies = deque(maxlen=1000)
+
+    def _start(self):
+        if len(self._threads) == self.workers:
+            return
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f"email-worker-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def send(self, *messages):
+        self._start()
+        for message in messages:
+            self._queue.put((time.monotonic(), message))
+
+    def _work(self):
+        connection = None
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.idle_timeout if connection is not None else None)]
+            except queue.Empty:
+                connection = self._close(connection)
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                connection = self._deliver(batch, connection)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _deliver(self, batch, connection):
+        messages = [message for _, message in batch]
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                if connection is None:
+                    connection = get_connection()
+                    connection.open()
+                connection.send_messages(messages)
+                break
+            except Exception:
+                connection = self._close(connection)
+                if attempt == self.max_attempts:
+                    logger.exception("Giving up on %s emails after %s attempts", len(messages), attempt)
+                    with self._lock:
+                        self._failed += len(messages)
+                    return None
+                logger.warning("Sending %s emails failed, retrying", len(messages), exc_info=True)
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+        now = time.monotonic()
+        with self._lock:
+            self._sent += len(messages)
+            self._latencies.extend(now - queued_at for queued_at, _ in batch)
+        return connection
+
+    @staticmethod
+    def _close(connection):
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                logger.warning("Closing the email connection failed", exc_info=True)
+        return None
+
+    def wait(self, timeout=None):
+        """
+        Block until every queued email was sent or given up on; returns False if ``timeout`` ran out first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def stats(self):
+        """
+        Queue depth, delivery counts and the time emails spent between ``send`` and delivery, in milliseconds,
+        over the last 1000 emails.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            sent, failed = self._sent, self._failed
+        return {
+            "queued": self._queue.qsize(),
+            "sent": sent,
+            "failed": failed,
+            "latency_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0,
+            "max_latency_ms": latencies[-1] * 1000 if latencies else 0,
+        }
+
+
+mailer = EmailWorkerPool(workers=settings.EMAIL_WORKERS, max_queue=settings.EMAIL_QUEUE_SIZE)
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.authentication import compact_tokens
+
+
+class Command(BaseCommand):
+    help = "Delete expired refresh tokens and their blacklist entries; run it periodically, e.g. from cron"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Tokens deleted per query")
+
+    def handle(self, *args, **options):
+        deleted = compact_tokens(chunk_size=options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired tokens"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.otp import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Delete expired one-time codes; run it periodically, e.g. from cron"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Codes deleted per query")
+
+    def handle(self, *args, **options):
+        deleted = purge_expired(chunk_size=options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired codes"))
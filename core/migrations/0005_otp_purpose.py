@@ -0,0 +1,34 @@
+# Generated by Django 4.1.7 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+def delete_codes(apps, schema_editor):
+    # Codes live for minutes and weren't tied to a purpose; anyone mid-flow simply requests a new one
+    apps.get_model("core", "Otp").objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_alter_otp_id'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_codes, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='otp',
+            name='purpose',
+            field=models.CharField(choices=[('A', 'Account activation'), ('E', 'Email change'), ('P', 'Password change')], default='A', max_length=1),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='otp',
+            name='expiry_date',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='otp',
+            constraint=models.UniqueConstraint(fields=('user', 'purpose'), name='otp_user_purpose_unique'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-19 03:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_otp_purpose'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='auth_provider',
+            field=models.CharField(choices=[('email', 'Email'), ('google', 'Google')], default='email', max_length=20),
+        ),
+    ]
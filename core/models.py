@@ -4,7 +4,7 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.utils import timezone
 
-from core.choices import GENDER_CHOICES
+from core.choices import AUTH_PROVIDER_CHOICES, AUTH_PROVIDER_EMAIL, GENDER_CHOICES, OTP_PURPOSE_CHOICES
 from core.validators import validate_full_name, validate_phone_number
 from common.models import BaseModel
 from .managers import CustomUserManager
@@ -21,6 +21,9 @@ class User(AbstractUser):
     avatar = models.ImageField(upload_to="avatar/images")
     email_changed = models.BooleanField(default=False)
     is_verified = models.BooleanField(default=False)
+    auth_provider = models.CharField(choices=AUTH_PROVIDER_CHOICES, max_length=20, default=AUTH_PROVIDER_EMAIL)
+    # Tokens issued before this are rejected; see core.authentication.revoke_tokens
+    tokens_revoked_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ["full_name"]
@@ -37,13 +40,19 @@ class User(AbstractUser):
 
 class Otp(BaseModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="otp")
+    purpose = models.CharField(choices=OTP_PURPOSE_CHOICES, max_length=1)
     code = models.PositiveIntegerField(null=True)
     expired = models.BooleanField(default=False)
-    expiry_date = models.DateTimeField(null=True)
+    expiry_date = models.DateTimeField(null=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "purpose"], name="otp_user_purpose_unique"),
+        ]
 
     def __str__(self):
         return f"{self.user.full_name} ----- {self.code}"
 
     def save(self, *args, **kwargs):
-        self.expired = self.expiry_date >= timezone.now() + timezone.timedelta(minutes=20)
+        self.expired = self.expiry_date is not None and self.expiry_date <= timezone.now()
         super(Otp, self).save(*args, **kwargs)
@@ -1,55 +1,50 @@
-from decouple import config
-from django.contrib.auth import authenticate, get_user_model
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
 from faker import Faker
 from rest_framework.exceptions import AuthenticationFailed
-from rest_framework_simplejwt.tokens import RefreshToken
+
+from core.authentication import token_pair
 
 fake = Faker()
 
 User = get_user_model()
 
 
-def tokens(self):
-    refresh = RefreshToken.for_user(self)
-    return {
-        "access": str(refresh.access_token),
-        "refresh": str(refresh)
-    }
-
-
-def generate_full_name(name):
-    full_name = fake.name().lower()
-    while User.objects.filter(full_name=full_name).exists():
-        full_name = fake.name().lower()
-    return full_name
+def generate_full_name(name, batch_size=10):
+    # Keeps the name from the provider when no one has it yet, otherwise draws two-word names a batch
+    # at a time and checks each batch with a single query
+    candidates = [name] if name and len(name.split()) == 2 else []
+    while True:
+        while len(candidates) < batch_size:
+            candidate = fake.name().lower()
+            if len(candidate.split()) == 2:
+                candidates.append(candidate)
+        taken = set(User.objects.filter(full_name__in=candidates).values_list("full_name", flat=True))
+        for candidate in candidates:
+            if candidate not in taken:
+                return candidate
+        candidates = []
 
 
 def register_social_user(provider, user_id, email, name):
-    filtered_user_by_email = User.objects.filter(email=email)
-
-    if filtered_user_by_email.exists():
-        if provider == filtered_user_by_email[0].auth_provider:
-            registered_user = authenticate(email=email, password=config('SOCIAL_SECRET'))
-            return {
-                "full_name": registered_user.full_name,
-                "email": registered_user.email,
-                "tokens": registered_user.tokens()
-            }
-        else:
-            raise AuthenticationFailed(f"Please continue your login using {filtered_user_by_email[0].auth_provider}")
-    else:
-        user = {
-            "full_name": generate_full_name(name),
-            "email": email,
-            "password": config('SOCIAL_SECRET')
-        }
-        user = User.objects.create_user(**user)
-        user.is_verified = True
-        user.save()
-
-        new_user = authenticate(email=email, password=config('SOCIAL_SECRET'))
-        return {
-            'email': new_user.email,
-            'full_name': new_user.full_name,
-            'tokens': new_user.tokens()
-        }
+    user = User.objects.filter(email=User.objects.normalize_email(email)).first()
+
+    if user is None:
+        try:
+            with transaction.atomic():
+                # No password: social accounts sign in through their provider only, and nothing gets hashed
+                user = User.objects.create_user(email=email, full_name=generate_full_name(name), password=None,
+                                                auth_provider=provider, is_verified=True)
+        except IntegrityError:
+            # Signed up by a concurrent request for the same account
+            user = User.objects.get(email=User.objects.normalize_email(email))
+
+    if user.auth_provider != provider:
+        raise AuthenticationFailed(f"Please continue your login using {user.auth_provider}")
+    if not user.is_active:
+        raise AuthenticationFailed("This account has been disabled")
+    return {
+        "full_name": user.full_name,
+        "email": user.email,
+        "tokens": token_pair(user)
+    }
@@ -5,6 +5,7 @@ from rest_framework import serializers
 from rest_framework.exceptions import AuthenticationFailed
 
 from core import google
+from core.choices import AUTH_PROVIDER_GOOGLE
 from core.oauth_funcs import register_social_user
 
 
@@ -24,7 +25,7 @@ class GoogleSocialAuthSerializer(serializers.Serializer):
 
         user_id = user_data["sub"]
         email = user_data["email"]
-        name = user_data["name"]
-        provider = 'google'
+        name = user_data.get("name", "")
+        provider = AUTH_PROVIDER_GOOGLE
 
         return register_social_user(provider=provider, user_id=user_id, email=email, name=name)
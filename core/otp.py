@@ -0,0 +1,169 @@
+import secrets
+import time
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from core.choices import OTP_ACTIVATION, OTP_EMAIL_CHANGE, OTP_PASSWORD_CHANGE
+from core.models import Otp
+
+OTP_LIFETIMES = {
+    OTP_ACTIVATION: timezone.timedelta(minutes=15),
+    OTP_EMAIL_CHANGE: timezone.timedelta(minutes=10),
+    OTP_PASSWORD_CHANGE: timezone.timedelta(minutes=10),
+}
+
+# Outcomes of ``check``, with the message the views answer them with
+OTP_VALID = "valid"
+OTP_MISSING = "missing"
+OTP_INCORRECT = "incorrect"
+OTP_EXPIRED = "expired"
+
+OTP_MESSAGES = {
+    OTP_MISSING: "No OTP found for this account",
+    OTP_INCORRECT: "Code is not correct",
+    OTP_EXPIRED: "Code has expired. Request for another",
+}
+
+
+class StoredOtp(NamedTuple):
+    code: int
+    expiry_date: object
+
+    @property
+    def expired(self):
+        return self.expiry_date <= timezone.now()
+
+
+def _cache_key(user_id, purpose):
+    return f"otp:{purpose}:{user_id}"
+
+
+class DatabaseOtps:
+    """
+    Codes saved to the ``Otp`` table, which keeps a single row per user and purpose, and to the cache until
+    they expire, so checking one normally doesn't touch the database.
+    """
+
+    @staticmethod
+    def issue(user, purpose):
+        code = 1000 + secrets.randbelow(9000)
+        expiry_date = timezone.now() + OTP_LIFETIMES[purpose]
+        Otp.objects.update_or_create(user_id=user.id, purpose=purpose,
+                                     defaults={"code": code, "expiry_date": expiry_date})
+        cache.set(_cache_key(user.id, purpose), StoredOtp(code, expiry_date), OTP_LIFETIMES[purpose].total_seconds())
+        return code
+
+    @staticmethod
+    def get(user_id, purpose):
+        """
+        Return the user's current code for the purpose, or None. On a cache miss it's a single lookup on the
+        (user, purpose) unique index.
+        """
+        key = _cache_key(user_id, purpose)
+        otp = cache.get(key)
+        if otp is not None:
+            return otp
+        row = Otp.objects.filter(user_id=user_id, purpose=purpose).values_list("code", "expiry_date").first()
+        if row is None or None in row:
+            return None
+        otp = StoredOtp(*row)
+        if not otp.expired:
+            cache.set(key, otp, (otp.expiry_date - timezone.now()).total_seconds())
+        return otp
+
+    @classmethod
+    def check(cls, user, purpose, code):
+        otp = cls.get(user.id, purpose)
+        if otp is None:
+            return OTP_MISSING
+        elif otp.code != code:
+            return OTP_INCORRECT
+        elif otp.expired:
+            cls.discard(user, purpose)
+            return OTP_EXPIRED
+        return OTP_VALID
+
+    @staticmethod
+    def discard(user, purpose):
+        cache.delete(_cache_key(user.id, purpose))
+        Otp.objects.filter(user_id=user.id, purpose=purpose).delete()
+
+
+class SignedOtps:
+    """
+    Codes derived with an HMAC of the user, the purpose and the current time step, so nothing is stored and
+    checking one reads and writes nothing. The step is the code's lifetime and the previous step's code is
+    accepted too, so a code lasts between one and two lifetimes.
+
+    The user's password hash, email and verification state are part of the HMAC: a code stops working once
+    the password or email it was sent for was changed, or the account it was sent to activate is verified.
+    """
+
+    @staticmethod
+    def _code(user, purpose, step):
+        value = f"{user.pk}|{user.password}|{user.email}|{user.is_verified}|{step}"
+        digest = salted_hmac(f"core.otp.{purpose}", value, algorithm="sha256").hexdigest()
+        return 1000 + int(digest, 16) % 9000
+
+    @staticmethod
+    def _step(purpose):
+        return int(time.time() // OTP_LIFETIMES[purpose].total_seconds())
+
+    @classmethod
+    def issue(cls, user, purpose):
+        return cls._code(user, purpose, cls._step(purpose))
+
+    @classmethod
+    def check(cls, user, purpose, code):
+        step = cls._step(purpose)
+        if any(constant_time_compare(str(cls._code(user, purpose, step - age)), str(code)) for age in (0, 1)):
+            return OTP_VALID
+        if constant_time_compare(str(cls._code(user, purpose, step - 2)), str(code)):
+            return OTP_EXPIRED
+        return OTP_INCORRECT
+
+    @staticmethod
+    def discard(user, purpose):
+        # Codes stop working on their own once the change they were sent for is saved
+        pass
+
+
+def _backend():
+    return SignedOtps if settings.OTP_MODE == "signed" else DatabaseOtps
+
+
+def issue(user, purpose):
+    """
+    Create a code for the user and purpose, replacing the previous one, and return it.
+    """
+    return _backend().issue(user, purpose)
+
+
+def check(user, purpose, code):
+    """
+    Return ``OTP_VALID`` when ``code`` is the user's current code for the purpose, or why it isn't.
+    """
+    return _backend().check(user, purpose, code)
+
+
+def discard(user, purpose):
+    _backend().discard(user, purpose)
+
+
+def purge_expired(chunk_size=1000, now=None):
+    """
+    Delete expired codes, ``chunk_size`` rows per DELETE. Returns the number of codes deleted.
+    """
+    now = now or timezone.now()
+    expired = Otp.objects.filter(expiry_date__lte=now).order_by("expiry_date")
+    deleted = 0
+    while True:
+        ids = list(expired.values_list("id", flat=True)[:chunk_size])
+        if not ids:
+            break
+        deleted += Otp.objects.filter(id__in=ids).delete()[0]
+    return deleted
@@ -3,7 +3,10 @@ import re
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenBlacklistSerializer, TokenObtainPairSerializer, \
+    TokenRefreshSerializer
 
+from core.authentication import ClaimsRefreshToken
 from core.models import User
 
 
@@ -48,6 +51,18 @@ class ChangePasswordSerializer(serializers.Serializer):
         return attrs
 
 
+class ClaimsTokenBlacklistSerializer(TokenBlacklistSerializer):
+    token_class = ClaimsRefreshToken
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = ClaimsRefreshToken
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = ClaimsRefreshToken
+
+
 class LoginSerializer(serializers.Serializer):
     email = serializers.EmailField()
     password = serializers.CharField(max_length=150, min_length=6, write_only=True)
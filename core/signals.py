@@ -0,0 +1,39 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from core.authentication import USER_CLAIMS, invalidate_blacklist_index, revoke_tokens
+from core.models import User
+
+# A change to any of these makes the tokens already issued to the user stale
+TOKEN_FIELDS = (*USER_CLAIMS, "password")
+
+
+def _token_state(user):
+    # Read from __dict__ so deferred fields aren't loaded just for this
+    return tuple(user.__dict__.get(field) for field in TOKEN_FIELDS)
+
+
+@receiver(post_init, sender=User)
+def remember_token_state(sender, instance, **kwargs):
+    instance._loaded_token_state = _token_state(instance)
+
+
+@receiver(post_save, sender=User)
+def revoke_stale_tokens(sender, instance, created, **kwargs):
+    state = _token_state(instance)
+    if not created and state != instance._loaded_token_state:
+        revoke_tokens(instance.pk)
+    instance._loaded_token_state = state
+
+
+@receiver(post_delete, sender=User)
+def revoke_deleted_user_tokens(sender, instance, **kwargs):
+    revoke_tokens(instance.pk)
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def publish_blacklisted_token(sender, instance, created, **kwargs):
+    if created:
+        invalidate_blacklist_index()
@@ -1,21 +1,51 @@
+import json
 import random
+import threading
+import time
 import warnings
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+
+import rsa
 
 from django.contrib.auth import get_user_model
-from django.contrib.auth.hashers import check_password
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, check_password
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import EmailMessage
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import connection
+from django.template.loader import render_to_string
+from django.test import Client, SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from faker import Faker
 from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient, APITestCase
+from google.auth import crypt, jwt
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
 
+from core import otp as otp_store
+from core.authentication import BLACKLIST_VERSION_KEY, ClaimsRefreshToken, ClaimsUser, compact_tokens
+from core.buffers import WriteBehindBuffer, last_logins
+from core.choices import (AUTH_PROVIDER_EMAIL, AUTH_PROVIDER_GOOGLE, OTP_ACTIVATION, OTP_EMAIL_CHANGE,
+                          OTP_PASSWORD_CHANGE)
+from core.email_templates import compiled
+from core.google import Google, GoogleCerts
+from core.mailer import EmailWorkerPool
 from core.models import Otp
+from core.oauth_funcs import register_social_user
+from core.otp import OTP_LIFETIMES
 
 
 class Authentication(APITestCase):
     def setUp(self):
         warnings.filterwarnings("ignore")
+        cache.clear()
 
         # URLs
         self.change_email = reverse("change_email")
@@ -29,9 +59,7 @@ class Authentication(APITestCase):
         self.logout = reverse("logout")
 
         # values
-        self.code = random.randint(1000, 9999)
         self.fake = Faker()
-        self.expiry_date = timezone.now() + timezone.timedelta(minutes=15)
         self.user_data = {
             "full_name": "John Doe",
             "email": "lookouttest91@zohomail.com",
@@ -52,7 +80,7 @@ class Authentication(APITestCase):
         self.assertEqual(registration_response.status_code, status.HTTP_201_CREATED)
         # Below are variables being used by other functions
         self.user = self.User.objects.get(email=registration_response.data["data"]["email"])
-        self.generated_code = Otp.objects.create(user=self.user, code=self.code, expiry_date=self.expiry_date)
+        self.generated_code = otp_store.issue(self.user, OTP_ACTIVATION)
 
     def test_user_can_register_with_data_and_cannot_authenticate_with_incorrect_verification_code(self):
         self.test_user_can_register_with_data()
@@ -66,7 +94,7 @@ class Authentication(APITestCase):
 
         # verify email
         user = self.user
-        verification_data = {"email": user.email, "code": self.generated_code.code}
+        verification_data = {"email": user.email, "code": self.generated_code}
         verification_response = self.client.post(self.verify_email, verification_data, format="json")
         self.assertEqual(verification_response.status_code, status.HTTP_200_OK)
 
@@ -127,8 +155,8 @@ class Authentication(APITestCase):
         self.test_get_authenticated_user_token_credentials()
         new_email = self.fake.email()
         user = self.login_response
-        generated_code = Otp.objects.create(user=user, code=self.code, expiry_date=self.expiry_date)
-        response = self.token_client.post(self.change_email, {"code": generated_code.code, "email": new_email},
+        generated_code = otp_store.issue(user, OTP_EMAIL_CHANGE)
+        response = self.token_client.post(self.change_email, {"code": generated_code, "email": new_email},
                                           format="json")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
@@ -158,8 +186,8 @@ class Authentication(APITestCase):
         self.test_get_authenticated_user_token_credentials()
         new_password = random.randint(100000, 999999)
         user = self.login_response
-        generated_code = Otp.objects.create(user=user, code=self.code, expiry_date=self.expiry_date)
-        response = self.token_client.post(self.change_password, {"code": generated_code.code, "password": new_password},
+        generated_code = otp_store.issue(user, OTP_PASSWORD_CHANGE)
+        response = self.token_client.post(self.change_password, {"code": generated_code, "password": new_password},
                                           format="json")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
@@ -169,4 +197,474 @@ class Authentication(APITestCase):
         response = self.token_client.post(self.logout, {"refresh": user.data["tokens"]["refresh"]}, user=user,
                                           token=user.data["tokens"]["access"], format="json")
         print(response.data)
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ClaimsAuthenticationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email="claims@example.com", full_name="Jane Doe",
+                                                         password="string", is_verified=True, gender="F")
+        response = self.client.post(reverse("login"), {"email": self.user.email, "password": "string"}, format="json")
+        self.tokens = response.data["tokens"]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.tokens['access']}")
+
+    def test_requests_are_authenticated_without_loading_the_user(self):
+        with mock.patch("core.authentication.cache_is_shared", return_value=True), self.assertNumQueries(1):
+            response = self.client.get(reverse("notifications"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_revocations_reach_processes_with_their_own_cache(self):
+        self.user.set_password("new password")
+        self.user.save()
+        # Another process's LocMemCache never saw the revocation
+        cache.clear()
+        response = self.client.get(reverse("notifications"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_claims_user_falls_back_to_the_database_for_other_fields(self):
+        user = ClaimsUser(AccessToken(self.tokens["access"]))
+        self.assertEqual(user.email, self.user.email)
+        with self.assertNumQueries(1):
+            self.assertEqual((user.gender, user.gender), ("F", "F"))
+
+    def test_login_hashes_the_password_once(self):
+        with mock.patch.object(PBKDF2PasswordHasher, "verify", autospec=True,
+                               side_effect=PBKDF2PasswordHasher.verify) as verify:
+            response = self.client.post(reverse("login"), {"email": self.user.email, "password": "string"},
+                                        format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(verify.call_count, 1)
+        self.assertEqual(AccessToken(response.data["tokens"]["access"])["email"], self.user.email)
+
+    def test_changing_the_user_revokes_issued_tokens(self):
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(reverse("notifications"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_tokens_issued_right_after_a_change_are_accepted(self):
+        self.user.full_name = "Jane Smith"
+        self.user.save()
+        response = self.client.post(reverse("login"), {"email": self.user.email, "password": "string"}, format="json")
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['tokens']['access']}")
+        response = self.client.get(reverse("notifications"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_refresh_issues_up_to_date_claims(self):
+        self.user.full_name = "Jane Smith"
+        self.user.save()
+        response = self.client.post(reverse("refresh_token"), {"refresh": self.tokens["refresh"]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(AccessToken(response.data["token"])["full_name"], "Jane Smith")
+
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.post(reverse("refresh_token"), {"refresh": self.tokens["refresh"]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class LoginBenchmarkTests(TransactionTestCase):
+    """
+    CPU spent per login while several clients log in at once, against the cost of hashing the password
+    once. Logging in used to hash it twice.
+    """
+    threads = 4
+    logins_per_thread = 3
+
+    def test_concurrent_logins_cost_a_single_hash_each(self):
+        cache.clear()
+        users = [get_user_model().objects.create_user(email=f"bench{index}@example.com", full_name="Jane Doe",
+                                                      password="string", is_verified=True)
+                 for index in range(self.threads)]
+        one_hash = []
+        for _ in range(3):
+            start = time.process_time()
+            check_password("string", users[0].password)
+            one_hash.append(time.process_time() - start)
+
+        statuses = []
+        start_line = threading.Barrier(self.threads)
+
+        def log_in(user):
+            client = Client()
+            start_line.wait()
+            try:
+                for _ in range(self.logins_per_thread):
+                    statuses.append(client.post(reverse("login"), {"email": user.email, "password": "string"},
+                                                content_type="application/json").status_code)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=log_in, args=(user,)) for user in users]
+        start = time.process_time()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        per_login = (time.process_time() - start) / len(statuses)
+
+        self.assertEqual(statuses, [status.HTTP_200_OK] * self.threads * self.logins_per_thread)
+        # Halfway between one hash and the two the old flow spent, clear of the noise of a loaded machine
+        self.assertLess(per_login, 1.75 * sorted(one_hash)[1])
+
+
+class TokenBlacklistTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email="blacklist@example.com", full_name="Jane Doe",
+                                                         password="string", is_verified=True)
+        response = self.client.post(reverse("login"), {"email": self.user.email, "password": "string"}, format="json")
+        self.tokens = response.data["tokens"]
+
+    def test_blacklist_checks_are_answered_from_memory(self):
+        ClaimsRefreshToken(self.tokens["refresh"])
+        with mock.patch("core.authentication.cache_is_shared", return_value=True), self.assertNumQueries(0):
+            ClaimsRefreshToken(self.tokens["refresh"]).check_blacklist()
+
+    def test_tokens_blacklisted_by_another_process_are_rejected(self):
+        token = ClaimsRefreshToken(self.tokens["refresh"])
+        loaded_version = cache.get(BLACKLIST_VERSION_KEY)
+        token.blacklist()
+        # Another process's LocMemCache never saw the new blacklist version
+        cache.set(BLACKLIST_VERSION_KEY, loaded_version, None)
+        response = self.client.post(reverse("refresh_token"), {"refresh": self.tokens["refresh"]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_logged_out_refresh_token_is_rejected(self):
+        ClaimsRefreshToken(self.tokens["refresh"])
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.tokens['access']}")
+        response = self.client.post(reverse("logout"), {"refresh": self.tokens["refresh"]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.post(reverse("refresh_token"), {"refresh": self.tokens["refresh"]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_compacting_deletes_expired_tokens_only(self):
+        token = ClaimsRefreshToken(self.tokens["refresh"])
+        token.blacklist()
+        expired = OutstandingToken.objects.create(user=self.user, jti="expired", token="expired",
+                                                  expires_at=timezone.now() - timezone.timedelta(days=1))
+        BlacklistedToken.objects.create(token=expired)
+
+        self.assertEqual(compact_tokens(chunk_size=1), 1)
+        self.assertEqual(list(OutstandingToken.objects.values_list("jti", flat=True)), [token["jti"]])
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
+
+
+class OtpStoreTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email="otp@example.com", full_name="Jane Doe",
+                                                         password="string")
+
+    def test_new_code_replaces_the_previous_one(self):
+        otp_store.issue(self.user, OTP_ACTIVATION)
+        code = otp_store.issue(self.user, OTP_ACTIVATION)
+        otp_store.issue(self.user, OTP_PASSWORD_CHANGE)
+        self.assertEqual(Otp.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(otp_store.DatabaseOtps.get(self.user.id, OTP_ACTIVATION).code, code)
+
+    def test_code_is_read_with_one_query_on_a_cache_miss(self):
+        code = otp_store.issue(self.user, OTP_EMAIL_CHANGE)
+        cache.clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(otp_store.DatabaseOtps.get(self.user.id, OTP_EMAIL_CHANGE).code, code)
+        with self.assertNumQueries(0):
+            self.assertEqual(otp_store.DatabaseOtps.get(self.user.id, OTP_EMAIL_CHANGE).code, code)
+
+    def test_expired_codes_are_reported_and_purged(self):
+        otp_store.issue(self.user, OTP_ACTIVATION)
+        otp_store.issue(self.user, OTP_EMAIL_CHANGE)
+        Otp.objects.filter(purpose=OTP_ACTIVATION).update(expiry_date=timezone.now() - timezone.timedelta(minutes=1))
+        cache.clear()
+        self.assertTrue(otp_store.DatabaseOtps.get(self.user.id, OTP_ACTIVATION).expired)
+
+        self.assertEqual(otp_store.purge_expired(chunk_size=1), 1)
+        self.assertEqual(list(Otp.objects.values_list("purpose", flat=True)), [OTP_EMAIL_CHANGE])
+
+
+class EmailWorkerPoolTests(APITestCase):
+    def setUp(self):
+        mail.outbox = []
+        self.pool = EmailWorkerPool(workers=1, batch_size=10, backoff=0, idle_timeout=1)
+
+    def messages(self, count):
+        return [EmailMessage(subject=f"Email {i}", body="Body", to=[f"user{i}@example.com"]) for i in range(count)]
+
+    def test_queued_emails_share_a_connection(self):
+        with mock.patch("core.mailer.get_connection", wraps=mail.get_connection) as get_connection:
+            self.pool.send(*self.messages(5))
+            self.assertTrue(self.pool.wait(timeout=5))
+        self.assertEqual(sorted(message.subject for message in mail.outbox), [f"Email {i}" for i in range(5)])
+        self.assertLessEqual(get_connection.call_count, 2)
+        stats = self.pool.stats()
+        self.assertEqual((stats["queued"], stats["sent"], stats["failed"]), (0, 5, 0))
+
+    def test_failed_batches_are_retried_then_given_up_on(self):
+        send_messages, calls = EmailBackend.send_messages, []
+
+        def fail_once(backend, messages):
+            calls.append(messages)
+            if len(calls) == 1:
+                raise OSError
+            return send_messages(backend, messages)
+
+        with mock.patch.object(EmailBackend, "send_messages", autospec=True, side_effect=fail_once):
+            self.pool.send(*self.messages(1))
+            self.assertTrue(self.pool.wait(timeout=5))
+        self.assertEqual((len(calls), len(mail.outbox)), (2, 1))
+
+        with mock.patch.object(EmailBackend, "send_messages", side_effect=OSError):
+            self.pool.send(*self.messages(1))
+            self.assertTrue(self.pool.wait(timeout=5))
+        self.assertEqual(self.pool.stats()["failed"], 1)
+
+
+class CompiledEmailTests(APITestCase):
+    def test_compiled_templates_render_like_the_template_engine(self):
+        contexts = [{"full_name": "Jane <Doe>", "code": 1234}, {"full_name": "John Doe", "code": 9876}]
+        for template in ("activation_email.html", "email_change.html", "password_reset.html",
+                         "verification_email.html"):
+            self.assertEqual(compiled(template).render_many(contexts),
+                             [render_to_string(template, context) for context in contexts])
+
+
+class GoogleTokenTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.keys = {key_id: rsa.newkeys(1024) for key_id in ("old", "new")}
+        cls.published = ["old"]
+        cls.requests = []
+        keys, published, requests = cls.keys, cls.published, cls.requests
+
+        class KeyServer(BaseHTTPRequestHandler):
+            def do_GET(self):
+                requests.append(self.path)
+                body = json.dumps({key_id: keys[key_id][0].save_pkcs1().decode() for key_id in published}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Cache-Control", "public, max-age=3600")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        cls.server = HTTPServer(("127.0.0.1", 0), KeyServer)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        del self.requests[:], self.published[1:]
+        certs = GoogleCerts(f"http://127.0.0.1:{self.server.server_port}/certs")
+        patcher = mock.patch("core.google.google_certs", certs)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def token(self, key_id="old", **claims):
+        now = int(time.time())
+        payload = {"iss": "https://accounts.google.com", "sub": "1", "email": "jane@example.com", "iat": now,
+                   "exp": now + 300, **claims}
+        signer = crypt.RSASigner.from_string(self.keys[key_id][1].save_pkcs1().decode(), key_id=key_id)
+        return jwt.encode(signer, payload).decode()
+
+    def test_certificates_are_downloaded_once_while_fresh(self):
+        self.assertEqual(Google.validate(self.token())["sub"], "1")
+        self.assertEqual(Google.validate(self.token(sub="2"))["sub"], "2")
+        self.assertEqual(len(self.requests), 1)
+
+    def test_unknown_key_triggers_a_new_download(self):
+        Google.validate(self.token())
+        self.published.append("new")
+        self.assertEqual(Google.validate(self.token(key_id="new"))["sub"], "1")
+        self.assertEqual(len(self.requests), 2)
+
+    def test_tokens_not_issued_by_google_are_rejected(self):
+        self.assertIsInstance(Google.validate(self.token(iss="https://example.com")), str)
+        self.assertIsInstance(Google.validate(self.token()[:-4] + "AAAA"), str)
+
+
+class SocialSignInTests(APITestCase):
+    def user_queries(self, queries):
+        return [query["sql"] for query in queries if '"core_user"' in query["sql"]]
+
+    def test_sign_up_and_sign_in_need_one_user_lookup_and_no_hashing(self):
+        with mock.patch("django.contrib.auth.hashers.PBKDF2PasswordHasher.encode") as encode, \
+                CaptureQueriesContext(connection) as sign_up:
+            data = register_social_user(AUTH_PROVIDER_GOOGLE, "1", "jane@example.com", "Jane Doe")
+        user = get_user_model().objects.get(email="jane@example.com")
+        self.assertEqual((data["full_name"], user.auth_provider, user.is_verified),
+                         ("Jane Doe", AUTH_PROVIDER_GOOGLE, True))
+        self.assertFalse(user.has_usable_password())
+        self.assertEqual(len(self.user_queries(sign_up.captured_queries)), 3)
+
+        with CaptureQueriesContext(connection) as sign_in:
+            data = register_social_user(AUTH_PROVIDER_GOOGLE, "1", "jane@example.com", "Jane Doe")
+        self.assertEqual(len(self.user_queries(sign_in.captured_queries)), 1)
+        self.assertEqual(AccessToken(data["tokens"]["access"])["email"], "jane@example.com")
+        encode.assert_not_called()
+
+    def test_taken_names_are_replaced_by_a_generated_one(self):
+        get_user_model().objects.create_user(email="jane@example.com", full_name="Jane Doe", password="string")
+        data = register_social_user(AUTH_PROVIDER_GOOGLE, "1", "other.jane@example.com", "Jane Doe")
+        self.assertNotEqual(data["full_name"], "Jane Doe")
+        self.assertEqual(len(data["full_name"].split()), 2)
+
+    def test_accounts_from_another_provider_are_refused(self):
+        get_user_model().objects.create_user(email="jane@example.com", full_name="Jane Doe", password="string")
+        with self.assertRaisesMessage(AuthenticationFailed, AUTH_PROVIDER_EMAIL):
+            register_social_user(AUTH_PROVIDER_GOOGLE, "1", "jane@example.com", "Jane Doe")
+
+
+class AsyncAuthViewTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_register_login_and_change_password(self):
+        response = self.client.post(reverse("async_register"), {"full_name": "Jane Doe", "email": "async@example.com",
+                                                                "password": "string"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        user = get_user_model().objects.get(email="async@example.com")
+        self.assertTrue(user.check_password("string"))
+
+        login = {"email": user.email, "password": "string"}
+        response = self.client.post(reverse("async_login"), login, format="json")
+        self.assertEqual(response.json()["message"], "Email is not verified")
+        user.is_verified = True
+        user.save()
+        response = self.client.post(reverse("async_login"), {**login, "password": "wrong!"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse("async_login"), login, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        access = response.json()["tokens"]["access"]
+
+        code = otp_store.issue(user, OTP_PASSWORD_CHANGE)
+        response = self.client.post(reverse("async_change_password"), {"code": code, "password": "changed"},
+                                    format="json")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post(reverse("async_change_password"), {"code": code, "password": "changed"},
+                                    format="json", HTTP_AUTHORIZATION=f"Bearer {access}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        user.refresh_from_db()
+        self.assertTrue(user.check_password("changed"))
+
+    def test_registering_an_existing_email_fails(self):
+        get_user_model().objects.create_user(email="async@example.com", full_name="Jane Doe", password="string")
+        response = self.client.post(reverse("async_register"), {"full_name": "Jane Doe", "email": "async@example.com",
+                                                                "password": "string"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ThrottlingTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        rates = {"login_ip": "6/min", "login_email": "2/min"}
+        patcher = mock.patch.dict("rest_framework.settings.api_settings.DEFAULT_THROTTLE_RATES", rates)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def login(self, email):
+        return self.client.post(reverse("login"), {"email": email, "password": "string"}, format="json")
+
+    def test_requests_are_limited_per_email_and_per_address(self):
+        self.assertEqual([self.login("a@example.com").status_code for _ in range(3)], [400, 400, 429])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.login("a@example.com").status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        self.assertEqual([self.login(f"{i}@example.com").status_code for i in range(3)], [400, 400, 429])
+
+    def test_code_checks_are_limited_per_account(self):
+        user = get_user_model().objects.create_user(email="guess@example.com", full_name="Jane Doe",
+                                                    password="string", is_verified=True)
+        otp_store.issue(user, OTP_PASSWORD_CHANGE)
+        rates = {"otp_check_user": "3/hour", "otp_check_email": "3/hour"}
+        with mock.patch.dict("rest_framework.settings.api_settings.DEFAULT_THROTTLE_RATES", rates):
+            self.client.force_authenticate(user=user)
+            guesses = [self.client.post(reverse("change_password"), {"code": code, "password": "changed"},
+                                        format="json").status_code for code in range(1000, 1004)]
+            self.assertEqual(guesses, [400, 400, 400, 429])
+
+            access = ClaimsRefreshToken.for_user(user).access_token
+            response = self.client.post(reverse("async_change_password"), {"code": 1004, "password": "changed"},
+                                        format="json", HTTP_AUTHORIZATION=f"Bearer {access}")
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertIn("Retry-After", response)
+
+            self.client.force_authenticate(user=None)
+            guesses = [self.client.post(reverse("verify_email"), {"email": user.email, "code": code},
+                                        format="json").status_code for code in range(1000, 1004)]
+            self.assertEqual(guesses[-1], status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_buckets_refill_over_time(self):
+        self.login("a@example.com")
+        self.login("a@example.com")
+        with mock.patch("core.throttling.time.time", return_value=time.time() + 31):
+            self.assertEqual(self.login("a@example.com").status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(self.login("a@example.com").status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+
+@override_settings(OTP_MODE="signed")
+class SignedOtpTests(APITestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email="signed@example.com", full_name="Jane Doe",
+                                                         password="string")
+
+    def test_codes_are_issued_and_checked_without_queries(self):
+        with self.assertNumQueries(0):
+            code = otp_store.issue(self.user, OTP_PASSWORD_CHANGE)
+            self.assertEqual(otp_store.check(self.user, OTP_PASSWORD_CHANGE, code), otp_store.OTP_VALID)
+            self.assertNotEqual(otp_store.check(self.user, OTP_EMAIL_CHANGE, code), otp_store.OTP_VALID)
+        self.assertFalse(Otp.objects.exists())
+
+    def test_codes_expire(self):
+        code = otp_store.issue(self.user, OTP_ACTIVATION)
+        later = time.time() + 2 * OTP_LIFETIMES[OTP_ACTIVATION].total_seconds()
+        with mock.patch("core.otp.time.time", return_value=later):
+            self.assertEqual(otp_store.check(self.user, OTP_ACTIVATION, code), otp_store.OTP_EXPIRED)
+
+    def test_codes_stop_working_once_used(self):
+        code = otp_store.issue(self.user, OTP_PASSWORD_CHANGE)
+        self.user.set_password("changed")
+        self.assertEqual(otp_store.check(self.user, OTP_PASSWORD_CHANGE, code), otp_store.OTP_INCORRECT)
+
+    def test_password_can_be_changed_with_a_signed_code(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+        code = otp_store.issue(self.user, OTP_PASSWORD_CHANGE)
+        response = self.client.post(reverse("change_password"), {"code": code, "password": "changed"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(reverse("change_password"), {"code": code, "password": "again!"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class WriteBehindBufferTests(APITestCase):
+    def setUp(self):
+        self.users = [get_user_model().objects.create_user(email=f"user{i}@example.com", full_name="Jane Doe",
+                                                           password="string", is_verified=True) for i in range(3)]
+
+    def test_updates_are_written_together(self):
+        buffer = WriteBehindBuffer(get_user_model(), interval=60)
+        now = timezone.now()
+        with self.assertNumQueries(0):
+            for minutes, user in enumerate(self.users * 2):
+                buffer.record(user.pk, last_login=now + timezone.timedelta(minutes=minutes))
+        with self.assertNumQueries(1):
+            self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(list(get_user_model().objects.order_by("email").values_list("last_login", flat=True)),
+                         [now + timezone.timedelta(minutes=minutes) for minutes in (3, 4, 5)])
+
+    def test_login_buffers_last_login(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse("login"), {"email": self.users[0].email, "password": "string"},
+                                        format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries.captured_queries if query["sql"].startswith("UPDATE")])
+        last_logins.flush()
+        self.users[0].refresh_from_db()
+        self.assertIsNotNone(self.users[0].last_login)
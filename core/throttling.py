@@ -0,0 +1,91 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {"s": 1, "m": 60, "h": 60 * 60, "d": 60 * 60 * 24}
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token bucket shared by every process through the cache. The view's ``throttle_scope`` and the throttle's
+    ``key_kind`` name the rate in ``DEFAULT_THROTTLE_RATES``, e.g. "login_ip": "20/min" allows bursts of 20
+    requests, refilled at one every three seconds.
+
+    The bucket is kept as a single timestamp, the moment it will be full again (the generic cell rate
+    algorithm), so a check is one cache read and, when allowed, one write. Concurrent requests may both
+    pass on the same token; the bucket is a bound on abuse, not an exact quota.
+    """
+    key_kind = None
+
+    def get_ident_key(self, request):
+        raise NotImplementedError(".get_ident_key() must be overridden")
+
+    def allow_request(self, request, view):
+        scope = getattr(view, "throttle_scope", None)
+        if not api_settings.DEFAULT_THROTTLE_RATES.get(f"{scope}_{self.key_kind}"):
+            return True
+        ident = self.get_ident_key(request)
+        return ident is None or self.consume(scope, ident)
+
+    def consume(self, scope, ident):
+        """
+        Take a token from the bucket of ``ident`` for ``scope``. Returns whether there was one; when there
+        wasn't, ``wait()`` tells how long until there is.
+        """
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(f"{scope}_{self.key_kind}")
+        if not rate:
+            return True
+        capacity, period = rate.split("/")
+        capacity, period = int(capacity), PERIODS[period[0]]
+        interval = period / capacity
+        key = f"throttle:{scope}:{self.key_kind}:{ident}"
+        now = time.time()
+        full_at = max(cache.get(key, now), now)
+        if full_at - now > period - interval:
+            self.wait_time = full_at - now - (period - interval)
+            return False
+        cache.set(key, full_at + interval, int(full_at + interval - now) + 1)
+        return True
+
+    def wait(self):
+        return getattr(self, "wait_time", None)
+
+
+class IPTokenBucketThrottle(TokenBucketThrottle):
+    key_kind = "ip"
+
+    def get_ident_key(self, request):
+        return self.get_ident(request)
+
+
+class EmailTokenBucketThrottle(TokenBucketThrottle):
+    """
+    Buckets by the email the request is about, so spreading requests for one account over many addresses
+    doesn't help. Requests without an email are left to the other throttles.
+    """
+    key_kind = "email"
+
+    def get_ident_key(self, request):
+        email = request.data.get("email") if hasattr(request.data, "get") else None
+        if not isinstance(email, str) or not email:
+            return None
+        return hashlib.sha256(email.strip().lower().encode()).hexdigest()
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """
+    Buckets by the authenticated user, for requests about the user's own account whatever else they carry.
+    """
+    key_kind = "user"
+
+    def get_ident_key(self, request):
+        return request.user.pk if request.user and request.user.is_authenticated else None
+
+
+AUTH_THROTTLES = [IPTokenBucketThrottle, EmailTokenBucketThrottle]
+
+# For the views checking one-time codes: with few enough guesses per account, guessing a code is hopeless
+OTP_CHECK_THROTTLES = [IPTokenBucketThrottle, EmailTokenBucketThrottle, UserTokenBucketThrottle]
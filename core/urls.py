@@ -1,9 +1,12 @@
 from django.urls import path
 
-from core import views
+from core import async_views, views
 from core.utils import GoogleSocialAuthView
 
 urlpatterns = [
+    path('async/change-password/', async_views.change_password, name="async_change_password"),
+    path('async/login/', async_views.login, name="async_login"),
+    path('async/register/', async_views.register, name="async_register"),
     path('change-email/', views.ChangeEmailView.as_view(), name="change_email"),
     path('change-password/', views.ChangePasswordView.as_view(), name="change_password"),
     path('google/', GoogleSocialAuthView.as_view(), name="google_auth"),
@@ -4,16 +4,22 @@ from rest_framework import status
 from rest_framework.generics import GenericAPIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from rest_framework_simplejwt.serializers import TokenBlacklistSerializer, TokenObtainPairSerializer, \
-    TokenRefreshSerializer
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.views import TokenBlacklistView, TokenObtainPairView, TokenRefreshView
 
+from core import otp as otp_store
+from core.authentication import token_pair
+from core.buffers import record_login
+from core.choices import OTP_ACTIVATION, OTP_EMAIL_CHANGE, OTP_PASSWORD_CHANGE
 from core.emails import Util
 from core.models import User
 from core.permissions import IsNotAuthenticated
-from core.serializers import ChangeEmailSerializer, ChangePasswordSerializer, LoginSerializer, RegisterSerializer, \
-    RequestEmailChangeCodeSerializer, RequestNewPasswordCodeSerializer, ResendEmailVerificationSerializer, \
-    VerifySerializer
+from core.serializers import (ChangeEmailSerializer, ChangePasswordSerializer, ClaimsTokenBlacklistSerializer,
+                              ClaimsTokenObtainPairSerializer, ClaimsTokenRefreshSerializer, LoginSerializer,
+                              RegisterSerializer, RequestEmailChangeCodeSerializer, RequestNewPasswordCodeSerializer,
+                              ResendEmailVerificationSerializer, VerifySerializer)
+from core.throttling import AUTH_THROTTLES, OTP_CHECK_THROTTLES
 
 
 # Create your views here.
@@ -22,6 +28,8 @@ from core.serializers import ChangeEmailSerializer, ChangePasswordSerializer, Lo
 class ChangeEmailView(GenericAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = ChangeEmailSerializer
+    throttle_classes = OTP_CHECK_THROTTLES
+    throttle_scope = "otp_check"
 
     @extend_schema(
             summary="Change Email Endpoint",
@@ -46,15 +54,9 @@ class ChangeEmailView(GenericAPIView):
             user = User.objects.get(email=email)
         except User.DoesNotExist:
             return Response({"message": "Account not found", "status": "failed"}, status=status.HTTP_404_NOT_FOUND)
-        otp = user.otp.first()
-        if otp is None or otp.code is None:
-            return Response({"message": "No OTP found for this account", "status": "failed"},
-                            status=status.HTTP_400_BAD_REQUEST)
-        elif otp.code != code:
-            return Response({"message": "Code is not correct", "status": "failed"}, status=status.HTTP_400_BAD_REQUEST)
-        elif otp.expired:
-            otp.delete()
-            return Response({"message": "Code has expired. Request for another", "status": "failed"},
+        result = otp_store.check(user, OTP_EMAIL_CHANGE, code)
+        if result != otp_store.OTP_VALID:
+            return Response({"message": otp_store.OTP_MESSAGES[result], "status": "failed"},
                             status=status.HTTP_400_BAD_REQUEST)
 
         if user.email == new_email:
@@ -65,7 +67,7 @@ class ChangeEmailView(GenericAPIView):
         user.email_changed = True
         user.is_verified = False
         user.save()
-        otp.delete()
+        otp_store.discard(user, OTP_EMAIL_CHANGE)
         if not user.is_verified:
             Util.email_activation(user)
         return Response(
@@ -76,6 +78,8 @@ class ChangeEmailView(GenericAPIView):
 class ChangePasswordView(GenericAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = ChangePasswordSerializer
+    throttle_classes = OTP_CHECK_THROTTLES
+    throttle_scope = "otp_check"
 
     @extend_schema(
             summary="Change Password Endpoint",
@@ -100,15 +104,9 @@ class ChangePasswordView(GenericAPIView):
             user = User.objects.get(email=email)
         except User.DoesNotExist:
             return Response({"message": "Account not found", "status": "failed"}, status=status.HTTP_404_NOT_FOUND)
-        otp = user.otp.first()
-        if otp is None or otp.code is None:
-            return Response({"message": "No OTP found for this account", "status": "failed"},
-                            status=status.HTTP_400_BAD_REQUEST)
-        elif otp.code != code:
-            return Response({"message": "Code is not correct", "status": "failed"}, status=status.HTTP_400_BAD_REQUEST)
-        elif otp.expired:
-            otp.delete()
-            return Response({"message": "Code has expired. Request for another", "status": "failed"},
+        result = otp_store.check(user, OTP_PASSWORD_CHANGE, code)
+        if result != otp_store.OTP_VALID:
+            return Response({"message": otp_store.OTP_MESSAGES[result], "status": "failed"},
                             status=status.HTTP_400_BAD_REQUEST)
 
         if user.check_password(password):
@@ -117,12 +115,14 @@ class ChangePasswordView(GenericAPIView):
 
         user.set_password(password)
         user.save()
-        otp.delete()
+        otp_store.discard(user, OTP_PASSWORD_CHANGE)
         return Response({"message": "Password updated successfully", "status": "success"}, status=status.HTTP_200_OK)
 
 
 class LoginView(TokenObtainPairView):
-    serializer_class = TokenObtainPairSerializer
+    serializer_class = ClaimsTokenObtainPairSerializer
+    throttle_classes = AUTH_THROTTLES
+    throttle_scope = "login"
 
     @extend_schema(
             summary="Login Endpoint",
@@ -153,20 +153,21 @@ class LoginView(TokenObtainPairView):
             return Response({"message": "Account is not active, contact the admin", "status": "failed"},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        tokens = super().post(request)
-        print(request.user.is_authenticated)
-        return Response({"message": "Logged in successfully", "tokens": tokens.data,
+        if api_settings.UPDATE_LAST_LOGIN:
+            record_login(user)
+        # Minted from the user authenticated above; going through the serializer would hash the password again
+        return Response({"message": "Logged in successfully", "tokens": token_pair(user),
                          "data": {"email": user.email, "full_name": user.full_name}, "status": "success"},
                         status=status.HTTP_200_OK)
 
 
 class LogoutView(TokenBlacklistView):
-    serializer_class = TokenBlacklistSerializer
+    serializer_class = ClaimsTokenBlacklistSerializer
 
     @extend_schema(
             summary="Logout Endpoint",
             description="This endpoint logs out an authenticated user.",
-            request=TokenBlacklistSerializer,
+            request=ClaimsTokenBlacklistSerializer,
             responses={
                 200: "Logged out successfully.",
                 500: "Internal server error."
@@ -180,12 +181,12 @@ class LogoutView(TokenBlacklistView):
 
 
 class RefreshView(TokenRefreshView):
-    serializer_class = TokenRefreshSerializer
+    serializer_class = ClaimsTokenRefreshSerializer
 
     @extend_schema(
             summary="Refresh token Endpoint",
             description="This endpoint refreshes an access token",
-            request=TokenRefreshSerializer,
+            request=ClaimsTokenRefreshSerializer,
             responses={
                 200: "Refreshed successfully.",
                 500: "Internal server error."
@@ -194,7 +195,10 @@ class RefreshView(TokenRefreshView):
     )
     def post(self, request, *args, **kwargs):
         serializer = self.serializer_class(data=request.data)
-        serializer.is_valid(raise_exception=True)
+        try:
+            serializer.is_valid(raise_exception=True)
+        except TokenError as error:
+            raise InvalidToken(error.args[0])
         access_token = serializer.validated_data['access']
         return Response({"message": "Refreshed successfully", "token": access_token, "status": "success"},
                         status=status.HTTP_200_OK)
@@ -202,6 +206,8 @@ class RefreshView(TokenRefreshView):
 
 class RegisterView(GenericAPIView):
     serializer_class = RegisterSerializer
+    throttle_classes = AUTH_THROTTLES
+    throttle_scope = "register"
 
     @extend_schema(
             summary="Register Endpoint",
@@ -228,6 +234,8 @@ class RegisterView(GenericAPIView):
 class RequestEmailChangeCodeView(GenericAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = RequestEmailChangeCodeSerializer
+    throttle_classes = AUTH_THROTTLES
+    throttle_scope = "otp"
 
     @extend_schema(
             summary="Request Email Change code Endpoint",
@@ -256,6 +264,8 @@ class RequestEmailChangeCodeView(GenericAPIView):
 
 class ResendEmailVerificationView(GenericAPIView):
     serializer_class = ResendEmailVerificationSerializer
+    throttle_classes = AUTH_THROTTLES
+    throttle_scope = "otp"
 
     @extend_schema(
             summary="Resend Email Verification Code Endpoint",
@@ -288,6 +298,8 @@ class ResendEmailVerificationView(GenericAPIView):
 class RequestNewPasswordCodeView(GenericAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = RequestNewPasswordCodeSerializer
+    throttle_classes = AUTH_THROTTLES
+    throttle_scope = "otp"
 
     @extend_schema(
             summary="Request New Password Endpoint",
@@ -319,6 +331,8 @@ class RequestNewPasswordCodeView(GenericAPIView):
 
 class VerifyEmailView(GenericAPIView):
     serializer_class = VerifySerializer
+    throttle_classes = OTP_CHECK_THROTTLES
+    throttle_scope = "otp_check"
 
     @extend_schema(
             summary="Verify Email Endpoint",
@@ -343,23 +357,17 @@ class VerifyEmailView(GenericAPIView):
         except User.DoesNotExist:
             return Response({"message": "Account not found", "status": "failed"}, status=status.HTTP_404_NOT_FOUND)
 
-        otp = user.otp.first()
-        if otp is None or otp.code is None:
-            return Response({"message": "No OTP found for this account", "status": "failed"},
-                            status=status.HTTP_400_BAD_REQUEST)
-        elif otp.code != code:
-            return Response({"message": "Code is not correct", "status": "failed"}, status=status.HTTP_400_BAD_REQUEST)
-        elif otp.expired:
-            otp.delete()
-            return Response({"message": "Code has expired. Request for another", "status": "failed"},
+        result = otp_store.check(user, OTP_ACTIVATION, code)
+        if result != otp_store.OTP_VALID:
+            return Response({"message": otp_store.OTP_MESSAGES[result], "status": "failed"},
                             status=status.HTTP_400_BAD_REQUEST)
-        elif user.is_verified:
-            otp.delete()
+        if user.is_verified:
+            otp_store.discard(user, OTP_ACTIVATION)
             return Response({"message": "Account already verified. Log in", "status": "success"},
                             status=status.HTTP_200_OK)
 
         user.is_verified = True
-        otp.delete()
+        otp_store.discard(user, OTP_ACTIVATION)
         if not user.email_changed:
             Util.email_verified(user)
         user.save()
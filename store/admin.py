@@ -1,17 +1,27 @@
 from urllib.parse import urlencode
 
 from django.contrib import admin, messages
-from django.db.models import Count
+from django.db.models import Avg, Count, OuterRef, Subquery
 from django.urls import reverse
 from django.utils.html import format_html, mark_safe
 
 from store.forms import ProductAdminForm
 from store.models import *
+from store.pagination import EstimatedCountPaginator
 
 # Register your models here.
 admin.site.register((Size, ItemLocation,))
 
 
+class EstimatedCountAdmin(admin.ModelAdmin):
+    """
+    For tables too large to count on every changelist page: the paginator estimates the total from the table
+    statistics, and the "N total" next to filtered results, another full count, isn't shown.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ("title", "gender", "products_count",)
@@ -48,7 +58,7 @@ class InventoryFilter(admin.SimpleListFilter):
 
     def queryset(self, request, queryset):
         if self.value() == "<20":
-            return queryset.filter(product_color_size_inventory__quantity__lt=20)
+            return queryset.filter(inventory__lt=20)
 
 
 class ProductImageAdmin(admin.TabularInline):
@@ -78,7 +88,17 @@ class ProductAdmin(admin.ModelAdmin):
     ordering = ("title", "category", "percentage_off",)
     readonly_fields = ("product_images",)
     search_fields = ("title", "category__name",)
-    
+
+    def get_queryset(self, request):
+        # A subquery rather than a join with GROUP BY, so the inventory filter can't skew the average
+        ratings = (ProductReview.objects.filter(product=OuterRef("pk")).order_by().values("product")
+                   .annotate(avg=Avg("ratings")).values("avg"))
+        return super().get_queryset(request).annotate(ratings_avg=Subquery(ratings))
+
+    @admin.display(ordering="ratings_avg")
+    def average_ratings(self, obj):
+        return obj.ratings_avg or 0
+
     @staticmethod
     def inventory_status(obj):
         if obj.inventory < 10:
@@ -108,11 +128,11 @@ class ProductAdmin(admin.ModelAdmin):
 
 
 @admin.register(FavoriteProduct)
-class FavoriteProductAdmin(admin.ModelAdmin):
+class FavoriteProductAdmin(EstimatedCountAdmin):
     list_display = ("customer", "product",)
     list_filter = ("product__category",)
     list_per_page = 30
-    list_select_related = ("product",)
+    list_select_related = ("customer", "product__category",)
     ordering = ("customer", "product",)
     search_fields = ("customer__full_name", "product__name",)
 
@@ -133,12 +153,12 @@ class ProductReviewImageAdmin(admin.TabularInline):
 
 
 @admin.register(ProductReview)
-class ProductReviewAdmin(admin.ModelAdmin):
+class ProductReviewAdmin(EstimatedCountAdmin):
     inlines = (ProductReviewImageAdmin,)
     list_display = ("product", "customer", "ratings",)
     list_filter = ("product__title", "product__category",)
     list_per_page = 30
-    list_select_related = ("product__category",)
+    list_select_related = ("customer", "product__category",)
     ordering = ("customer", "ratings",)
     readonly_fields = ("product_review_images",)
     search_fields = ("product__title",)
@@ -156,7 +176,7 @@ class ProductReviewAdmin(admin.ModelAdmin):
 
 
 @admin.register(Notification)
-class NotificationAdmin(admin.ModelAdmin):
+class NotificationAdmin(EstimatedCountAdmin):
     list_display = ("title", "notification_type", "general",)
     list_filter = ("notification_type", "general",)
     list_per_page = 20
@@ -173,6 +193,16 @@ class CouponCodeAdmin(admin.ModelAdmin):
     search_fields = ("price",)
 
 
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ("product", "quantity", "status", "expires_at",)
+    list_filter = ("status",)
+    list_per_page = 30
+    list_select_related = ("product__category",)
+    ordering = ("-expires_at",)
+    search_fields = ("product__title", "group",)
+
+
 class OrderItemInline(admin.TabularInline):
     autocomplete_fields = ["product"]
     min_num = 1
@@ -182,15 +212,44 @@ class OrderItemInline(admin.TabularInline):
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(EstimatedCountAdmin):
     inlines = [OrderItemInline]
-    list_display = ("customer", "transaction_ref", "payment_status", "shipping_status", "placed_at",)
+    list_display = ("customer", "transaction_ref", "total_price", "item_count", "payment_status", "shipping_status",
+                    "placed_at",)
     list_filter = ("payment_status", "shipping_status",)
     list_per_page = 30
-    ordering = ("customer", "transaction_ref", "payment_status", "shipping_status", "placed_at",)
+    list_select_related = ("customer",)
+    ordering = ("-placed_at",)
     search_fields = ("customer__full_name", "transaction_ref", "payment_status", "shipping_status")
 
 
+class SalesRollupAdmin(admin.ModelAdmin):
+    date_hierarchy = "bucket"
+    list_filter = ("period",)
+    list_per_page = 50
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ProductSalesRollup)
+class ProductSalesRollupAdmin(SalesRollupAdmin):
+    list_display = ("product", "period", "bucket", "units", "revenue", "order_count",)
+    list_select_related = ("product__category",)
+    ordering = ("-bucket", "-revenue",)
+    search_fields = ("product__title",)
+
+
+@admin.register(CategorySalesRollup)
+class CategorySalesRollupAdmin(SalesRollupAdmin):
+    list_display = ("category", "period", "bucket", "units", "revenue", "order_count",)
+    list_select_related = ("category",)
+    ordering = ("-bucket", "-revenue",)
+
+
 @admin.register(Country)
 class CountryAdmin(admin.ModelAdmin):
     list_display = ("name", "code",)
@@ -204,6 +263,6 @@ class AddressAdmin(admin.ModelAdmin):
     list_display = ("customer", "first_name", "last_name", "country", "city", "zip_code")
     list_filter = ("country", "city", "zip_code", "customer")
     list_per_page = 20
-    list_select_related = ["country"]
+    list_select_related = ["country", "customer"]
     ordering = ("country__name", "city", "first_name")
     search_fields = ("first_name__istartswith", "last_name__istartswith", "country__name")
@@ -0,0 +1,469 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from decimal import Decimal, ROUND_HALF_UP
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from store.models import Cart, CartItem, Product, build_price_summary
+
+# Relations read by ProductSerializer when it is nested in a cart item
+PRODUCT_PREFETCH = ('images', 'size_inventory__size', 'color_inventory__colour')
+
+logger = logging.getLogger(__name__)
+
+
+def _product_key(product_id):
+    return f"cart:product:{product_id}"
+
+
+def get_product_snapshots(product_ids):
+    """
+    Return ``{product_id: Product}`` with ``PRODUCT_PREFETCH`` already loaded, read from the cache where possible.
+    Products that don't exist are left out. Snapshots are dropped whenever a product or its inventory changes.
+    """
+    product_ids = [str(product_id) for product_id in product_ids]
+    cached = cache.get_many([_product_key(product_id) for product_id in product_ids])
+    products = {product_id: cached[_product_key(product_id)] for product_id in product_ids
+                if _product_key(product_id) in cached}
+    missing = [product_id for product_id in product_ids if product_id not in products]
+    if missing:
+        fetched = {str(product.id): product for product in
+                   Product.objects.filter(id__in=missing).prefetch_related(*PRODUCT_PREFETCH)}
+        cache.set_many({_product_key(product_id): product for product_id, product in fetched.items()},
+                       getattr(settings, "CART_PRODUCT_CACHE_TIMEOUT", 60 * 5))
+        products.update(fetched)
+    return products
+
+
+def get_product_snapshot(product_id):
+    """
+    Single product version of ``get_product_snapshots``. Raises ``Product.DoesNotExist``.
+    """
+    product = get_product_snapshots([product_id]).get(str(product_id))
+    if product is None:
+        raise Product.DoesNotExist
+    return product
+
+
+def invalidate_product_snapshot(product_id):
+    cache.delete(_product_key(product_id))
+
+
+def apply_pricing(item):
+    """
+    Set the same price attributes as ``CartItemQuerySet.with_pricing`` on an item that is not in the database.
+    Expects the product's size and colour inventories to be prefetched.
+    """
+    product = item.product
+    size_extra = next((inventory.extra_price for inventory in product.size_inventory.all()
+                       if inventory.size.title == item.size), None)
+    colour_extra = next((inventory.extra_price for inventory in product.color_inventory.all()
+                         if inventory.colour.name == item.colour), None)
+    cent = Decimal("0.01")
+    price = Decimal(product.price).quantize(cent)
+    item.extra_price = (Decimal(size_extra or 0) + Decimal(colour_extra or 0)).quantize(cent)
+    item.unit_discount = (price * product.percentage_off / 100).quantize(cent, rounding=ROUND_HALF_UP)
+    item.unit_price = price - item.unit_discount + item.extra_price
+    item.line_total = item.unit_price * item.quantity
+    item.line_discount = item.unit_discount * item.quantity
+    return item
+
+
+CART_OPERATION_ADD = "add"
+CART_OPERATION_SET = "set"
+CART_OPERATION_REMOVE = "remove"
+
+# Largest quantity CartItem.quantity (a PositiveSmallIntegerField) can hold
+MAX_LINE_QUANTITY = 32767
+
+
+def apply_operations(lines, operations):
+    """
+    Apply a list of cart operations to ``{product_id: {"size", "colour", "quantity"}}`` in order.
+    ``add`` increments the quantity, ``set`` replaces it and ``remove`` drops the line; a line set to
+    zero is dropped as well and an ``add`` never takes a line past ``MAX_LINE_QUANTITY``.
+    """
+    for operation in operations:
+        product_id = str(operation["product_id"])
+        if operation["op"] == CART_OPERATION_REMOVE:
+            lines.pop(product_id, None)
+            continue
+
+        line = lines.get(product_id, {"size": None, "colour": None, "quantity": 0})
+        quantity = operation["quantity"]
+        if operation["op"] == CART_OPERATION_ADD:
+            quantity = min(quantity + line["quantity"], MAX_LINE_QUANTITY)
+        line = {"size": operation.get("size") or line["size"], "colour": operation.get("colour") or line["colour"],
+                "quantity": quantity}
+        if quantity > 0:
+            lines[product_id] = line
+        else:
+            lines.pop(product_id, None)
+    return lines
+
+
+class BaseCartStorage:
+    """
+    Interface shared by every cart backend.
+
+    All methods take the cart id as a string and hand back ``CartItem`` instances so the
+    serializers don't need to know where a cart actually lives.
+    """
+
+    def add(self, cart_id, product, quantity, size=None, colour=None):
+        """
+        Add ``quantity`` of ``product`` to the cart, creating the cart when ``cart_id`` is None.
+        Returns the resulting cart item; a line whose quantity drops to zero is removed.
+        """
+        raise NotImplementedError
+
+    def update(self, cart_id, product_id, size=None, colour=None):
+        """
+        Change the size and/or colour of an existing line. Raises ``CartItem.DoesNotExist``.
+        """
+        raise NotImplementedError
+
+    def remove(self, cart_id, product_id):
+        """
+        Remove a line from the cart. Raises ``CartItem.DoesNotExist``.
+        """
+        raise NotImplementedError
+
+    def apply_batch(self, cart_id, operations):
+        """
+        Apply ``operations`` (see ``apply_operations``) atomically, creating the cart when ``cart_id`` is None.
+        Returns the cart id.
+        """
+        raise NotImplementedError
+
+    def get_items(self, cart_id):
+        """
+        Return the items of a cart annotated with ``unit_price``, ``line_total`` and ``line_discount``.
+        Raises ``Cart.DoesNotExist``.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def price_summary(items):
+        """
+        Cart totals for items returned by ``get_items``, without going back to the database.
+        """
+        items = list(items)
+        return build_price_summary(sum(item.line_total for item in items),
+                                   sum(item.line_discount for item in items),
+                                   sum(item.quantity for item in items))
+
+    def persist(self, cart_id):
+        """
+        Make sure the cart and its items are stored in the database and return the ``Cart``.
+        """
+        raise NotImplementedError
+
+    def clear(self, cart_id):
+        """
+        Drop the cart and all of its items.
+        """
+        raise NotImplementedError
+
+
+class DatabaseCartStorage(BaseCartStorage):
+    """
+    Stores carts directly in the Cart and CartItem tables.
+    """
+
+    def add(self, cart_id, product, quantity, size=None, colour=None):
+        if cart_id is None:
+            cart = Cart.objects.create()
+        else:
+            cart, _ = Cart.objects.get_or_create(id=cart_id)
+
+        try:
+            item = CartItem.objects.get(cart=cart, product=product)
+            item.quantity += quantity
+            item.size = size or item.size
+            item.colour = colour or item.colour
+        except CartItem.DoesNotExist:
+            item = CartItem(cart=cart, product=product, size=size, colour=colour, quantity=quantity)
+
+        if item.quantity > 0:
+            item.save()
+            return item
+
+        if not item._state.adding:
+            item.delete()
+        if not cart.items.exists():
+            cart.delete()
+        return item
+
+    def update(self, cart_id, product_id, size=None, colour=None):
+        item = CartItem.objects.select_related('product').get(cart_id=cart_id, product_id=product_id)
+        if size:
+            item.size = size
+        if colour:
+            item.colour = colour
+        item.save()
+        return item
+
+    def remove(self, cart_id, product_id):
+        deleted, _ = CartItem.objects.filter(cart_id=cart_id, product_id=product_id).delete()
+        if not deleted:
+            raise CartItem.DoesNotExist
+
+    @transaction.atomic
+    def apply_batch(self, cart_id, operations):
+        if cart_id is None:
+            cart = Cart.objects.create()
+        else:
+            cart, _ = Cart.objects.get_or_create(id=cart_id)
+
+        existing = {str(item.product_id): item for item in CartItem.objects.filter(cart=cart)}
+        lines = {
+            product_id: {"size": item.size, "colour": item.colour, "quantity": item.quantity}
+            for product_id, item in existing.items()
+        }
+        lines = apply_operations(lines, operations)
+
+        to_create, to_update, now = [], [], timezone.now()
+        for product_id, line in lines.items():
+            item = existing.get(product_id)
+            if item is None:
+                to_create.append(CartItem(cart=cart, product_id=product_id, **line))
+            elif (item.size, item.colour, item.quantity) != (line["size"], line["colour"], line["quantity"]):
+                item.size, item.colour, item.quantity = line["size"], line["colour"], line["quantity"]
+                item.updated = now
+                to_update.append(item)
+        to_delete = [item.id for product_id, item in existing.items() if product_id not in lines]
+
+        if to_delete:
+            CartItem.objects.filter(id__in=to_delete).delete()
+        if to_update:
+            CartItem.objects.bulk_update(to_update, ["size", "colour", "quantity", "updated"])
+        if to_create:
+            CartItem.objects.bulk_create(to_create)
+        return str(cart.id)
+
+    def get_items(self, cart_id):
+        cart = Cart.objects.get(id=cart_id)
+        return cart.items.with_pricing().select_related('product').prefetch_related(
+                *(f'product__{lookup}' for lookup in PRODUCT_PREFETCH))
+
+    def persist(self, cart_id):
+        return Cart.objects.get(id=cart_id)
+
+    def clear(self, cart_id):
+        Cart.objects.filter(id=cart_id).delete()
+
+
+class CacheCartStorage(BaseCartStorage):
+    """
+    Keeps carts in the Django cache so mutating a cart doesn't touch the database.
+
+    The cache has to be shared by every process serving the site (Redis or Memcached, see
+    ``CACHE_BACKEND``); with a per-process cache each worker would see a different cart.
+    A mutation takes a short per-cart lock in the cache around its read and write so that two
+    concurrent requests on the same cart can't overwrite each other.
+
+    Carts are written to the database when ``persist`` is called (at checkout) and, for carts
+    touched by this process, by a write-behind flush every ``CART_WRITE_BEHIND_INTERVAL`` seconds.
+    A cart is stored as ``{product_id: {"size": ..., "colour": ..., "quantity": ...}}``.
+    """
+
+    key_prefix = "cart"
+    lock_timeout = 5
+
+    def __init__(self, timeout=None, write_behind_interval=None):
+        local_cache = isinstance(caches["default"], (LocMemCache, DummyCache))
+        if local_cache and not getattr(settings, "CART_CACHE_ALLOW_LOCAL", False):
+            raise ImproperlyConfigured("CacheCartStorage needs a cache shared between processes; "
+                                       "configure CACHE_BACKEND or set CART_CACHE_ALLOW_LOCAL.")
+        self.timeout = timeout or getattr(settings, "CART_CACHE_TIMEOUT", 60 * 60 * 24 * 7)
+        if write_behind_interval is None:
+            write_behind_interval = getattr(settings, "CART_WRITE_BEHIND_INTERVAL", 0)
+        self.write_behind_interval = write_behind_interval
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def _key(self, cart_id):
+        return f"{self.key_prefix}:{cart_id}"
+
+    @contextmanager
+    def _locked(self, cart_id):
+        """
+        Hold the cart's lock for the duration of a read-modify-write. A lock left behind by a crashed
+        worker expires after ``lock_timeout`` seconds.
+        """
+        key, token = f"{self._key(cart_id)}:lock", uuid4().hex
+        while not cache.add(key, token, self.lock_timeout):
+            time.sleep(0.01)
+        try:
+            yield
+        finally:
+            if cache.get(key) == token:
+                cache.delete(key)
+
+    def _load(self, cart_id):
+        lines = cache.get(self._key(cart_id))
+        if lines is None:
+            # Fall back to a cart that was already written to the database
+            lines = {
+                str(item.product_id): {"size": item.size, "colour": item.colour, "quantity": item.quantity}
+                for item in CartItem.objects.filter(cart_id=cart_id)
+            }
+            if not lines and not Cart.objects.filter(id=cart_id).exists():
+                return None
+        return lines
+
+    def _store(self, cart_id, lines):
+        cache.set(self._key(cart_id), lines, self.timeout)
+        self._mark_dirty(cart_id)
+
+    def _mark_dirty(self, cart_id):
+        if not self.write_behind_interval:
+            return
+        with self._lock:
+            self._dirty.add(cart_id)
+            if self._timer is None:
+                self._timer = threading.Timer(self.write_behind_interval, self._flush_in_background)
+                self._timer.daemon = True
+                self._timer.start()
+
+    @staticmethod
+    def _build_item(cart_id, product, line):
+        return CartItem(cart_id=cart_id, product=product, size=line["size"], colour=line["colour"],
+                        quantity=line["quantity"])
+
+    def add(self, cart_id, product, quantity, size=None, colour=None):
+        cart_id = str(cart_id or uuid4())
+        with self._locked(cart_id):
+            lines = self._load(cart_id) or {}
+            product_id = str(product.id)
+            line = lines.get(product_id, {"size": None, "colour": None, "quantity": 0})
+            line = {"size": size or line["size"], "colour": colour or line["colour"],
+                    "quantity": line["quantity"] + quantity}
+            item = self._build_item(cart_id, product, line)
+
+            if line["quantity"] > 0:
+                lines[product_id] = line
+            else:
+                lines.pop(product_id, None)
+
+            if lines:
+                self._store(cart_id, lines)
+            else:
+                self.clear(cart_id)
+        return item
+
+    def update(self, cart_id, product_id, size=None, colour=None):
+        cart_id, product_id = str(cart_id), str(product_id)
+        with self._locked(cart_id):
+            lines = self._load(cart_id) or {}
+            if product_id not in lines:
+                raise CartItem.DoesNotExist
+            line = lines[product_id]
+            if size:
+                line["size"] = size
+            if colour:
+                line["colour"] = colour
+            self._store(cart_id, lines)
+        return self._build_item(cart_id, get_product_snapshot(product_id), line)
+
+    def remove(self, cart_id, product_id):
+        cart_id, product_id = str(cart_id), str(product_id)
+        with self._locked(cart_id):
+            lines = self._load(cart_id) or {}
+            if lines.pop(product_id, None) is None:
+                raise CartItem.DoesNotExist
+            self._store(cart_id, lines)
+
+    def apply_batch(self, cart_id, operations):
+        cart_id = str(cart_id or uuid4())
+        with self._locked(cart_id):
+            lines = self._load(cart_id) or {}
+            self._store(cart_id, apply_operations(lines, operations))
+        return cart_id
+
+    def get_items(self, cart_id):
+        cart_id = str(cart_id)
+        lines = self._load(cart_id)
+        if lines is None:
+            raise Cart.DoesNotExist
+        products = get_product_snapshots(lines)
+        return [
+            apply_pricing(self._build_item(cart_id, products[product_id], line))
+            for product_id, line in lines.items() if product_id in products
+        ]
+
+    def persist(self, cart_id):
+        cart_id = str(cart_id)
+        # Clear the dirty flag before reading so a write that lands meanwhile is flushed next time
+        with self._lock:
+            self._dirty.discard(cart_id)
+        lines = cache.get(self._key(cart_id))
+        if lines is None:
+            # Either never cached or evicted; whatever reached the database is all there is
+            return Cart.objects.get(id=cart_id)
+
+        with transaction.atomic():
+            cart, _ = Cart.objects.get_or_create(id=cart_id)
+            CartItem.objects.filter(cart=cart).delete()
+            CartItem.objects.bulk_create([
+                CartItem(cart=cart, product_id=product_id, size=line["size"], colour=line["colour"],
+                         quantity=line["quantity"])
+                for product_id, line in lines.items()
+            ])
+        return cart
+
+    def clear(self, cart_id):
+        cart_id = str(cart_id)
+        cache.delete(self._key(cart_id))
+        with self._lock:
+            self._dirty.discard(cart_id)
+        Cart.objects.filter(id=cart_id).delete()
+
+    def flush(self):
+        """
+        Write every cart touched since the last flush to the database. A cart that fails to persist
+        is logged and skipped so it doesn't hold back the others.
+        """
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            self._timer = None
+        for cart_id in dirty:
+            try:
+                self.persist(cart_id)
+            except Cart.DoesNotExist:
+                logger.info("Cart %s left the cache before it was written to the database", cart_id)
+            except Exception:
+                logger.exception("Could not write cart %s to the database", cart_id)
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        finally:
+            # The timer thread gets its own database connection which nothing else would close
+            connection.close()
+
+
+_storage = None
+
+
+def get_cart_storage():
+    """
+    Return the cart backend configured by ``CART_STORAGE_BACKEND``.
+    """
+    global _storage
+    if _storage is None:
+        backend = getattr(settings, "CART_STORAGE_BACKEND", "store.cart_storage.DatabaseCartStorage")
+        _storage = import_string(backend)()
+    return _storage
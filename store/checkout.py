@@ -0,0 +1,69 @@
+import logging
+import time
+from contextlib import contextmanager
+
+from django.db import transaction
+
+from store import inventory
+from store.cart_storage import get_cart_storage
+from store.inventory import ReservationLine
+from store.models import CartItem, Order, OrderItem
+
+logger = logging.getLogger(__name__)
+
+
+class EmptyCart(Exception):
+    pass
+
+
+@contextmanager
+def _stage(timings, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = (time.perf_counter() - start) * 1000
+
+
+def checkout(cart_id, customer_id=None):
+    """
+    Turn a cart into an order in one transaction: price the cart, reserve its stock, create the order
+    with every item in one ``bulk_create`` (each item keeps the unit price it was sold at) and clear the cart.
+
+    Raises ``Cart.DoesNotExist``, ``EmptyCart`` or ``inventory.InsufficientStock``; nothing is changed then.
+    The number of queries doesn't depend on the size of the cart. The time spent in each stage, in
+    milliseconds, is logged and left on the returned order as ``timings``.
+    """
+    storage = get_cart_storage()
+    timings = {}
+    with transaction.atomic():
+        with _stage(timings, "persist"):
+            cart = storage.persist(cart_id)
+
+        with _stage(timings, "price"):
+            items = list(CartItem.objects.filter(cart=cart).with_pricing().order_by("product_id"))
+        if not items:
+            raise EmptyCart
+
+        with _stage(timings, "reserve"):
+            group = inventory.reserve([ReservationLine(item.product_id, item.quantity, item.size, item.colour)
+                                       for item in items])
+
+        with _stage(timings, "order"):
+            order = Order.objects.create(customer_id=customer_id, reservation_group=group,
+                                         total_price=sum(item.line_total for item in items),
+                                         item_count=sum(item.quantity for item in items))
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, customer_id=customer_id, product_id=item.product_id, quantity=item.quantity,
+                          unit_price=item.unit_price, size=item.size, colour=item.colour, ordered=True)
+                for item in items
+            ])
+
+        with _stage(timings, "clear"):
+            storage.clear(cart.id)
+
+    logger.info("Checked out cart %s as order %s (%s)", cart.id, order.transaction_ref,
+                ", ".join(f"{stage}={elapsed:.1f}ms" for stage, elapsed in timings.items()),
+                extra={"checkout_timings": timings})
+    order.timings = timings
+    return order
@@ -54,8 +54,29 @@ RATING_CHOICES = (
 
 SHIPPING_STATUS_PENDING = "P"
 SHIPPING_STATUS_SHIPPED = "PR"
+# Paid after its reservation lapsed, when the stock was no longer there to take again
+SHIPPING_STATUS_OUT_OF_STOCK = "OS"
 
 SHIPPING_STATUS_CHOICES = (
     (SHIPPING_STATUS_PENDING, "Pending"),
     (SHIPPING_STATUS_SHIPPED, "Shipping"),
+    (SHIPPING_STATUS_OUT_OF_STOCK, "Out of stock"),
+)
+
+RESERVATION_HELD = "H"
+RESERVATION_COMMITTED = "C"
+RESERVATION_RELEASED = "R"
+
+RESERVATION_STATUS_CHOICES = (
+    (RESERVATION_HELD, "Held"),
+    (RESERVATION_COMMITTED, "Committed"),
+    (RESERVATION_RELEASED, "Released"),
+)
+
+ROLLUP_HOURLY = "H"
+ROLLUP_DAILY = "D"
+
+ROLLUP_PERIOD_CHOICES = (
+    (ROLLUP_HOURLY, "Hourly"),
+    (ROLLUP_DAILY, "Daily"),
 )
@@ -0,0 +1,143 @@
+import secrets
+import threading
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from common.cache import cache_is_shared
+from store.models import CouponCode
+
+# Replaced whenever a coupon changes so every process reloads its index on the next check
+INDEX_VERSION_KEY = "coupons:index-version"
+
+
+class ActiveCouponIndex:
+    """
+    In-process map of active coupon codes to their price and expiry date.
+
+    Checking a code is a dictionary lookup plus one cache read of the index version; the database is
+    only read again after a coupon was created, changed or deleted in any process. That takes a cache
+    shared by every process; on a per-process one, codes are looked up in the database instead.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._coupons = {}
+        self._version = None
+
+    def _current_version(self):
+        version = cache.get(INDEX_VERSION_KEY)
+        if version is None:
+            cache.add(INDEX_VERSION_KEY, uuid4().hex, None)
+            version = cache.get(INDEX_VERSION_KEY)
+        return version
+
+    def _refresh(self):
+        version = self._current_version()
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            coupons = CouponCode.objects.filter(expired=False, expiry_date__gt=timezone.now()).values_list(
+                    "code", "price", "expiry_date")
+            self._coupons = {code: (price, expiry_date) for code, price, expiry_date in coupons.iterator()}
+            self._version = version
+
+    def get(self, code):
+        """
+        Return the price of an active coupon, or None when the code doesn't exist or has expired.
+        """
+        if not cache_is_shared():
+            # Other processes' version bumps never reach a per-process cache, so the index could be stale
+            return CouponCode.objects.filter(code=code.upper(), expired=False, expiry_date__gt=timezone.now()) \
+                .values_list("price", flat=True).first()
+        self._refresh()
+        coupon = self._coupons.get(code.upper())
+        if coupon is None:
+            return None
+        price, expiry_date = coupon
+        return price if expiry_date > timezone.now() else None
+
+
+def invalidate_coupon_index():
+    cache.set(INDEX_VERSION_KEY, uuid4().hex, None)
+
+
+active_coupons = ActiveCouponIndex()
+
+
+def expire_coupons(chunk_size=1000, now=None):
+    """
+    Flag every coupon past its expiry date as expired, ``chunk_size`` rows per UPDATE so a large
+    backlog never holds a long lock. Returns the number of coupons expired.
+    """
+    now = now or timezone.now()
+    pending = CouponCode.objects.filter(expired=False, expiry_date__lte=now)
+    expired = 0
+    while True:
+        ids = list(pending.values_list("id", flat=True)[:chunk_size])
+        if not ids:
+            break
+        expired += CouponCode.objects.filter(id__in=ids).update(expired=True, updated=now)
+    if expired:
+        invalidate_coupon_index()
+    return expired
+
+
+def _candidates(count):
+    codes = set()
+    while len(codes) < count:
+        codes.add(secrets.token_hex(4).upper())
+    return codes
+
+
+def _coupon_inserter(price, expiry_date):
+    """
+    Return a function inserting coupons with the given codes, all sharing ``price`` and ``expiry_date``.
+
+    Every column but the id and the code is the same for the whole run, so those values are prepared
+    once and each batch is a single ``executemany``; going through ``bulk_create`` spends most of its
+    time preparing the same values again for every row.
+    """
+    now = timezone.now()
+    template = CouponCode(price=price, expiry_date=expiry_date, expired=expiry_date <= now, created=now, updated=now)
+    fields = [field for field in CouponCode._meta.concrete_fields if field.name not in ("id", "code")]
+    constants = [field.get_db_prep_save(field.value_from_object(template), connection) for field in fields]
+    id_field, code_field = CouponCode._meta.pk, CouponCode._meta.get_field("code")
+    columns = ", ".join(connection.ops.quote_name(field.column) for field in [id_field, code_field, *fields])
+    sql = (f"INSERT INTO {connection.ops.quote_name(CouponCode._meta.db_table)} ({columns}) "
+           f"VALUES ({', '.join(['%s'] * (len(fields) + 2))})")
+    # What UUIDField.get_db_prep_value does, without looking the connection up again for every row
+    new_id = uuid4 if connection.features.has_native_uuid_field else (lambda: uuid4().hex)
+
+    def insert(codes):
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, [(new_id(), code, *constants) for code in codes])
+    return insert
+
+
+def generate_coupon_codes(count, price, expiry_date, batch_size=5000):
+    """
+    Create ``count`` coupons with new, unique codes and return the codes.
+
+    Candidates are drawn a batch at a time, checked against existing codes with one query per batch and
+    inserted together; a batch that loses a race with another writer is rolled back to its savepoint and
+    simply drawn again. Everything is committed at once.
+    """
+    insert = _coupon_inserter(price, expiry_date)
+    generated = []
+    with transaction.atomic():
+        while len(generated) < count:
+            candidates = _candidates(min(batch_size, count - len(generated)))
+            candidates -= set(CouponCode.objects.filter(code__in=candidates).values_list("code", flat=True))
+            try:
+                with transaction.atomic():
+                    insert(candidates)
+            except IntegrityError:
+                continue
+            generated.extend(candidates)
+    invalidate_coupon_index()
+    return generated
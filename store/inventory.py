@@ -0,0 +1,204 @@
+from collections import namedtuple
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from store.choices import RESERVATION_COMMITTED, RESERVATION_HELD, RESERVATION_RELEASED
+from store.models import ColourInventory, Product, SizeInventory, StockReservation
+
+# A line to reserve; size is a Size title and colour a Colour name, as stored on cart items
+ReservationLine = namedtuple("ReservationLine", ["product_id", "quantity", "size", "colour"], defaults=(None, None))
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_ids):
+        self.product_ids = {str(product_id) for product_id in product_ids}
+        super().__init__(f"Not enough stock for product(s) {', '.join(sorted(self.product_ids))}")
+
+
+class _Shortfall(Exception):
+    """
+    Raised from inside the reservation savepoint when a conditional UPDATE did not cover every row.
+    Which rows were short can only be read once that savepoint has been rolled back.
+    """
+
+    def __init__(self, model, field, quantities, owners):
+        self.model, self.field, self.quantities, self.owners = model, field, quantities, owners
+
+    def product_ids(self):
+        available = {str(pk): value for pk, value in
+                     self.model.objects.filter(pk__in=self.quantities).values_list("pk", self.field)}
+        # Missing rows count as short as well as rows without enough stock
+        return {self.owners[pk] for pk, quantity in self.quantities.items() if available.get(str(pk), -1) < quantity}
+
+
+def _decrement(model, field, quantities):
+    """
+    Take ``quantities[pk]`` off ``field`` for every row in one UPDATE, but only on rows that still have
+    that much left. Returns True when every requested row was decremented; the caller rolls back otherwise.
+    The check and the write happen in the same statement, so concurrent reservations never go below zero.
+    """
+    if not quantities:
+        return True
+    if connection.features.has_select_for_update:
+        # Take the row locks in primary key order first so two reservations can't wait on each other
+        list(model.objects.select_for_update().filter(pk__in=quantities).order_by("pk").values_list("pk", flat=True))
+    requested = Case(*(When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()),
+                     output_field=IntegerField())
+    updated = model.objects.filter(pk__in=quantities, **{f"{field}__gte": requested}).update(
+            **{field: F(field) - requested})
+    return updated == len(quantities)
+
+
+def _increment(queryset, field, quantity):
+    return queryset.update(**{field: F(field) + quantity})
+
+
+def _merge(lines):
+    merged = {}
+    for line in lines:
+        key = (str(line.product_id), line.size or None, line.colour or None)
+        merged[key] = merged.get(key, 0) + line.quantity
+    return [ReservationLine(product_id, quantity, size, colour)
+            for (product_id, size, colour), quantity in merged.items()]
+
+
+def _variant_ids(model, lookup, pairs):
+    """
+    Map (product_id, size title or colour name) pairs to inventory row ids with one query.
+    """
+    if not pairs:
+        return {}
+    rows = model.objects.filter(
+            product_id__in={product_id for product_id, _ in pairs}, **{f"{lookup}__in": {name for _, name in pairs}}
+    ).values_list("product_id", lookup, "id")
+    return {(str(product_id), name): pk for product_id, name, pk in rows}
+
+
+def _reserve_lines(lines):
+    """
+    Decrement product, size and colour stock for all lines with one conditional UPDATE per table.
+    Tables are always updated in the same order and, where the backend has row locks, rows are locked
+    in primary key order, which keeps concurrent reservations from deadlocking.
+    Returns the size and colour inventory ids used by each line.
+    """
+    product_quantities, size_quantities, colour_quantities = {}, {}, {}
+    owners = {}
+    size_ids = _variant_ids(SizeInventory, "size__title", {(line.product_id, line.size) for line in lines if line.size})
+    colour_ids = _variant_ids(ColourInventory, "colour__name",
+                              {(line.product_id, line.colour) for line in lines if line.colour})
+    variants = []
+    for line in lines:
+        product_quantities[line.product_id] = product_quantities.get(line.product_id, 0) + line.quantity
+        owners[line.product_id] = line.product_id
+        size_id = size_ids.get((line.product_id, line.size))
+        colour_id = colour_ids.get((line.product_id, line.colour))
+        if (line.size and size_id is None) or (line.colour and colour_id is None):
+            raise InsufficientStock([line.product_id])
+        if size_id:
+            size_quantities[size_id] = size_quantities.get(size_id, 0) + line.quantity
+            owners[size_id] = line.product_id
+        if colour_id:
+            colour_quantities[colour_id] = colour_quantities.get(colour_id, 0) + line.quantity
+            owners[colour_id] = line.product_id
+        variants.append((size_id, colour_id))
+
+    for model, field, quantities in ((Product, "inventory", product_quantities),
+                                     (SizeInventory, "quantity", size_quantities),
+                                     (ColourInventory, "quantity", colour_quantities)):
+        if not _decrement(model, field, quantities):
+            raise _Shortfall(model, field, quantities, {pk: owners[pk] for pk in quantities})
+    return variants
+
+
+def _attempt(lines):
+    try:
+        with transaction.atomic():
+            return _reserve_lines(lines)
+    except _Shortfall as shortfall:
+        raise InsufficientStock(shortfall.product_ids()) from None
+
+
+def reserve(lines, ttl=None):
+    """
+    Reserve stock for every line, all or nothing, and return the reservation group id.
+
+    Raises ``InsufficientStock`` when any line can't be covered; nothing is reserved in that case.
+    When stock runs out, expired reservations for the products involved are released and the
+    reservation is tried once more. The number of queries does not depend on the number of lines.
+    """
+    ttl = ttl or getattr(settings, "INVENTORY_RESERVATION_TTL", 15 * 60)
+    group = uuid4()
+    expires_at = timezone.now() + timezone.timedelta(seconds=ttl)
+    lines = _merge(lines)
+
+    with transaction.atomic():
+        try:
+            variants = _attempt(lines)
+        except InsufficientStock as error:
+            if not release_expired(product_ids=error.product_ids):
+                raise
+            variants = _attempt(lines)
+        StockReservation.objects.bulk_create([
+            StockReservation(group=group, product_id=line.product_id, quantity=line.quantity,
+                             size_inventory_id=size_id, colour_inventory_id=colour_id, expires_at=expires_at)
+            for line, (size_id, colour_id) in zip(lines, variants)
+        ])
+    return group
+
+
+def _release(reservations):
+    released = 0
+    for reservation in reservations:
+        # Claim the reservation first so a concurrent release can't put the stock back twice
+        claimed = StockReservation.objects.filter(id=reservation.id, status=RESERVATION_HELD).update(
+                status=RESERVATION_RELEASED, updated=timezone.now())
+        if not claimed:
+            continue
+        _increment(Product.objects.filter(id=reservation.product_id), "inventory", reservation.quantity)
+        if reservation.size_inventory_id:
+            _increment(SizeInventory.objects.filter(id=reservation.size_inventory_id), "quantity",
+                       reservation.quantity)
+        if reservation.colour_inventory_id:
+            _increment(ColourInventory.objects.filter(id=reservation.colour_inventory_id), "quantity",
+                       reservation.quantity)
+        released += 1
+    return released
+
+
+@transaction.atomic
+def release(group):
+    """
+    Put the stock of a held reservation group back. Returns the number of reservations released.
+    """
+    return _release(StockReservation.objects.filter(group=group, status=RESERVATION_HELD).order_by("product_id"))
+
+
+@transaction.atomic
+def release_expired(product_ids=None, now=None):
+    """
+    Release every held reservation past its expiry date, optionally only for some products.
+    """
+    queryset = StockReservation.objects.filter(status=RESERVATION_HELD, expires_at__lte=now or timezone.now())
+    if product_ids is not None:
+        queryset = queryset.filter(product_id__in=product_ids)
+    return _release(queryset.order_by("product_id"))
+
+
+@transaction.atomic
+def commit(group):
+    """
+    Turn a held reservation group into a permanent stock decrement, e.g. once an order is placed.
+    Returns False, committing nothing, when part of the group already expired and was released.
+    """
+    reservations = StockReservation.objects.filter(group=group)
+    total = reservations.count()
+    committed = reservations.filter(status=RESERVATION_HELD).update(status=RESERVATION_COMMITTED,
+                                                                    updated=timezone.now())
+    if committed != total:
+        transaction.set_rollback(True)
+        return False
+    return True
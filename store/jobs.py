@@ -0,0 +1,15 @@
+from django.utils.dateparse import parse_datetime
+
+from common.jobs import register
+from store import rollups
+from store.coupons import expire_coupons
+
+
+@register("store.rebuild_sales_rollups")
+def rebuild_sales_rollups(since=None):
+    rollups.rebuild(since=parse_datetime(since) if since else None)
+
+
+@register("store.expire_coupons")
+def expire_coupon_codes(chunk_size=1000):
+    expire_coupons(chunk_size=chunk_size)
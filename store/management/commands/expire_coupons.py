@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from store.coupons import expire_coupons
+
+
+class Command(BaseCommand):
+    help = "Flag coupon codes past their expiry date as expired; run it periodically, e.g. from cron"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Coupons updated per query")
+
+    def handle(self, *args, **options):
+        expired = expire_coupons(chunk_size=options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Expired {expired} coupon codes"))
@@ -0,0 +1,31 @@
+from datetime import datetime
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store.coupons import generate_coupon_codes
+
+
+class Command(BaseCommand):
+    help = "Create a batch of unique coupon codes, e.g. for a campaign, and print them one per line"
+
+    def add_arguments(self, parser):
+        parser.add_argument("count", type=int)
+        parser.add_argument("--price", type=Decimal, required=True)
+        parser.add_argument("--expires", type=datetime.fromisoformat, required=True,
+                            help="Expiry date, YYYY-MM-DD[THH:MM]")
+        parser.add_argument("--output", help="Write the codes to this file instead of stdout")
+
+    def handle(self, *args, **options):
+        expiry_date = options["expires"]
+        if timezone.is_naive(expiry_date):
+            expiry_date = timezone.make_aware(expiry_date)
+        codes = generate_coupon_codes(options["count"], options["price"], expiry_date)
+
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                output.write("\n".join(codes) + "\n")
+        else:
+            self.stdout.write("\n".join(codes))
+        self.stderr.write(self.style.SUCCESS(f"Generated {len(codes)} coupon codes"))
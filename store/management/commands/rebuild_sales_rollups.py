@@ -0,0 +1,21 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the hourly and daily sales rollups from paid orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", type=datetime.fromisoformat,
+                            help="Only rebuild from this date (YYYY-MM-DD) onwards")
+
+    def handle(self, *args, **options):
+        since = options["since"]
+        if since is not None and timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        written = rebuild(since=since)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} sales rollup rows"))
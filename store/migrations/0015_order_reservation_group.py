@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-19 02:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_stockreservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='reservation_group',
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.1.7 on 2026-10-19 02:44
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_order_totals(apps, schema_editor):
+    Order = apps.get_model('store', 'Order')
+    OrderItem = apps.get_model('store', 'OrderItem')
+    items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    Order.objects.update(
+            total_price=Coalesce(Subquery(items.annotate(total=Sum(F('unit_price') * F('quantity'))).values('total'),
+                                          output_field=models.DecimalField(max_digits=12, decimal_places=2)), 0,
+                                 output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+            item_count=Coalesce(Subquery(items.annotate(count=Sum('quantity')).values('count')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_order_reservation_group'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'placed_at', 'id'], name='order_customer_history_idx'),
+        ),
+        migrations.RunPython(fill_order_totals, migrations.RunPython.noop),
+    ]
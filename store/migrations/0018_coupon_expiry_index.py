@@ -0,0 +1,17 @@
+# Generated by Django 4.1.7 on 2026-10-19 02:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0017_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='couponcode',
+            index=models.Index(fields=['expired', 'expiry_date'], name='coupon_expiry_idx'),
+        ),
+    ]
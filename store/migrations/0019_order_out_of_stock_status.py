@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-19 03:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_coupon_expiry_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='shipping_status',
+            field=models.CharField(choices=[('P', 'Pending'), ('PR', 'Shipping'), ('OS', 'Out of stock')], default='P', max_length=2),
+        ),
+    ]
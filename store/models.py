@@ -1,18 +1,21 @@
 import secrets
+from decimal import Decimal
 from uuid import uuid4
 
 from autoslug import AutoSlugField
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator
 from django.db import models
-from django.db.models import Avg
+from django.db.models import Avg, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, Floor, Round
 from django.utils import timezone
 from django.utils.functional import cached_property
 
 from common.models import BaseModel
 from core.validators import validate_phone_number
 from store.choices import (CONDITION_CHOICES, GENDER_CHOICES, NOTIFICATION_CHOICES, PAYMENT_PENDING, PAYMENT_STATUS,
-                           RATING_CHOICES, SHIPPING_STATUS_CHOICES, SHIPPING_STATUS_PENDING)
+                           RATING_CHOICES, RESERVATION_HELD, RESERVATION_STATUS_CHOICES, ROLLUP_PERIOD_CHOICES,
+                           SHIPPING_STATUS_CHOICES, SHIPPING_STATUS_PENDING)
 from store.validators import validate_image_size
 
 # Create your models here.
@@ -134,6 +137,25 @@ class SizeInventory(models.Model):
         return self.product.title
 
 
+class StockReservation(BaseModel):
+    # All reservations made by one call to store.inventory.reserve share a group
+    group = models.UUIDField(db_index=True)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="reservations")
+    size_inventory = models.ForeignKey(SizeInventory, on_delete=models.SET_NULL, null=True, blank=True)
+    colour_inventory = models.ForeignKey(ColourInventory, on_delete=models.SET_NULL, null=True, blank=True)
+    quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
+    status = models.CharField(max_length=1, choices=RESERVATION_STATUS_CHOICES, default=RESERVATION_HELD)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "expires_at"], name="reservation_status_expiry_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.product.title} --- {self.quantity} --- {self.get_status_display()}"
+
+
 class ProductImage(models.Model):
     product = models.ForeignKey(
             Product, on_delete=models.CASCADE, related_name="images"
@@ -232,6 +254,9 @@ class CouponCode(BaseModel):
     expired = models.BooleanField(default=False)
     expiry_date = models.DateTimeField()
 
+    class Meta:
+        indexes = [models.Index(fields=["expired", "expiry_date"], name="coupon_expiry_idx")]
+
     def __str__(self):
         return self.code
 
@@ -255,6 +280,14 @@ class Order(BaseModel):
     shipping_status = models.CharField(
             max_length=2, choices=SHIPPING_STATUS_CHOICES, default=SHIPPING_STATUS_PENDING
     )
+    # Stock held for the order at checkout; committed once payment completes, released if it fails
+    reservation_group = models.UUIDField(null=True, blank=True, editable=False)
+    # Copied from the items at checkout so listing orders doesn't have to aggregate them
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    item_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=["customer", "placed_at", "id"], name="order_customer_history_idx")]
 
     def __str__(self):
         return f"{self.transaction_ref} --- {self.placed_at}"
@@ -278,11 +311,104 @@ class OrderItem(BaseModel):
         )
 
 
+class SalesRollup(models.Model):
+    """
+    Units, revenue and number of paid orders for one hour or day, kept up to date by ``store.rollups``.
+    """
+    period = models.CharField(max_length=1, choices=ROLLUP_PERIOD_CHOICES)
+    # Start of the hour or day, in the project time zone
+    bucket = models.DateTimeField()
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    order_count = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class ProductSalesRollup(SalesRollup):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="sales_rollups")
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["period", "bucket", "product"],
+                                               name="product_rollup_bucket_unique")]
+
+    def __str__(self):
+        return f"{self.product_id} --- {self.get_period_display()} --- {self.bucket}"
+
+
+class CategorySalesRollup(SalesRollup):
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="sales_rollups")
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["period", "bucket", "category"],
+                                               name="category_rollup_bucket_unique")]
+
+    def __str__(self):
+        return f"{self.category_id} --- {self.get_period_display()} --- {self.bucket}"
+
+
 class Cart(BaseModel):
 
     def total_price(self):
-        total_price = sum((item.product.price * item.product.quantity for item in self.items.all()))
-        return total_price
+        return self.items.price_summary()["total"]
+
+
+def _cents(expression):
+    return Cast(Round(expression * Value(100)), models.IntegerField())
+
+
+class CartItemQuerySet(models.QuerySet):
+    def with_pricing(self):
+        """
+        Annotate every line with its unit price, line total and line discount.
+        The product discount applies to the base price and is rounded half up to the cent; size and colour
+        extras are added on top. Prices are worked out in integer cents, so SQLite storing a whole price
+        as an integer can't turn the discount into integer division.
+        """
+        money = models.DecimalField(max_digits=12, decimal_places=2)
+        size_extra = SizeInventory.objects.filter(
+                product=OuterRef("product"), size__title=OuterRef("size")
+        ).values("extra_price")[:1]
+        colour_extra = ColourInventory.objects.filter(
+                product=OuterRef("product"), colour__name=OuterRef("colour")
+        ).values("extra_price")[:1]
+        zero = Value(Decimal("0.00"), output_field=money)
+        return self.annotate(
+                price_cents=_cents(F("product__price")),
+                extra_price_cents=_cents(
+                        Coalesce(Subquery(size_extra, output_field=money), zero)
+                        + Coalesce(Subquery(colour_extra, output_field=money), zero)
+                ),
+                unit_discount_cents=Cast(
+                        Floor(F("price_cents") * F("product__percentage_off") / Value(100.0) + Value(0.5)),
+                        models.IntegerField(),
+                ),
+                unit_price_cents=F("price_cents") - F("unit_discount_cents") + F("extra_price_cents"),
+                line_total_cents=F("unit_price_cents") * F("quantity"),
+                line_discount_cents=F("unit_discount_cents") * F("quantity"),
+                extra_price=ExpressionWrapper(F("extra_price_cents") / Value(100.0), output_field=money),
+                unit_discount=ExpressionWrapper(F("unit_discount_cents") / Value(100.0), output_field=money),
+                unit_price=ExpressionWrapper(F("unit_price_cents") / Value(100.0), output_field=money),
+                line_total=ExpressionWrapper(F("line_total_cents") / Value(100.0), output_field=money),
+                line_discount=ExpressionWrapper(F("line_discount_cents") / Value(100.0), output_field=money),
+        )
+
+    def price_summary(self):
+        """
+        Cart subtotal, discount, total and number of units computed in a single aggregate query.
+        """
+        summary = self.with_pricing().aggregate(
+                total=Sum("line_total_cents"), discount=Sum("line_discount_cents"), item_count=Sum("quantity")
+        )
+        return build_price_summary(Decimal(summary["total"] or 0) / 100, Decimal(summary["discount"] or 0) / 100,
+                                   summary["item_count"])
+
+
+def build_price_summary(total, discount, item_count):
+    total = Decimal(total or 0).quantize(Decimal("0.01"))
+    discount = Decimal(discount or 0).quantize(Decimal("0.01"))
+    return {"subtotal": total + discount, "discount": discount, "total": total, "item_count": item_count or 0}
 
 
 class CartItem(BaseModel):
@@ -292,6 +418,8 @@ class CartItem(BaseModel):
     colour = models.CharField(max_length=20, null=True)
     quantity = models.PositiveSmallIntegerField(validators=[MinValueValidator(1)])
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
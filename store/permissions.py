@@ -1,5 +1,4 @@
 from rest_framework.permissions import BasePermission
-from rest_framework_simplejwt.authentication import JWTAuthentication
 
 
 class IsAuthenticatedJWT(BasePermission):
@@ -8,6 +7,6 @@ class IsAuthenticatedJWT(BasePermission):
     """
 
     def has_permission(self, request, view):
-        auth = JWTAuthentication()
-        user, auth_token = auth.authenticate(request)
-        return bool(user and user.is_authenticated)
+        # DRF already authenticated the request; running JWTAuthentication again here would validate
+        # the token and load the user a second time
+        return bool(request.user and request.user.is_authenticated and request.auth is not None)
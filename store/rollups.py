@@ -0,0 +1,101 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, IntegerField, Sum, Value, When
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from store.choices import PAYMENT_COMPLETE, ROLLUP_DAILY, ROLLUP_HOURLY
+from store.models import CategorySalesRollup, OrderItem, ProductSalesRollup
+
+PERIODS = {ROLLUP_HOURLY: TruncHour, ROLLUP_DAILY: TruncDay}
+
+# Rollup model, its key field and the OrderItem lookup that fills that key
+ROLLUPS = (
+    (ProductSalesRollup, "product_id", "product_id"),
+    (CategorySalesRollup, "category_id", "product__category_id"),
+)
+
+REVENUE = DecimalField(max_digits=14, decimal_places=2)
+
+
+def bucket_start(moment, period):
+    """
+    Start of the hour or day ``moment`` falls in, matching what ``TruncHour``/``TruncDay`` return.
+    """
+    moment = timezone.localtime(moment).replace(minute=0, second=0, microsecond=0)
+    if period == ROLLUP_DAILY:
+        moment = moment.replace(hour=0)
+    return moment
+
+
+def _add(model, field, period, bucket, totals, sign):
+    if not totals:
+        return
+    model.objects.bulk_create([model(period=period, bucket=bucket, **{field: key}) for key in totals],
+                              ignore_conflicts=True)
+
+    def per_row(index, output_field):
+        return Case(*(When(**{field: key}, then=Value(sign * values[index])) for key, values in totals.items()),
+                    output_field=output_field)
+
+    model.objects.filter(period=period, bucket=bucket, **{f"{field}__in": totals}).update(
+            units=F("units") + per_row(0, IntegerField()),
+            revenue=F("revenue") + per_row(1, REVENUE),
+            order_count=F("order_count") + Value(sign),
+    )
+
+
+@transaction.atomic
+def record_order(order, sign=1):
+    """
+    Add a paid order to the hourly and daily rollups of its products and categories, or take it out
+    again with ``sign=-1``. Costs the same number of queries however many items the order has.
+
+    Called when an order is saved with a new payment status. Changes that skip ``save()``, like
+    ``QuerySet.update()`` or items added to an already paid order, need a ``rebuild`` afterwards.
+    """
+    totals = {field: defaultdict(lambda: [0, Decimal(0)]) for _, field, _ in ROLLUPS}
+    items = OrderItem.objects.filter(order=order).values_list("product_id", "product__category_id", "quantity",
+                                                              "unit_price")
+    for product_id, category_id, quantity, unit_price in items:
+        for field, key in (("product_id", product_id), ("category_id", category_id)):
+            totals[field][key][0] += quantity
+            totals[field][key][1] += unit_price * quantity
+
+    for period in PERIODS:
+        bucket = bucket_start(order.placed_at, period)
+        for model, field, _ in ROLLUPS:
+            _add(model, field, period, bucket, totals[field], sign)
+
+
+@transaction.atomic
+def rebuild(since=None):
+    """
+    Recompute the rollups from paid orders, from the start of the day ``since`` falls in or from scratch.
+    Returns the number of rollup rows written.
+    """
+    items = OrderItem.objects.filter(order__payment_status=PAYMENT_COMPLETE)
+    if since is not None:
+        since = bucket_start(since, ROLLUP_DAILY)
+        items = items.filter(order__placed_at__gte=since)
+
+    written = 0
+    for model, field, lookup in ROLLUPS:
+        existing = model.objects.all()
+        if since is not None:
+            existing = existing.filter(bucket__gte=since)
+        existing.delete()
+
+        for period, trunc in PERIODS.items():
+            rows = items.annotate(bucket=trunc("order__placed_at")).values("bucket", lookup).annotate(
+                    units=Sum("quantity"), revenue=Sum(F("unit_price") * F("quantity"), output_field=REVENUE),
+                    order_count=Count("order", distinct=True)).order_by()
+            created = model.objects.bulk_create([
+                model(period=period, bucket=row["bucket"], units=row["units"], revenue=row["revenue"],
+                      order_count=row["order_count"], **{field: row[lookup]})
+                for row in rows
+            ], batch_size=1000)
+            written += len(created)
+    return written
@@ -1,7 +1,12 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from store.models import Cart, CartItem, Colour, ColourInventory, Product, ProductReview, Size, SizeInventory
+from store.cart_storage import CART_OPERATION_ADD, CART_OPERATION_REMOVE, CART_OPERATION_SET, MAX_LINE_QUANTITY, \
+    apply_pricing, get_cart_storage, get_product_snapshot
+from store.coupons import generate_coupon_codes
+from store.models import Cart, CartItem, Colour, ColourInventory, Order, OrderItem, Product, ProductReview, Size, \
+    SizeInventory
 
 
 class ColourSerializer(serializers.ModelSerializer):
@@ -34,7 +39,7 @@ class SizeInventorySerializer(serializers.ModelSerializer):
 
 class ProductSerializer(serializers.ModelSerializer):
     sizes = SizeInventorySerializer(source='size_inventory', many=True, read_only=True)
-    colours = ColourInventorySerializer(source='colour_inventory', many=True, read_only=True)
+    colours = ColourInventorySerializer(source='color_inventory', many=True, read_only=True)
     images = serializers.SerializerMethodField()
 
     class Meta:
@@ -84,17 +89,32 @@ class AddProductReviewSerializer(serializers.ModelSerializer):
 
 class CartItemSerializer(serializers.ModelSerializer):
     product = ProductSerializer()
+    unit_price = serializers.SerializerMethodField()
     total_price = serializers.SerializerMethodField()
 
     class Meta:
         model = CartItem
-        fields = ['cart_id', 'product', 'quantity', 'total_price']
+        fields = ['cart_id', 'product', 'size', 'colour', 'quantity', 'unit_price', 'total_price']
 
     @staticmethod
-    def get_total_price(cartitem: CartItem):
-        if cartitem.product.discount_price > 0:
-            return cartitem.quantity * cartitem.product.discount_price
-        return cartitem.quantity * cartitem.product.price
+    def _priced(cartitem: CartItem):
+        # Items from the cart storage are already priced, single items returned by a mutation may not be
+        if not hasattr(cartitem, 'line_total'):
+            apply_pricing(cartitem)
+        return cartitem
+
+    def get_unit_price(self, cartitem: CartItem):
+        return self._priced(cartitem).unit_price
+
+    def get_total_price(self, cartitem: CartItem):
+        return self._priced(cartitem).line_total
+
+
+class CartSummarySerializer(serializers.Serializer):
+    subtotal = serializers.DecimalField(max_digits=12, decimal_places=2)
+    discount = serializers.DecimalField(max_digits=12, decimal_places=2)
+    total = serializers.DecimalField(max_digits=12, decimal_places=2)
+    item_count = serializers.IntegerField()
 
 
 class CartSerializer(serializers.ModelSerializer):
@@ -103,20 +123,22 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ['id', 'items', 'total_price']
 
 
-def validate_cart_item(self, attrs):
-    product_id = attrs['product_id']
-    if not Product.objects.filter(id=product_id).exists():
+def validate_cart_item(attrs):
+    try:
+        product = get_product_snapshot(attrs['product_id'])
+    except (Product.DoesNotExist, DjangoValidationError):
         raise serializers.ValidationError({"message": "No product with the given ID was found."})
 
-    product = Product.objects.get(id=product_id)
+    # The snapshot comes with its inventories prefetched, so these checks don't query the database
     size = attrs.get('size', '')
-    if size and not product.size.filter(title=size).exists():
+    if size and not any(inventory.size.title == size for inventory in product.size_inventory.all()):
         raise serializers.ValidationError({"message": "Size not found for the given product.", "status": "failed"})
 
     colour = attrs.get('colour', '')
-    if colour and not product.colour.filter(name=colour).exists():
+    if colour and not any(inventory.colour.name == colour for inventory in product.color_inventory.all()):
         raise serializers.ValidationError({"message": "Colour not found for the given product.", "status": "failed"})
 
+    attrs['product'] = product
     return attrs
 
 
@@ -132,30 +154,13 @@ class AddCartItemSerializer(serializers.Serializer):
         return attrs
 
     def save(self, **kwargs):
-        product = Product.objects.get(id=self.validated_data['product_id'])
-        cart_id = self.validated_data.get('cart_id')
-        size = self.validated_data.get('size', None)
-        colour = self.validated_data.get('colour', None)
-        quantity = self.validated_data.get('quantity')
-
-        if cart_id is None:
-            cart = Cart.objects.create()
-            # cart_id = cart.id
-        else:
-            cart, _ = Cart.objects.get_or_create(id=cart_id)
-
-        try:
-            item = CartItem.objects.get(cart=cart, product=product, size=size, colour=colour)
-            item.quantity += quantity
-            item.save()
-        except CartItem.DoesNotExist:
-            item = CartItem.objects.create(cart=cart, product=product, size=size, colour=colour, quantity=quantity)
-        if item.quantity == 0:
-            item.delete()
-
-        if cart.items.count() == 0:
-            cart.delete()
-        return item
+        return get_cart_storage().add(
+                self.validated_data.get('cart_id'),
+                self.validated_data['product'],
+                self.validated_data['quantity'],
+                size=self.validated_data.get('size', None),
+                colour=self.validated_data.get('colour', None),
+        )
 
 
 class UpdateCartItemSerializer(serializers.Serializer):
@@ -170,18 +175,12 @@ class UpdateCartItemSerializer(serializers.Serializer):
 
     def save(self, **kwargs):
         try:
-            cart = Cart.objects.get(id=self.validated_data['cart_id'])
-            product = Product.objects.get(id=self.validated_data['product_id'])
-            item = CartItem.objects.get(cart=cart, product=product)
-        except (Cart.DoesNotExist, Product.DoesNotExist, CartItem.DoesNotExist):
+            return get_cart_storage().update(self.validated_data['cart_id'], self.validated_data['product_id'],
+                                             size=self.validated_data.get('size'),
+                                             colour=self.validated_data.get('colour'))
+        except (CartItem.DoesNotExist, DjangoValidationError):
             raise serializers.ValidationError(
                     {"message": "Invalid cart or product ID. Please check the provided IDs.", "status": "failed"})
-        if self.validated_data.get('size'):
-            item.size = self.validated_data['size']
-        if self.validated_data.get('colour'):
-            item.colour = self.validated_data['colour']
-        item.save()
-        return item
 
 
 class DeleteCartItemSerializer(serializers.Serializer):
@@ -190,10 +189,93 @@ class DeleteCartItemSerializer(serializers.Serializer):
 
     def save(self, **kwargs):
         try:
-            cart = Cart.objects.get(id=self.validated_data['cart_id'])
-            product = Product.objects.get(id=self.validated_data['product_id'])
-            item = CartItem.objects.get(cart=cart, product=product)
-        except (Cart.DoesNotExist, Product.DoesNotExist, CartItem.DoesNotExist):
+            get_cart_storage().remove(self.validated_data['cart_id'], self.validated_data['product_id'])
+        except (CartItem.DoesNotExist, DjangoValidationError):
             raise serializers.ValidationError(
                     {"message": "Invalid cart or product ID. Please check the provided IDs.", "status": "failed"})
-        item.delete()
+
+
+class CartOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=[CART_OPERATION_ADD, CART_OPERATION_SET, CART_OPERATION_REMOVE])
+    product_id = serializers.UUIDField()
+    size = serializers.CharField(required=False)
+    colour = serializers.CharField(required=False)
+    quantity = serializers.IntegerField(required=False, min_value=0, max_value=MAX_LINE_QUANTITY)
+
+    def validate(self, attrs):
+        if attrs['op'] == CART_OPERATION_REMOVE:
+            return attrs
+        if 'quantity' not in attrs:
+            raise serializers.ValidationError({"message": "Quantity is required.", "status": "failed"})
+        if attrs['op'] == CART_OPERATION_ADD and attrs['quantity'] < 1:
+            raise serializers.ValidationError({"message": "Quantity must be at least 1.", "status": "failed"})
+        return attrs
+
+
+class BatchCartItemSerializer(serializers.Serializer):
+    cart_id = serializers.UUIDField(required=False, default=None)
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=500)
+
+    def validate_operations(self, operations):
+        # One query for the products and one per variant type, however many operations are sent
+        product_ids = {operation['product_id'] for operation in operations}
+        found = set(Product.objects.filter(id__in=product_ids).values_list('id', flat=True))
+        if product_ids - found:
+            raise serializers.ValidationError({"message": "No product with the given ID was found.",
+                                               "products": sorted(str(pk) for pk in product_ids - found),
+                                               "status": "failed"})
+
+        sizes = {(operation['product_id'], operation['size']) for operation in operations if operation.get('size')}
+        if sizes:
+            available = set(SizeInventory.objects.filter(
+                    product_id__in={product_id for product_id, _ in sizes}, size__title__in={size for _, size in sizes}
+            ).values_list('product_id', 'size__title'))
+            if sizes - available:
+                raise serializers.ValidationError(
+                        {"message": "Size not found for the given product.", "status": "failed"})
+
+        colours = {(operation['product_id'], operation['colour']) for operation in operations
+                   if operation.get('colour')}
+        if colours:
+            available = set(ColourInventory.objects.filter(
+                    product_id__in={product_id for product_id, _ in colours},
+                    colour__name__in={colour for _, colour in colours}
+            ).values_list('product_id', 'colour__name'))
+            if colours - available:
+                raise serializers.ValidationError(
+                        {"message": "Colour not found for the given product.", "status": "failed"})
+        return operations
+
+    def save(self, **kwargs):
+        return get_cart_storage().apply_batch(self.validated_data['cart_id'], self.validated_data['operations'])
+
+
+class CheckoutSerializer(serializers.Serializer):
+    cart_id = serializers.UUIDField()
+
+
+class OrderItemSerializer(serializers.ModelSerializer):
+    product_title = serializers.CharField(source='product.title', read_only=True)
+
+    class Meta:
+        model = OrderItem
+        fields = ['product', 'product_title', 'quantity', 'unit_price', 'size', 'colour']
+
+
+class OrderSerializer(serializers.ModelSerializer):
+    items = OrderItemSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['id', 'transaction_ref', 'placed_at', 'payment_status', 'shipping_status', 'total_price',
+                  'item_count', 'items']
+
+
+class GenerateCouponCodesSerializer(serializers.Serializer):
+    count = serializers.IntegerField(min_value=1, max_value=10000)
+    price = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=0)
+    expiry_date = serializers.DateTimeField()
+
+    def save(self, **kwargs):
+        return generate_coupon_codes(self.validated_data['count'], self.validated_data['price'],
+                                     self.validated_data['expiry_date'])
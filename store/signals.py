@@ -0,0 +1,79 @@
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from store import inventory, rollups
+from store.cart_storage import invalidate_product_snapshot
+from store.coupons import invalidate_coupon_index
+from store.choices import PAYMENT_COMPLETE, PAYMENT_FAILED, SHIPPING_STATUS_OUT_OF_STOCK
+from store.inventory import ReservationLine
+from store.models import ColourInventory, CouponCode, Order, Product, ProductImage, SizeInventory
+
+logger = logging.getLogger(__name__)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def drop_product_snapshot(sender, instance, **kwargs):
+    invalidate_product_snapshot(instance.id)
+
+
+@receiver([post_save, post_delete], sender=SizeInventory)
+@receiver([post_save, post_delete], sender=ColourInventory)
+@receiver([post_save, post_delete], sender=ProductImage)
+def drop_related_product_snapshot(sender, instance, **kwargs):
+    invalidate_product_snapshot(instance.product_id)
+
+
+@receiver([post_save, post_delete], sender=CouponCode)
+def drop_coupon_index(sender, instance, **kwargs):
+    invalidate_coupon_index()
+
+
+@receiver(post_init, sender=Order)
+def remember_payment_status(sender, instance, **kwargs):
+    # Read from __dict__ so a deferred field isn't loaded just for this
+    instance._loaded_payment_status = instance.__dict__.get("payment_status")
+
+
+@receiver(post_save, sender=Order)
+def handle_payment_status_change(sender, instance, created, **kwargs):
+    # Only saves go through here: after changing payment_status with QuerySet.update(), run rollups.rebuild()
+    previous, current = None if created else instance._loaded_payment_status, instance.payment_status
+    if previous == current:
+        return
+    instance._loaded_payment_status = current
+
+    if instance.reservation_group:
+        if current == PAYMENT_COMPLETE:
+            _commit_stock(instance)
+        elif current == PAYMENT_FAILED:
+            inventory.release(instance.reservation_group)
+
+    if current == PAYMENT_COMPLETE and created:
+        # The items of a new order are added after it, normally in the same transaction
+        transaction.on_commit(lambda: rollups.record_order(instance))
+    elif current == PAYMENT_COMPLETE:
+        rollups.record_order(instance)
+    elif previous == PAYMENT_COMPLETE:
+        rollups.record_order(instance, sign=-1)
+
+
+def _commit_stock(order):
+    if inventory.commit(order.reservation_group):
+        return
+    # Paid after part of the reservation expired and was released: take the stock again, or flag the
+    # order so it isn't shipped against stock it never held
+    inventory.release(order.reservation_group)
+    lines = [ReservationLine(item.product_id, item.quantity, item.size, item.colour) for item in order.items.all()]
+    try:
+        group = inventory.reserve(lines)
+    except inventory.InsufficientStock as error:
+        logger.error("Order %s was paid after its reservation lapsed: %s", order.transaction_ref, error)
+        order.shipping_status = SHIPPING_STATUS_OUT_OF_STOCK
+        Order.objects.filter(pk=order.pk).update(shipping_status=order.shipping_status)
+        return
+    inventory.commit(group)
+    order.reservation_group = group
+    Order.objects.filter(pk=order.pk).update(reservation_group=group)
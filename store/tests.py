@@ -1,3 +1,728 @@
-from django.test import TestCase
+import random
+import threading
+import time
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from uuid import uuid4
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from store import inventory, rollups
+from store.cart_storage import CacheCartStorage, DatabaseCartStorage, apply_pricing, get_product_snapshot
+from store.checkout import checkout
+from store.coupons import active_coupons, expire_coupons, generate_coupon_codes
+from store.choices import CONDITION_NEW, PAYMENT_COMPLETE, PAYMENT_FAILED, RESERVATION_COMMITTED, \
+    RESERVATION_RELEASED, ROLLUP_DAILY, ROLLUP_HOURLY, SHIPPING_STATUS_OUT_OF_STOCK
+from store.inventory import ReservationLine
+from store.models import Address, Cart, CartItem, Category, CategorySalesRollup, Colour, ColourInventory, Country, \
+    CouponCode, FavoriteProduct, Notification, Order, OrderItem, Product, ProductReview, ProductSalesRollup, Size, \
+    SizeInventory, StockReservation
+from store.pagination import EstimatedCountPaginator
+from store.serializers import validate_cart_item
+
+
+def create_product(title="Denim Jacket", price="100.00", inventory=50, percentage_off=0, category=None):
+    category = category or Category.objects.get_or_create(title="Jackets")[0]
+    return Product.objects.create(title=title, category=category, description="description", style="casual",
+                                  price=price, inventory=inventory, percentage_off=percentage_off,
+                                  condition=CONDITION_NEW)
+
+
+class DatabaseCartStorageTests(TestCase):
+    def setUp(self):
+        self.storage = DatabaseCartStorage()
+        self.product = create_product()
+
+    def test_add_creates_cart_and_merges_quantities(self):
+        item = self.storage.add(None, self.product, 2)
+        cart_id = item.cart_id
+        self.storage.add(cart_id, self.product, 3, size="XL")
+        item = CartItem.objects.get(cart_id=cart_id, product=self.product)
+        self.assertEqual(item.quantity, 5)
+        self.assertEqual(item.size, "XL")
+
+    def test_quantity_dropping_to_zero_removes_line_and_empty_cart(self):
+        cart_id = self.storage.add(None, self.product, 2).cart_id
+        self.storage.add(cart_id, self.product, -2)
+        self.assertFalse(Cart.objects.filter(id=cart_id).exists())
+
+    def test_remove_missing_line_raises(self):
+        cart_id = self.storage.add(None, self.product, 1).cart_id
+        self.storage.remove(cart_id, self.product.id)
+        with self.assertRaises(CartItem.DoesNotExist):
+            self.storage.remove(cart_id, self.product.id)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+                   CART_CACHE_ALLOW_LOCAL=True)
+class CacheCartStorageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.storage = CacheCartStorage(write_behind_interval=0)
+        self.product = create_product()
+
+    def test_add_to_existing_cart_does_not_touch_the_database(self):
+        cart_id = self.storage.add(None, self.product, 1).cart_id
+        with self.assertNumQueries(0):
+            item = self.storage.add(cart_id, self.product, 2, colour="Red")
+        self.assertEqual(item.quantity, 3)
+        self.assertFalse(Cart.objects.filter(id=cart_id).exists())
+
+    def test_get_items_fetches_and_prices_products_in_bulk(self):
+        other = create_product(title="Chinos")
+        cart_id = self.storage.add(None, self.product, 1).cart_id
+        self.storage.add(cart_id, other, 4)
+        with self.assertNumQueries(4):
+            items = self.storage.get_items(cart_id)
+        self.assertEqual(sorted(item.quantity for item in items), [1, 4])
+        with self.assertNumQueries(0):
+            self.storage.get_items(cart_id)
+
+    def test_validation_uses_the_product_snapshot(self):
+        SizeInventory.objects.create(product=self.product, size=Size.objects.create(title="M"), quantity=3)
+        get_product_snapshot(self.product.id)
+        with self.assertNumQueries(0):
+            attrs = validate_cart_item({"product_id": str(self.product.id), "size": "M"})
+        self.assertEqual(attrs["product"].id, self.product.id)
+
+    def test_product_changes_drop_the_snapshot(self):
+        get_product_snapshot(self.product.id)
+        Product.objects.filter(id=self.product.id).update(title="Renamed")
+        self.product.save()
+        self.assertEqual(get_product_snapshot(self.product.id).title, self.product.title)
+        SizeInventory.objects.create(product=self.product, size=Size.objects.create(title="L"), quantity=3)
+        self.assertEqual(len(get_product_snapshot(self.product.id).size_inventory.all()), 1)
+
+    def test_concurrent_adds_are_not_lost(self):
+        cart_id = self.storage.add(None, self.product, 1).cart_id
+        threads = [threading.Thread(target=self.storage.add, args=(cart_id, self.product, 1)) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(cache.get(f"cart:{cart_id}")[str(self.product.id)]["quantity"], 11)
+
+    def test_persist_writes_cart_to_database(self):
+        cart_id = self.storage.add(None, self.product, 2, size="M").cart_id
+        cart = self.storage.persist(cart_id)
+        item = cart.items.get()
+        self.assertEqual((item.product_id, item.quantity, item.size), (self.product.id, 2, "M"))
+
+    def test_flush_persists_dirty_carts(self):
+        storage = CacheCartStorage(write_behind_interval=3600)
+        cart_id = storage.add(None, self.product, 2).cart_id
+        storage._timer.cancel()
+        storage.flush()
+        self.assertEqual(CartItem.objects.get(cart_id=cart_id).quantity, 2)
+
+    def test_flush_skips_carts_evicted_from_the_cache(self):
+        storage = CacheCartStorage(write_behind_interval=3600)
+        evicted = storage.add(None, self.product, 1).cart_id
+        kept = storage.add(None, self.product, 2).cart_id
+        storage._timer.cancel()
+        cache.delete(f"cart:{evicted}")
+        storage.flush()
+        self.assertEqual(CartItem.objects.get(cart_id=kept).quantity, 2)
+        self.assertFalse(storage._dirty)
+
+    @override_settings(CART_CACHE_ALLOW_LOCAL=False)
+    def test_per_process_cache_is_rejected(self):
+        with self.assertRaises(ImproperlyConfigured):
+            CacheCartStorage()
+
+    def test_missing_cart_raises(self):
+        with self.assertRaises(Cart.DoesNotExist):
+            self.storage.get_items("3f1c2a0e-4c5b-4d7a-9d0e-8b6f4b8f1a11")
+
+
+class CartPricingTests(APITestCase):
+    def setUp(self):
+        self.product = create_product(price="100.00", percentage_off=10)
+        SizeInventory.objects.create(product=self.product, size=Size.objects.create(title="XL"), quantity=5,
+                                     extra_price="5.00")
+        ColourInventory.objects.create(product=self.product, colour=Colour.objects.create(name="Red", hex_code="#f00"),
+                                       quantity=5, extra_price="2.50")
+        self.cart = Cart.objects.create()
+        CartItem.objects.create(cart=self.cart, product=self.product, size="XL", colour="Red", quantity=3)
+        user = get_user_model().objects.create_user(email="shopper@example.com", full_name="Jane Doe",
+                                                    password="string")
+        self.client.force_authenticate(user=user)
+
+    def test_line_pricing_includes_discount_and_extras(self):
+        item = CartItem.objects.with_pricing().get()
+        self.assertEqual(item.unit_price, Decimal("97.50"))
+        self.assertEqual(item.line_total, Decimal("292.50"))
+        self.assertEqual(item.line_discount, Decimal("30.00"))
+
+    def test_pricing_rounds_the_same_in_the_database_and_in_python(self):
+        whole = create_product(title="Boots", price="95.00", percentage_off=15)
+        odd = create_product(title="Socks", price="19.99", percentage_off=15)
+        CartItem.objects.create(cart=self.cart, product=whole, quantity=2)
+        CartItem.objects.create(cart=self.cart, product=odd, quantity=3)
+
+        priced = {item.product_id: item for item in self.cart.items.with_pricing()}
+        self.assertEqual((priced[whole.id].unit_discount, priced[whole.id].unit_price), (Decimal("14.25"),
+                                                                                         Decimal("80.75")))
+        self.assertEqual((priced[odd.id].unit_discount, priced[odd.id].unit_price), (Decimal("3.00"),
+                                                                                     Decimal("16.99")))
+        self.assertEqual(priced[odd.id].line_total, Decimal("50.97"))
+
+        for item in CartItem.objects.filter(product__in=[whole, odd]).select_related("product"):
+            apply_pricing(item)
+            self.assertEqual((item.unit_price, item.line_total), (priced[item.product_id].unit_price,
+                                                                  priced[item.product_id].line_total))
+        self.assertEqual(self.cart.total_price(), Decimal("292.50") + Decimal("161.50") + Decimal("50.97"))
+
+    def test_cart_summary_is_a_single_query(self):
+        for index in range(200):
+            CartItem.objects.create(cart=self.cart, product=create_product(title=f"Shirt {index}", price="10.00"),
+                                    quantity=1)
+        with self.assertNumQueries(1):
+            summary = self.cart.items.price_summary()
+        self.assertEqual(summary["total"], Decimal("2292.50"))
+        self.assertEqual(summary["discount"], Decimal("30.00"))
+        self.assertEqual(summary["subtotal"], Decimal("2322.50"))
+        self.assertEqual(summary["item_count"], 203)
+        self.assertEqual(self.cart.total_price(), Decimal("2292.50"))
+
+    def test_cart_response_exposes_summary(self):
+        response = self.client.get(reverse("cart"), {"cart_id": str(self.cart.id)})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["data"][0]["total_price"], Decimal("292.50"))
+        self.assertEqual(response.data["summary"]["total"], Decimal("292.50"))
+
+    def test_add_item_response_is_priced(self):
+        response = self.client.post(reverse("cart"), {"cart_id": str(self.cart.id), "product_id": str(self.product.id),
+                                                      "size": "XL", "quantity": 1}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["data"]["quantity"], 4)
+        self.assertEqual(response.data["data"]["total_price"], Decimal("390.00"))
+
+
+class CartBatchTests(APITestCase):
+    def setUp(self):
+        self.products = [create_product(title=f"Sneaker {index}", price="20.00") for index in range(30)]
+        size = Size.objects.create(title="42")
+        SizeInventory.objects.create(product=self.products[0], size=size, quantity=5)
+        self.cart = Cart.objects.create()
+        CartItem.objects.create(cart=self.cart, product=self.products[0], quantity=1)
+        CartItem.objects.create(cart=self.cart, product=self.products[1], quantity=1)
+        user = get_user_model().objects.create_user(email="batch@example.com", full_name="Jane Doe",
+                                                    password="string")
+        self.client.force_authenticate(user=user)
+
+    def test_batch_applies_add_set_and_remove(self):
+        operations = [{"op": "add", "product_id": str(product.id), "quantity": 2} for product in self.products[2:]]
+        operations += [
+            {"op": "set", "product_id": str(self.products[0].id), "quantity": 5, "size": "42"},
+            {"op": "remove", "product_id": str(self.products[1].id)},
+        ]
+        with self.assertNumQueries(15):
+            response = self.client.post(reverse("cart_batch"), {"cart_id": str(self.cart.id),
+                                                                "operations": operations}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.cart.items.count(), 29)
+        first = self.cart.items.get(product=self.products[0])
+        self.assertEqual((first.quantity, first.size), (5, "42"))
+        self.assertEqual(response.data["summary"]["item_count"], 61)
+
+    def test_batch_is_rejected_as_a_whole_on_unknown_variant(self):
+        operations = [
+            {"op": "add", "product_id": str(self.products[2].id), "quantity": 1},
+            {"op": "add", "product_id": str(self.products[3].id), "quantity": 1, "size": "42"},
+        ]
+        response = self.client.post(reverse("cart_batch"), {"cart_id": str(self.cart.id), "operations": operations},
+                                    format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.cart.items.count(), 2)
+
+    def test_batch_rejects_missing_or_out_of_range_quantities(self):
+        product_id = str(self.products[0].id)
+        for operation in ({"op": "set", "product_id": product_id},
+                          {"op": "add", "product_id": product_id, "quantity": 0},
+                          {"op": "add", "product_id": product_id, "quantity": -1},
+                          {"op": "set", "product_id": product_id, "quantity": 32768}):
+            response = self.client.post(reverse("cart_batch"), {"cart_id": str(self.cart.id),
+                                                                "operations": [operation]}, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, operation)
+        self.assertEqual(self.cart.items.get(product=self.products[0]).quantity, 1)
+
+
+class InventoryReservationTests(TestCase):
+    def setUp(self):
+        self.product = create_product(inventory=10)
+        self.size_inventory = SizeInventory.objects.create(product=self.product, size=Size.objects.create(title="M"),
+                                                           quantity=4)
+
+    def test_reserve_decrements_product_and_variant_stock(self):
+        group = inventory.reserve([ReservationLine(self.product.id, 3, size="M")])
+        self.product.refresh_from_db()
+        self.size_inventory.refresh_from_db()
+        self.assertEqual((self.product.inventory, self.size_inventory.quantity), (7, 1))
+        self.assertTrue(inventory.commit(group))
+        self.assertEqual(inventory.release(group), 0)
+
+    def test_oversubscription_reserves_nothing(self):
+        other = create_product(title="Scarf", inventory=10)
+        with self.assertRaises(inventory.InsufficientStock):
+            inventory.reserve([ReservationLine(other.id, 2), ReservationLine(self.product.id, 5, size="M")])
+        other.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual((other.inventory, self.product.inventory), (10, 10))
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_unknown_product_is_rejected(self):
+        missing = uuid4()
+        with self.assertRaises(inventory.InsufficientStock) as raised:
+            inventory.reserve([ReservationLine(self.product.id, 1), ReservationLine(missing, 1)])
+        self.assertEqual(raised.exception.product_ids, {str(missing)})
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_release_puts_stock_back_once(self):
+        group = inventory.reserve([ReservationLine(self.product.id, 4, size="M")])
+        self.assertEqual(inventory.release(group), 1)
+        self.assertEqual(inventory.release(group), 0)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.inventory, 10)
+        self.assertFalse(inventory.commit(group))
+
+    def test_expired_reservations_are_released_when_stock_runs_out(self):
+        expired = inventory.reserve([ReservationLine(self.product.id, 8)], ttl=1)
+        StockReservation.objects.filter(group=expired).update(expires_at=timezone.now() - timezone.timedelta(1))
+        inventory.reserve([ReservationLine(self.product.id, 6)])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.inventory, 4)
+        self.assertEqual(StockReservation.objects.get(group=expired).status, RESERVATION_RELEASED)
+
+
+class CheckoutTests(APITestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email="checkout@example.com", full_name="Jane Doe",
+                                                         password="string")
+        self.client.force_authenticate(user=self.user)
+
+    def create_cart(self, size):
+        cart = Cart.objects.create()
+        for index in range(size):
+            product = create_product(title=f"Shirt {size}-{index}", price="19.99", inventory=10, percentage_off=10)
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+        return cart
+
+    def test_checkout_creates_priced_order_and_clears_cart(self):
+        cart = self.create_cart(2)
+        product = cart.items.first().product
+        response = self.client.post(reverse("checkout"), {"cart_id": str(cart.id)}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn("reserve;dur=", response["Server-Timing"])
+
+        order = Order.objects.get(id=response.data["data"]["id"])
+        self.assertEqual(order.customer_id, str(self.user.id))
+        self.assertEqual([item.unit_price for item in order.items.all()], [Decimal("17.99")] * 2)
+        self.assertEqual((order.total_price, order.item_count), (Decimal("71.96"), 4))
+        self.assertFalse(Cart.objects.filter(id=cart.id).exists())
+        product.refresh_from_db()
+        self.assertEqual(product.inventory, 8)
+
+        # Later price changes don't touch the order
+        Product.objects.filter(id=product.id).update(price="50.00")
+        self.assertEqual(order.items.get(product=product).unit_price, Decimal("17.99"))
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        counts = []
+        for size in (2, 25):
+            cart = self.create_cart(size)
+            with CaptureQueriesContext(connection) as queries:
+                checkout(cart.id, customer_id=self.user.id)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_insufficient_stock_changes_nothing(self):
+        cart = self.create_cart(2)
+        item = cart.items.first()
+        item.quantity = 11
+        item.save()
+        response = self.client.post(reverse("checkout"), {"cart_id": str(cart.id)}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["products"], [str(item.product_id)])
+        self.assertEqual(cart.items.count(), 2)
+        self.assertFalse(Order.objects.exists())
+
+    def test_missing_and_empty_carts_are_rejected(self):
+        response = self.client.post(reverse("checkout"), {"cart_id": str(uuid4())}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.post(reverse("checkout"), {"cart_id": str(Cart.objects.create().id)}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_completed_payment_commits_the_reservation(self):
+        order = checkout(self.create_cart(1).id, customer_id=self.user.id)
+        order = Order.objects.get(id=order.id)
+        order.payment_status = PAYMENT_COMPLETE
+        order.save()
+        self.assertEqual(StockReservation.objects.get(group=order.reservation_group).status, RESERVATION_COMMITTED)
+
+    def test_payment_after_the_reservation_lapsed_reserves_the_stock_again(self):
+        order = Order.objects.get(id=checkout(self.create_cart(1).id, customer_id=self.user.id).id)
+        lapsed_group = order.reservation_group
+        inventory.release_expired(now=timezone.now() + timezone.timedelta(days=1))
+
+        order.payment_status = PAYMENT_COMPLETE
+        order.save()
+        order.refresh_from_db()
+        self.assertNotEqual(order.reservation_group, lapsed_group)
+        self.assertEqual(StockReservation.objects.get(group=order.reservation_group).status, RESERVATION_COMMITTED)
+        self.assertEqual(order.items.get().product.inventory, 8)
+
+    def test_payment_after_the_stock_was_sold_flags_the_order(self):
+        order = Order.objects.get(id=checkout(self.create_cart(1).id, customer_id=self.user.id).id)
+        inventory.release_expired(now=timezone.now() + timezone.timedelta(days=1))
+        Product.objects.update(inventory=0)
+
+        order.payment_status = PAYMENT_COMPLETE
+        with self.assertLogs("store.signals", "ERROR"):
+            order.save()
+        order.refresh_from_db()
+        self.assertEqual(order.shipping_status, SHIPPING_STATUS_OUT_OF_STOCK)
+        self.assertFalse(StockReservation.objects.filter(status=RESERVATION_COMMITTED).exists())
+
+
+class OrderHistoryTests(APITestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email="history@example.com", full_name="Jane Doe",
+                                                         password="string")
+        self.client.force_authenticate(user=self.user)
+        self.product = create_product()
+
+    def create_orders(self, customer, count):
+        orders = [Order.objects.create(customer=customer, total_price="200.00", item_count=2) for _ in range(count)]
+        OrderItem.objects.bulk_create([OrderItem(order=order, customer=customer, product=self.product, quantity=2,
+                                                 unit_price="100.00") for order in orders])
+        return orders
+
+    def fetch(self, url, queries):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_pages_cover_every_order_once_at_a_constant_cost(self):
+        orders = self.create_orders(self.user, 45)
+        self.create_orders(get_user_model().objects.create_user(email="other@example.com", full_name="John Doe",
+                                                                password="string"), 3)
+        seen, url = [], reverse("order_history")
+        while url:
+            page = self.fetch(url, 2)
+            seen += [order["id"] for order in page["data"]]
+            url = page["next"]
+        self.assertEqual(sorted(seen), sorted(str(order.id) for order in orders))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_order_totals_and_items_are_included(self):
+        self.create_orders(self.user, 1)
+        order = self.fetch(reverse("order_history"), 2)["data"][0]
+        self.assertEqual((order["total_price"], order["item_count"]), (Decimal("200.00"), 2))
+        self.assertEqual(order["items"][0]["product_title"], self.product.title)
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.shirt = create_product(title="Shirt", category=Category.objects.create(title="Tops"))
+        self.jacket = create_product(title="Jacket")
+
+    def place_order(self, *lines):
+        order = Order.objects.create()
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=product, quantity=quantity, unit_price=price)
+                                       for product, quantity, price in lines])
+        return order
+
+    def pay(self, order, payment_status=PAYMENT_COMPLETE):
+        order.payment_status = payment_status
+        order.save()
+
+    def snapshot(self):
+        return sorted(
+                list(ProductSalesRollup.objects.values_list("period", "bucket", "product_id", "units", "revenue",
+                                                            "order_count"))
+                + list(CategorySalesRollup.objects.values_list("period", "bucket", "category_id", "units", "revenue",
+                                                               "order_count")), key=str)
+
+    def test_completed_payments_are_added_to_hourly_and_daily_rollups(self):
+        self.pay(self.place_order((self.shirt, 2, Decimal("10.50")), (self.jacket, 1, Decimal("99.99"))))
+        self.pay(self.place_order((self.shirt, 1, Decimal("10.50"))))
+        self.place_order((self.shirt, 5, Decimal("10.50")))
+
+        for period in (ROLLUP_HOURLY, ROLLUP_DAILY):
+            rollup = ProductSalesRollup.objects.get(period=period, product=self.shirt)
+            self.assertEqual((rollup.units, rollup.revenue, rollup.order_count), (3, Decimal("31.50"), 2))
+            rollup = CategorySalesRollup.objects.get(period=period, category=self.jacket.category)
+            self.assertEqual((rollup.units, rollup.revenue, rollup.order_count), (1, Decimal("99.99"), 1))
+
+    def test_orders_created_complete_are_recorded_once_their_items_are_in(self):
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            order = Order.objects.create(payment_status=PAYMENT_COMPLETE)
+            OrderItem.objects.create(order=order, product=self.shirt, quantity=2, unit_price=Decimal("10.50"))
+        rollup = ProductSalesRollup.objects.get(period=ROLLUP_DAILY, product=self.shirt)
+        self.assertEqual((rollup.units, rollup.revenue, rollup.order_count), (2, Decimal("21.00"), 1))
+
+    def test_bulk_status_changes_are_picked_up_by_a_rebuild(self):
+        self.place_order((self.shirt, 2, Decimal("10.50")))
+        Order.objects.update(payment_status=PAYMENT_COMPLETE)
+        self.assertFalse(ProductSalesRollup.objects.exists())
+        rollups.rebuild()
+        self.assertEqual(ProductSalesRollup.objects.get(period=ROLLUP_DAILY, product=self.shirt).units, 2)
+
+    def test_leaving_complete_takes_the_order_out_again(self):
+        order = self.place_order((self.shirt, 2, Decimal("10.50")))
+        self.pay(order)
+        self.pay(order, PAYMENT_FAILED)
+        self.assertEqual(ProductSalesRollup.objects.get(period=ROLLUP_DAILY).units, 0)
+
+    def test_recording_an_order_costs_the_same_however_many_items_it_has(self):
+        products = [create_product(title=f"Sock {index}") for index in range(20)]
+        counts = []
+        for lines in (products[:2], products):
+            order = self.place_order(*((product, 1, Decimal("5.00")) for product in lines))
+            with CaptureQueriesContext(connection) as queries:
+                rollups.record_order(order)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_rebuild_matches_incremental_rollups(self):
+        self.pay(self.place_order((self.shirt, 2, Decimal("10.50")), (self.jacket, 1, Decimal("99.99"))))
+        self.pay(self.place_order((self.jacket, 3, Decimal("80.00"))))
+        incremental = self.snapshot()
+        ProductSalesRollup.objects.update(units=0)
+        call_command("rebuild_sales_rollups", stdout=StringIO())
+        self.assertEqual(self.snapshot(), incremental)
+
+
+class CouponTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        user = get_user_model().objects.create_user(email="coupon@example.com", full_name="Jane Doe",
+                                                    password="string")
+        self.client.force_authenticate(user=user)
+        self.coupon = CouponCode.objects.create(price="15.00", expiry_date=timezone.now() + timezone.timedelta(days=1))
+
+    def test_active_coupons_are_checked_without_a_query(self):
+        shared = mock.patch("store.coupons.cache_is_shared", return_value=True)
+        shared.start()
+        self.addCleanup(shared.stop)
+        active_coupons.get(self.coupon.code)
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("coupon_check", args=[self.coupon.code.lower()]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["data"]["price"], Decimal("15.00"))
+
+    @mock.patch("store.coupons.cache_is_shared", return_value=True)
+    def test_coupon_changes_invalidate_the_index(self, shared):
+        self.assertEqual(active_coupons.get(self.coupon.code), Decimal("15.00"))
+        self.coupon.expiry_date = timezone.now() - timezone.timedelta(minutes=1)
+        self.coupon.save()
+        self.assertIsNone(active_coupons.get(self.coupon.code))
+        new = CouponCode.objects.create(price="5.00", expiry_date=timezone.now() + timezone.timedelta(days=1))
+        self.assertEqual(active_coupons.get(new.code), Decimal("5.00"))
+
+    def test_coupons_changed_by_another_process_are_seen_on_a_per_process_cache(self):
+        self.assertEqual(active_coupons.get(self.coupon.code), Decimal("15.00"))
+        # Saved by another process, whose version bump this process's LocMemCache never sees
+        with mock.patch("store.signals.invalidate_coupon_index"):
+            CouponCode.objects.filter(id=self.coupon.id).update(expired=True)
+            new = CouponCode.objects.create(price="5.00", expiry_date=timezone.now() + timezone.timedelta(days=1))
+        self.assertIsNone(active_coupons.get(self.coupon.code))
+        self.assertEqual(active_coupons.get(new.code), Decimal("5.00"))
+
+    def test_sweeper_expires_coupons_in_chunks(self):
+        past = timezone.now() - timezone.timedelta(days=1)
+        for _ in range(5):
+            CouponCode.objects.create(price="1.00", expiry_date=timezone.now() + timezone.timedelta(seconds=1))
+        CouponCode.objects.exclude(id=self.coupon.id).update(expiry_date=past)
+        self.assertEqual(expire_coupons(chunk_size=2), 5)
+        self.assertEqual(set(CouponCode.objects.filter(expired=False)), {self.coupon})
+
+    def test_generated_codes_skip_existing_and_repeated_candidates(self):
+        CouponCode.objects.create(code="AAAAAAAA", price="1.00", expiry_date=timezone.now())
+        draws = iter(["aaaaaaaa", "bbbbbbbb", "bbbbbbbb", "cccccccc", "dddddddd"])
+        with mock.patch("store.coupons.secrets.token_hex", side_effect=lambda size: next(draws)):
+            codes = generate_coupon_codes(3, Decimal("2.50"), timezone.now() + timezone.timedelta(days=7),
+                                          batch_size=2)
+        self.assertEqual(sorted(codes), ["BBBBBBBB", "CCCCCCCC", "DDDDDDDD"])
+        self.assertEqual(CouponCode.objects.filter(code__in=codes, price=Decimal("2.50")).count(), 3)
+        self.assertEqual(active_coupons.get("CCCCCCCC"), Decimal("2.50"))
+
+    def test_generate_endpoint_is_for_staff_only(self):
+        expiry_date = (timezone.now() + timezone.timedelta(days=1)).isoformat()
+        payload = {"count": 50, "price": "3.00", "expiry_date": expiry_date}
+        response = self.client.post(reverse("coupon_generate"), payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(user=get_user_model().objects.create_superuser(
+                email="admin@example.com", full_name="Jane Doe", password="string"))
+        response = self.client.post(reverse("coupon_generate"), payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(set(response.data["data"])), 50)
+
+
+class AdminChangelistTests(TestCase):
+    """
+    Every changelist has to render in the same number of queries however many rows are on the page.
+    """
+
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create_superuser(
+                email="admin@example.com", full_name="Jane Doe", password="string"))
+        self.country = Country.objects.create(name="Nigeria", code="NG")
+        self.rows = 0
+
+    def add_row(self, model):
+        self.rows += 1
+        n = self.rows
+        customer = get_user_model().objects.create_user(email=f"customer{n}@example.com",
+                                                        full_name=f"Customer {n}", password="string")
+        product = create_product(title=f"Product {n}", category=Category.objects.create(title=f"Category {n}"))
+        ProductReview.objects.create(customer=customer, product=product, ratings=n % 5 + 1, description="ok")
+        if model is FavoriteProduct:
+            FavoriteProduct.objects.create(customer=customer, product=product)
+        elif model is Order:
+            Order.objects.create(customer=customer, total_price="10.00", item_count=1)
+        elif model is StockReservation:
+            StockReservation.objects.create(group=uuid4(), product=product, quantity=1,
+                                            expires_at=timezone.now() + timezone.timedelta(minutes=5))
+        elif model is ProductSalesRollup:
+            ProductSalesRollup.objects.create(product=product, period=ROLLUP_DAILY, bucket=timezone.now(), units=1)
+        elif model is CategorySalesRollup:
+            CategorySalesRollup.objects.create(category=product.category, period=ROLLUP_DAILY,
+                                               bucket=timezone.now(), units=1)
+        elif model is Address:
+            Address.objects.create(customer=customer, country=self.country, first_name="Jane", last_name="Doe",
+                                   street_address="1 Main Street", city="Lagos", state="Lagos", zip_code="100001",
+                                   phone_number="+2348012345678")
+
+    def count_queries(self, model):
+        url = reverse(f"admin:store_{model._meta.model_name}_changelist")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries)
+
+    def test_changelists_render_in_a_constant_number_of_queries(self):
+        for model in (Product, Category, FavoriteProduct, ProductReview, Order, StockReservation, ProductSalesRollup,
+                      CategorySalesRollup, Address):
+            with self.subTest(model=model.__name__):
+                self.add_row(model)
+                budget = self.count_queries(model)
+                for _ in range(3):
+                    self.add_row(model)
+                self.assertEqual(self.count_queries(model), budget)
+
+    def test_product_changelist_shows_the_average_rating(self):
+        product = create_product()
+        customers = [get_user_model().objects.create_user(email=f"reviewer{n}@example.com", full_name="Reviewer",
+                                                          password="string") for n in range(2)]
+        for customer, ratings in zip(customers, (2, 5)):
+            ProductReview.objects.create(customer=customer, product=product, ratings=ratings, description="ok")
+
+        response = self.client.get(reverse("admin:store_product_changelist"))
+        self.assertEqual(response.context["cl"].result_list.get(pk=product.pk).ratings_avg, 3.5)
+
+        response = self.client.get(reverse("admin:store_product_changelist"), {"inventory": "<20"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@override_settings(ADMIN_EXACT_COUNT_LIMIT=2)
+class EstimatedCountPaginatorTests(TestCase):
+    def setUp(self):
+        for _ in range(3):
+            Order.objects.create()
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        # Rows added since the statistics were gathered aren't in the estimate
+        Order.objects.create()
+
+    def test_large_unfiltered_tables_are_estimated(self):
+        paginator = EstimatedCountPaginator(Order.objects.all(), 2)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(paginator.count, 3)
+        self.assertFalse(any("COUNT(" in query["sql"].upper() for query in queries))
+        self.assertEqual(len(paginator.page(2).object_list), 2)
+
+    def test_filtered_and_small_tables_are_counted(self):
+        self.assertEqual(EstimatedCountPaginator(Order.objects.filter(item_count=0), 2).count, 4)
+        with override_settings(ADMIN_EXACT_COUNT_LIMIT=3):
+            self.assertEqual(EstimatedCountPaginator(Order.objects.all(), 2).count, 4)
+        self.assertEqual(EstimatedCountPaginator(Notification.objects.all(), 2).count, 0)
+
+    def test_tables_without_statistics_are_counted(self):
+        self.assertEqual(EstimatedCountPaginator(Cart.objects.all(), 2).count, 0)
+
+    def test_order_changelist_uses_the_estimate(self):
+        self.client.force_login(get_user_model().objects.create_superuser(
+                email="admin@example.com", full_name="Jane Doe", password="string"))
+        response = self.client.get(reverse("admin:store_order_changelist"))
+        self.assertEqual(response.context["cl"].result_count, 3)
+        self.assertIsNone(response.context["cl"].full_result_count)
+
+
+class InventoryReservationStressTests(TransactionTestCase):
+    """
+    Runs the row-locking path on backends that have it and the conditional UPDATE alone on SQLite, whose
+    file-backed test database makes concurrent writers wait on, or fail to take, the database lock.
+    """
+    threads = 16
+    attempts_per_thread = 10
+    max_retries = 50
+
+    def test_concurrent_reservations_never_oversell(self):
+        stock = 25
+        product = create_product(inventory=stock)
+        size_inventory = SizeInventory.objects.create(product=product, size=Size.objects.create(title="L"),
+                                                      quantity=stock)
+        results = {"reserved": 0, "rejected": 0, "failed": 0}
+        lock = threading.Lock()
+        start = threading.Barrier(self.threads)
+
+        def worker():
+            start.wait()
+            try:
+                for _ in range(self.attempts_per_thread):
+                    outcome = "failed"
+                    for attempt in range(self.max_retries):
+                        try:
+                            inventory.reserve([ReservationLine(product.id, 1, size="L")])
+                            outcome = "reserved"
+                        except inventory.InsufficientStock:
+                            outcome = "rejected"
+                        except OperationalError:
+                            # Deadlock, serialization failure or, on SQLite, a writer that couldn't take the
+                            # database lock; back off and try again
+                            time.sleep(random.uniform(0.001, 0.02) * (attempt + 1))
+                            continue
+                        break
+                    with lock:
+                        results[outcome] += 1
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        product.refresh_from_db()
+        size_inventory.refresh_from_db()
+        self.assertEqual(results["failed"], 0)
+        self.assertEqual(results["reserved"], stock)
+        self.assertEqual(results["rejected"], self.threads * self.attempts_per_thread - stock)
+        self.assertEqual((product.inventory, size_inventory.quantity), (0, 0))
+        self.assertEqual(StockReservation.objects.count(), stock)
@@ -7,6 +7,11 @@ urlpatterns = [
     path("product-reviews/add/", views.AddProductReviewView.as_view(), name="add_product_review"),
     path("categories/", views.CategoryListView.as_view(), name="category_list"),
     path("cart/items/", views.CartItemView.as_view(), name="cart"),
+    path("cart/items/batch/", views.CartItemBatchView.as_view(), name="cart_batch"),
+    path("checkout/", views.CheckoutView.as_view(), name="checkout"),
+    path("orders/", views.OrderHistoryView.as_view(), name="order_history"),
+    path("coupons/generate/", views.GenerateCouponCodesView.as_view(), name="coupon_generate"),
+    path("coupons/<str:code>/", views.CouponCheckView.as_view(), name="coupon_check"),
     path("favorite-products/", views.FavoriteProductsView.as_view(), name="favorite_products"),
     path("notifications/", views.NotificationView.as_view(), name="notifications"),
     path("products/<str:product_id>/", views.ProductDetailView.as_view(), name="product_detail"),
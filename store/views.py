@@ -1,18 +1,25 @@
-from django.db.models import Q
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Prefetch, Q
 from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status
 from rest_framework.filters import SearchFilter
 from rest_framework.generics import GenericAPIView, ListAPIView
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 
+from store.cart_storage import get_cart_storage
+from store.checkout import EmptyCart, checkout
+from store.coupons import active_coupons
 from store.choices import GENDER_FEMALE, GENDER_MALE
 from store.filters import ProductFilter
-from store.models import Cart, Category, FavoriteProduct, Notification, Product, ProductReview, ProductReviewImage
-from store.serializers import AddCartItemSerializer, AddProductReviewSerializer, CartItemSerializer, \
-    DeleteCartItemSerializer, ProductDetailSerializer, \
-    ProductReviewSerializer, \
+from store.inventory import InsufficientStock
+from store.models import Cart, Category, FavoriteProduct, Notification, Order, OrderItem, Product, ProductReview, \
+    ProductReviewImage
+from store.pagination import OrderHistoryPagination
+from store.serializers import AddCartItemSerializer, AddProductReviewSerializer, BatchCartItemSerializer, \
+    CartItemSerializer, CartSummarySerializer, CheckoutSerializer, DeleteCartItemSerializer, \
+    GenerateCouponCodesSerializer, OrderSerializer, ProductDetailSerializer, ProductReviewSerializer, \
     ProductSerializer, UpdateCartItemSerializer
 
 
@@ -46,7 +53,7 @@ class FavoriteProductsView(GenericAPIView):
         user = request.user
         if user is None:
             return Response({"message": "User does not exist", "status": "failed"}, status=status.HTTP_400_BAD_REQUEST)
-        favorite_products = FavoriteProduct.objects.filter(customer=user)
+        favorite_products = FavoriteProduct.objects.filter(customer_id=user.id)
 
         data = [
             {
@@ -86,7 +93,7 @@ class FavoriteProductsView(GenericAPIView):
             return Response({"message": "Invalid product id", "status": "failed"},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        favorite, created = FavoriteProduct.objects.get_or_create(customer=user, product=product)
+        favorite, created = FavoriteProduct.objects.get_or_create(customer_id=user.id, product=product)
 
         if created:
             return Response({"message": "Product added to favorites", "status": "success"},
@@ -107,7 +114,7 @@ class FavoriteProductsView(GenericAPIView):
             return Response({"message": "Invalid product id", "status": "failed"},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        FavoriteProduct.objects.filter(customer=user, product=product).delete()
+        FavoriteProduct.objects.filter(customer_id=user.id, product=product).delete()
         return Response({"message": "Product removed from favorite list", "status": "succeed"},
                         status=status.HTTP_200_OK)
 
@@ -153,7 +160,7 @@ class AddProductReviewView(GenericAPIView):
         images = request.FILES.getlist('images')
         if len(images) > 3:
             return Response({"message": "The maximum number of allowed images is 3"})
-        product_review = ProductReview.objects.create(customer=user, product=product, **data)
+        product_review = ProductReview.objects.create(customer_id=user.id, product=product, **data)
         for image in images:
             ProductReviewImage.objects.create(product_review=product_review, image=image)
         return Response({"message": "Review created successfully", "status": "succeed"}, status.HTTP_201_CREATED)
@@ -167,7 +174,7 @@ class NotificationView(GenericAPIView):
         if user.is_staff:
             notifications = Notification.objects.all().values('notification_type', 'title', 'description', 'created')
         else:
-            notifications = Notification.objects.filter(Q(customers__in=[user]) | Q(general=True)).values(
+            notifications = Notification.objects.filter(Q(customers=user.id) | Q(general=True)).values(
                     'notification_type', 'title', 'customers', 'description', 'created')
         return Response({"message": "Notifications sent", "data": notifications, "status": "succeed"},
                         status.HTTP_200_OK)
@@ -209,13 +216,15 @@ class CartItemView(GenericAPIView):
         if not cart_id:
             return Response({"message": "Cart ID not provided."}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            cart = Cart.objects.get(id=cart_id)
-        except Cart.DoesNotExist:
+            items = get_cart_storage().get_items(cart_id)
+        except (Cart.DoesNotExist, DjangoValidationError):
             return Response({"message": "Cart not found", "status": "failed"},
                             status=status.HTTP_404_NOT_FOUND)
-        serializer = CartItemSerializer(cart.items.all(), many=True)
-        return Response({"message": "Cart Items fetched successfully", "data": serializer.data, "status": "succeed"},
-                        status=status.HTTP_200_OK)
+        items = list(items)
+        serializer = CartItemSerializer(items, many=True)
+        summary = CartSummarySerializer(get_cart_storage().price_summary(items))
+        return Response({"message": "Cart Items fetched successfully", "data": serializer.data,
+                         "summary": summary.data, "status": "succeed"}, status=status.HTTP_200_OK)
 
     def post(self, request):
         serializer = self.get_serializer(data=request.data)
@@ -244,4 +253,87 @@ class CartItemView(GenericAPIView):
         serializer.is_valid(raise_exception=True)
         serializer.save()
         return Response({"message": "Item deleted successfully.", "status": "succeed"},
-                        status=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+                        status=status.HTTP_204_NO_CONTENT)
+
+
+class CartItemBatchView(GenericAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = BatchCartItemSerializer
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        storage = get_cart_storage()
+        cart_id = serializer.save()
+
+        items = list(storage.get_items(cart_id))
+        return Response({"message": "Cart updated successfully", "cart_id": cart_id,
+                         "data": CartItemSerializer(items, many=True).data,
+                         "summary": CartSummarySerializer(storage.price_summary(items)).data, "status": "succeed"},
+                        status=status.HTTP_200_OK)
+
+
+class CheckoutView(GenericAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = CheckoutSerializer
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            order = checkout(serializer.validated_data['cart_id'], customer_id=request.user.id)
+        except Cart.DoesNotExist:
+            return Response({"message": "Cart not found", "status": "failed"}, status=status.HTTP_404_NOT_FOUND)
+        except EmptyCart:
+            return Response({"message": "Cart is empty", "status": "failed"}, status=status.HTTP_400_BAD_REQUEST)
+        except InsufficientStock as error:
+            return Response({"message": "Some items are out of stock", "products": sorted(error.product_ids),
+                             "status": "failed"}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = Response({"message": "Order placed successfully", "data": OrderSerializer(order).data,
+                             "status": "succeed"}, status=status.HTTP_201_CREATED)
+        response["Server-Timing"] = ", ".join(f"{stage};dur={elapsed:.1f}" for stage, elapsed in order.timings.items())
+        return response
+
+
+class OrderHistoryView(ListAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = OrderSerializer
+    pagination_class = OrderHistoryPagination
+    filter_backends = []
+
+    def get_queryset(self):
+        return Order.objects.filter(customer_id=self.request.user.id).prefetch_related(
+                Prefetch('items', queryset=OrderItem.objects.select_related('product').only(
+                        'order_id', 'product_id', 'product__title', 'quantity', 'unit_price', 'size', 'colour')))
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer(page, many=True)
+        return Response({"message": "Orders fetched successfully", "data": serializer.data,
+                         "next": self.paginator.get_next_link(), "previous": self.paginator.get_previous_link(),
+                         "status": "succeed"}, status=status.HTTP_200_OK)
+
+
+class CouponCheckView(GenericAPIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, code):
+        price = active_coupons.get(code)
+        if price is None:
+            return Response({"message": "Invalid or expired coupon code", "status": "failed"},
+                            status=status.HTTP_404_NOT_FOUND)
+        return Response({"message": "Coupon code is valid", "data": {"code": code.upper(), "price": price},
+                         "status": "succeed"}, status=status.HTTP_200_OK)
+
+
+class GenerateCouponCodesView(GenericAPIView):
+    permission_classes = [IsAdminUser]
+    serializer_class = GenerateCouponCodesSerializer
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        codes = serializer.save()
+        return Response({"message": f"{len(codes)} coupon codes generated", "data": codes, "status": "succeed"},
+                        status=status.HTTP_201_CREATED)